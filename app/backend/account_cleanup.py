@@ -0,0 +1,147 @@
+# deletes unverified accounts whose verification link expired
+#
+# runs hourly from the scheduler (app.py), from /auth/cleanup-unverified and from
+# `flask --app app accounts cleanup-expired`. each chunk locks at most
+# ACCOUNT_CLEANUP_CHUNK expired users (SKIP LOCKED, a user verifying right now is
+# left alone), removes everything referencing them with cascade.delete_users
+# and commits. a transaction lasts one chunk rather than the whole sweep, so
+# registrations and logins never queue behind it
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from flask import Blueprint
+from app import get_db_connection
+from cascade import delete_users
+from catalog_index import catalog
+from user_cache import invalidate_user
+
+logger = logging.getLogger(__name__)
+
+account_cleanup_bp = Blueprint('accounts', __name__)
+
+CHUNK_SIZE = int(os.getenv('ACCOUNT_CLEANUP_CHUNK', 200))
+# seconds between chunks, lets other transactions in between
+CHUNK_PAUSE = float(os.getenv('ACCOUNT_CLEANUP_PAUSE', 0.1))
+# an account has this long from registration to verify, asking for a new link
+# doesn't extend it
+EXPIRE_HOURS = 24
+
+# per worker progress for /admin/account-cleanup
+_stats = {'runs': 0, 'chunks': 0, 'users_deleted': 0, 'running': False,
+          'last_run_at': None, 'last_run_ms': None, 'last_deleted': 0, 'last_error': None}
+_stats_lock = threading.Lock()
+
+
+def delete_chunk(conn, chunk_size=CHUNK_SIZE, before_delete=None):
+    """Delete one chunk of expired accounts in its own transaction
+
+    before_delete(cursor, users) runs inside the transaction, e.g. to log an
+    admin action. Returns the deleted users as dicts.
+    """
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("START TRANSACTION")
+        cursor.execute("""
+            SELECT user_id, username, email
+            FROM users
+            WHERE verification_status = 'unverified'
+            AND date_joined < NOW() - INTERVAL %s HOUR
+            ORDER BY user_id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (EXPIRE_HOURS, chunk_size))
+        users = cursor.fetchall()
+        if not users:
+            conn.commit()
+            return [], []
+
+        user_ids = [u['user_id'] for u in users]
+        if before_delete:
+            before_delete(cursor, users)
+        # expired accounts are never worth keeping, always a hard delete
+        product_ids = delete_users(cursor, user_ids)['products']
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    for user_id in user_ids:
+        invalidate_user(user_id)
+    return users, product_ids
+
+
+def cleanup_expired_accounts(conn, chunk_size=CHUNK_SIZE, max_chunks=None, before_delete=None):
+    """Delete expired unverified accounts chunk by chunk, returns the deleted users"""
+    deleted = []
+    started = time.monotonic()
+    with _stats_lock:
+        _stats['running'] = True
+    try:
+        chunks = 0
+        while max_chunks is None or chunks < max_chunks:
+            users, product_ids = delete_chunk(conn, chunk_size, before_delete)
+            if not users:
+                break
+            chunks += 1
+            deleted += users
+            if product_ids:
+                try:
+                    catalog.refresh_products(conn, product_ids)
+                except Exception as e:
+                    logger.error(f"Catalog refresh after account cleanup failed: {e}")
+            with _stats_lock:
+                _stats['chunks'] += 1
+                _stats['users_deleted'] += len(users)
+            logger.info(f"Account cleanup chunk {chunks}: deleted {len(users)} expired accounts")
+            if len(users) < chunk_size:
+                break
+            time.sleep(CHUNK_PAUSE)
+        error = None
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        with _stats_lock:
+            _stats.update(running=False, last_run_at=datetime.now().isoformat(),
+                          last_run_ms=round((time.monotonic() - started) * 1000),
+                          last_deleted=len(deleted), last_error=error)
+            _stats['runs'] += 1
+    return deleted
+
+
+def cleanup_job():
+    """Scheduler entry point, owns its connection"""
+    conn = get_db_connection()
+    if conn is None:
+        return
+    try:
+        deleted = cleanup_expired_accounts(conn)
+        if deleted:
+            logger.info(f"Account cleanup deleted {len(deleted)} expired accounts")
+    except Exception as e:
+        logger.error(f"Account cleanup failed: {e}")
+    finally:
+        conn.close()
+
+
+def cleanup_stats():
+    with _stats_lock:
+        return dict(_stats, chunk_size=CHUNK_SIZE)
+
+
+# usage: flask --app app accounts cleanup-expired
+@account_cleanup_bp.cli.command('cleanup-expired')
+def cleanup_expired():
+    conn = get_db_connection()
+    try:
+        deleted = cleanup_expired_accounts(conn)
+        print(f"Deleted {len(deleted)} expired unverified accounts")
+    except Exception as e:
+        print(f"Error cleaning up expired accounts: {e}")
+    finally:
+        conn.close()
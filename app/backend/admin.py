@@ -1,6 +1,15 @@
 from flask import Blueprint, jsonify, request
 from auth import token_required, admin_required
-from app import get_db_connection
+from app import get_db_connection, get_db_pool
+from user_cache import user_cache
+from password_hashing import password_hasher
+from email_outbox import outbox_stats
+from account_cleanup import cleanup_stats
+from cascade import cascade_stats
+from image_derivatives import derivative_stats
+from image_store import store_stats
+from catalog_index import catalog, record_product_change, product_changed
+from response_cache import response_cache, product_scope, invalidate_product
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
@@ -54,8 +63,11 @@ def moderate_product(current_user, product_id):
         f"product_{product_id}",
         f"Product {product_id} {data['status']}"
     ))
+    record_product_change(cursor, product_id)
     
     conn.commit()
+    product_changed(conn, product_id)
+    invalidate_product(product_id, product_scope(conn, product_id))
     cursor.close()
     conn.close()
     
@@ -172,4 +184,80 @@ def get_dashboard_stats(current_user):
     cursor.close()
     conn.close()
     
-    return jsonify(stats)
\ No newline at end of file
+    return jsonify(stats)
+
+# Connection pool statistics for this worker
+@admin_bp.route('/db-pool', methods=['GET'])
+@admin_required
+def get_db_pool_stats(current_user):
+    return jsonify(get_db_pool().stats())
+
+# bcrypt pool load, rejections and latency for this worker
+@admin_bp.route('/password-hashing', methods=['GET'])
+@admin_required
+def get_password_hashing_stats(current_user):
+    return jsonify(password_hasher.stats())
+
+# Outbox backlog by status and this worker's sender counters
+@admin_bp.route('/email-outbox', methods=['GET'])
+@admin_required
+def get_email_outbox(current_user):
+    conn = get_db_connection()
+    return jsonify(outbox_stats(conn))
+
+# Dead-lettered mails, newest first
+@admin_bp.route('/email-outbox/dead', methods=['GET'])
+@admin_required
+def get_dead_emails(current_user):
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("""
+        SELECT email_id, to_email, subject, attempts, last_error, created_at
+        FROM email_outbox
+        WHERE status = 'dead'
+        ORDER BY email_id DESC
+        LIMIT 100
+    """)
+    emails = cursor.fetchall()
+    cursor.close()
+    return jsonify(emails)
+
+# Put a dead-lettered mail back in the queue, e.g. after fixing the SES setup
+@admin_bp.route('/email-outbox/<int:email_id>/retry', methods=['POST'])
+@admin_required
+def retry_email(current_user, email_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE email_outbox
+        SET status = 'pending', attempts = 0, next_attempt_at = NOW(), last_error = NULL
+        WHERE email_id = %s AND status = 'dead'
+    """, (email_id,))
+    requeued = cursor.rowcount
+    conn.commit()
+    cursor.close()
+    if not requeued:
+        return jsonify({'error': 'No dead email with that id'}), 404
+    return jsonify({'message': 'Email queued for another attempt'})
+
+# Progress of this worker's expired account cleanup
+@admin_bp.route('/account-cleanup', methods=['GET'])
+@admin_required
+def get_account_cleanup_stats(current_user):
+    return jsonify(dict(cleanup_stats(), purge=cascade_stats()))
+
+# Resized image copies, deduplicated uploads and image GC runs of this worker
+@admin_bp.route('/image-derivatives', methods=['GET'])
+@admin_required
+def get_image_derivative_stats(current_user):
+    return jsonify(dict(derivative_stats(), store=store_stats()))
+
+# Hit/miss counters for this worker's caches
+@admin_bp.route('/cache-stats', methods=['GET'])
+@admin_required
+def get_cache_stats(current_user):
+    return jsonify({
+        'user_cache': user_cache.stats(),
+        'catalog_index': catalog.stats(),
+        'response_cache': response_cache.stats(),
+    })
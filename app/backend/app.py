@@ -5,8 +5,9 @@ from flask import send_from_directory
 from dotenv import load_dotenv
 import mysql.connector
 import os
+import threading
 from flask_apscheduler import APScheduler
-from flask import jsonify
+from flask import jsonify, g, has_request_context
 
 # Load environment variables from .env file
 load_dotenv()
@@ -33,19 +34,93 @@ from flask_jwt_extended import JWTManager
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET', 'your-secret-key')
 jwt = JWTManager(app)
 
-# helper function to create MySQL db connection using creds from .env
+# background jobs (email outbox, account cleanup), each gunicorn worker runs its own
+# scheduler, the jobs coordinate through the database so running them twice is safe
+scheduler = APScheduler()
+
+# serve public product reads from the in memory catalog index (catalog_index.py)
+app.config['CATALOG_INDEX_ENABLED'] = os.getenv('CATALOG_INDEX_ENABLED', 'true').lower() == 'true'
+# cache serialized product GET responses (response_cache.py)
+app.config['RESPONSE_CACHE_ENABLED'] = os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+
+# shared connection pool, created lazily so importing the app never touches MySQL
+# sized through env vars, workers x (size + overflow) stays below MYSQL_MAX_CONNECTIONS
+# with a couple of connections spare for CLI commands and overlapping restarts
+from db_pool import ConnectionPool, RequestConnection
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+# True inside a gevent worker (GUNICORN_WORKER_CLASS=gevent), where the socket
+# module has been monkey patched and blocking C calls stall every request
+def green_sockets():
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('socket')
+
+def get_db_pool():
+    global _db_pool
+    if _db_pool is None:
+        with _db_pool_lock:
+            if _db_pool is None:
+                _db_pool = ConnectionPool(
+                    {
+                        'host': os.getenv('MYSQL_HOST'),
+                        'user': os.getenv('MYSQL_USER'),
+                        'password': os.getenv('MYSQL_PASSWORD'),
+                        'database': os.getenv('MYSQL_DATABASE'),
+                        # the C extension blocks the whole gevent hub on every query,
+                        # the pure python driver talks through the patched socket module
+                        'use_pure': green_sockets(),
+                    },
+                    size=int(os.getenv('DB_POOL_SIZE', 3)),
+                    max_overflow=int(os.getenv('DB_POOL_MAX_OVERFLOW', 1)),
+                    timeout=float(os.getenv('DB_POOL_TIMEOUT', 10)),
+                    recycle=int(os.getenv('DB_POOL_RECYCLE', 1800)),
+                    pre_ping=os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true',
+                )
+    return _db_pool
+
+# helper function to borrow a MySQL db connection from the pool
+# inside a request every caller (token_required, the view) shares one connection
+# that is returned by the teardown hook below, so conn.close() is safe to skip
+# outside a request (scheduler jobs, cli) the caller owns the connection and must close it
 def get_db_connection():
+    if has_request_context():
+        conn = g.get('_db_conn')
+        if conn is not None:
+            return conn
     try:
-        return mysql.connector.connect(
-            host=os.getenv('MYSQL_HOST'),  
-            user=os.getenv('MYSQL_USER'),
-            password=os.getenv('MYSQL_PASSWORD'),
-            database=os.getenv('MYSQL_DATABASE')
-        )
+        conn = get_db_pool().connect()
     except mysql.connector.Error as err:
-        # debug statement: print error if connection fails
+        # debug statement: print error if connection fails or the pool is exhausted
         print(f"Database connection error: {err}")
         return None
+    if has_request_context():
+        conn = g._db_conn = RequestConnection(conn)
+    return conn
+
+# hand the request's connection back early, e.g. before slow disk or network work
+# later get_db_connection calls in the same request borrow a fresh one
+def release_db_connection(commit=True):
+    conn = g.pop('_db_conn', None)
+    if conn is not None:
+        try:
+            conn.release(commit)
+        except mysql.connector.Error as err:
+            print(f"Database release error: {err}")
+
+# anything that ended in an error response is rolled back instead of committed
+@app.after_request
+def mark_failed_request(response):
+    if response.status_code >= 400:
+        g._db_failed = True
+    return response
+
+@app.teardown_request
+def teardown_db_connection(exc):
+    release_db_connection(commit=exc is None and not g.pop('_db_failed', False))
 
 # Register product routes
 from products import products_bp
@@ -95,6 +170,40 @@ app.register_blueprint(wishlist_bp)
 from report import report_bp
 app.register_blueprint(report_bp)
 
+# delivers queued email in the background
+from email_outbox import email_outbox_bp, schedule_jobs
+app.register_blueprint(email_outbox_bp)
+
+# removes unverified accounts whose verification link expired
+from account_cleanup import account_cleanup_bp, cleanup_job
+app.register_blueprint(account_cleanup_bp)
+
+# content addressed image files no listing references are collected daily
+from image_store import image_store_bp, gc_job, UploadRequest
+app.register_blueprint(image_store_bp)
+# uploaded files stream into the image store, IMAGE_MAX_BYTES each
+app.request_class = UploadRequest
+
+# soft deleted listings and accounts are purged in the background (cascade.py)
+from cascade import SOFT_DELETE, purge_job
+
+# the catalog index's change log is pruned hourly on the scheduler's own connection
+from catalog_index import prune_changes_job
+
+if os.getenv('SCHEDULER_ENABLED', 'true').lower() == 'true':
+    scheduler.init_app(app)
+    schedule_jobs(scheduler)
+    scheduler.add_job(id='account_cleanup', func=cleanup_job, trigger='interval',
+                      minutes=int(os.getenv('ACCOUNT_CLEANUP_INTERVAL', 60)), max_instances=1, coalesce=True)
+    scheduler.add_job(id='image_gc', func=gc_job, trigger='interval',
+                      hours=int(os.getenv('IMAGE_GC_INTERVAL', 24)), max_instances=1, coalesce=True)
+    scheduler.add_job(id='catalog_prune', func=prune_changes_job, trigger='interval',
+                      hours=1, max_instances=1, coalesce=True)
+    if SOFT_DELETE:
+        scheduler.add_job(id='purge_deleted', func=purge_job, trigger='interval',
+                          minutes=5, max_instances=1, coalesce=True)
+    scheduler.start()
+
 # main entry point to run app during local development
 # served with gunicorn + nginx during production
 if __name__ == '__main__':
@@ -1,11 +1,14 @@
 from flask import Blueprint, jsonify, request
-import bcrypt
 import jwt
 import datetime
 from functools import wraps
 import os
 import uuid
-from app import get_db_connection
+from app import get_db_connection, release_db_connection
+from password_hashing import password_hasher, PasswordPoolBusy, too_busy
+from user_cache import user_cache, invalidate_user
+from account_cleanup import cleanup_expired_accounts
+from conditional import conditional_json
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
 
@@ -24,6 +27,20 @@ def generate_token(user_id, username, user_role):
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
+# EventSource can't set headers, so event streams authenticate with ?ticket=
+# a ticket only opens streams and expires quickly, a logged stream URL is no login
+STREAM_TICKET_SECONDS = 60
+
+def generate_stream_ticket(user_id):
+    """Generate a short lived JWT that only opens event streams"""
+    payload = {
+        'exp': datetime.datetime.utcnow() + datetime.timedelta(seconds=STREAM_TICKET_SECONDS),
+        'iat': datetime.datetime.utcnow(),
+        'sub': user_id,
+        'scope': 'stream'
+    }
+    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+
 def token_required(f):
     """Decorator to require valid JWT token"""
     @wraps(f)
@@ -39,20 +56,32 @@ def token_required(f):
             except IndexError:
                 return jsonify({'error': 'Bearer token malformed', 'code': 'INVALID_TOKEN'}), 401
         
+        # event streams pass a stream ticket instead, never the login token
+        from_ticket = False
+        if not token and request.accept_mimetypes.best == 'text/event-stream':
+            token = request.args.get('ticket')
+            from_ticket = token is not None
+
         if not token:
             return jsonify({'error': 'Token is missing', 'code': 'NO_TOKEN'}), 401
         
         try:
             # Decode the token
             data = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+            if data.get('scope') != ('stream' if from_ticket else None):
+                return jsonify({'error': 'Invalid token: wrong scope', 'code': 'INVALID_TOKEN'}), 401
             
-            # Get user from database
-            conn = get_db_connection()
-            cursor = conn.cursor(dictionary=True)
-            cursor.execute("SELECT * FROM users WHERE user_id = %s", (data['sub'],))
-            current_user = cursor.fetchone()
-            cursor.close()
-            conn.close()
+            # Get user from the cache, or from the database on a miss
+            # the connection stays open for the view to reuse
+            current_user = user_cache.get(int(data['sub']))
+            if current_user is None:
+                conn = get_db_connection()
+                cursor = conn.cursor(dictionary=True)
+                cursor.execute("SELECT * FROM users WHERE user_id = %s", (data['sub'],))
+                current_user = cursor.fetchone()
+                cursor.close()
+                if current_user:
+                    user_cache.set(int(data['sub']), current_user)
             
             if not current_user:
                 return jsonify({'error': 'User not found', 'code': 'USER_NOT_FOUND'}), 401
@@ -125,7 +154,10 @@ def register():
             return jsonify({'errors': validation_errors}), 400
         
         # Hash password
-        password_hash = bcrypt.hashpw(data['password'].encode('utf-8'), bcrypt.gensalt())
+        try:
+            password_hash = password_hasher.hash(data['password'])
+        except PasswordPoolBusy as e:
+            return too_busy(e)
         
         conn = get_db_connection()
         cursor = conn.cursor()
@@ -136,7 +168,7 @@ def register():
                 VALUES (%s, %s, %s, %s, %s)
             """, (
                 data['username'],
-                password_hash.decode('utf-8'),
+                password_hash,
                 data['email'],
                 data['first_name'],
                 data['last_name']
@@ -193,9 +225,16 @@ def login():
             if user.get('account_status') != 'active':
                 return jsonify({'error': 'Account is not active'}), 401
             
+            # the connection isn't needed while bcrypt runs, return it to the pool
+            cursor.close()
+            release_db_connection()
+
             # Verify password
-            if not bcrypt.checkpw(data['password'].encode('utf-8'), user['password_hash'].encode('utf-8')):
-                return jsonify({'error': 'Invalid credentials'}), 401
+            try:
+                if not password_hasher.check(data['password'], user['password_hash']):
+                    return jsonify({'error': 'Invalid credentials'}), 401
+            except PasswordPoolBusy as e:
+                return too_busy(e)
             
             # Check verification status AFTER password verification
             # This ensures we don't reveal if an account exists when providing verification errors
@@ -205,14 +244,32 @@ def login():
                     'unverified_email': user['email']
                 }), 403
             
+            # upgrade hashes made with an old BCRYPT_ROUNDS while we have the password,
+            # a busy pool just leaves it for the next login
+            new_hash = None
+            if password_hasher.needs_rehash(user['password_hash']):
+                try:
+                    new_hash = password_hasher.hash(data['password'])
+                except PasswordPoolBusy:
+                    pass
+
             # Update last login
+            conn = get_db_connection()
             update_cursor = conn.cursor()
-            update_cursor.execute(
-                "UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE user_id = %s", 
-                (user['user_id'],)
-            )
+            if new_hash:
+                update_cursor.execute(
+                    "UPDATE users SET last_login = CURRENT_TIMESTAMP, password_hash = %s WHERE user_id = %s",
+                    (new_hash, user['user_id'])
+                )
+                password_hasher.record_rehash()
+            else:
+                update_cursor.execute(
+                    "UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE user_id = %s", 
+                    (user['user_id'],)
+                )
             conn.commit()
             update_cursor.close()
+            invalidate_user(user['user_id'])
             
             # Generate token
             token = generate_token(user['user_id'], user['username'], user['user_role'])
@@ -396,6 +453,7 @@ def update_user_role(current_user, user_id):
     conn.commit()
     cursor.close()
     conn.close()
+    invalidate_user(user_id)
     return jsonify({'message': 'User role updated successfully'})
 
 @auth_bp.route('/users/<int:user_id>/status', methods=['PUT'])
@@ -414,9 +472,12 @@ def update_user_status(current_user, user_id):
     conn.commit()
     cursor.close()
     conn.close()
+    # drop the cached row so a ban takes effect on the next request
+    invalidate_user(user_id)
     return jsonify({'message': 'User status updated successfully'})
 
 @auth_bp.route('/users/<int:user_id>', methods=['GET'])
+@conditional_json()
 def get_user_by_id(user_id):
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
@@ -548,10 +609,10 @@ def get_bookmarks(current_user):
         
         # Get bookmarked products with details
         cursor.execute("""
-            SELECT p.*, u.username,
-                   (SELECT AVG(rating) FROM reviews WHERE seller_id = p.user_id) as seller_rating
+            SELECT p.*, u.username, sr.rating_avg as seller_rating
             FROM products p
             JOIN users u ON p.user_id = u.user_id
+            LEFT JOIN seller_ratings sr ON sr.seller_id = p.user_id
             WHERE JSON_CONTAINS(
                 (SELECT bookmarked_products FROM users WHERE user_id = %s),
                 CAST(p.product_id AS JSON)
@@ -620,47 +681,25 @@ def verified_user_required(f):
 @admin_required
 def cleanup_unverified_users(current_user):
     """Delete unverified users older than 24 hours"""
+    def log_deletions(cursor, users):
+        cursor.executemany("""
+            INSERT INTO admin_actions (admin_id, action_type, target_entity, action_description)
+            VALUES (%s, %s, %s, %s)
+        """, [(
+            current_user['user_id'],
+            "cleanup_unverified",
+            f"user_{user['user_id']}",
+            f"Deleted unverified user {user['username']} with email {user['email']} after 24 hours"
+        ) for user in users])
+
     try:
         conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        
-        # Find unverified users older than 24 hours
-        cursor.execute("""
-            SELECT user_id, username, email FROM users
-            WHERE verification_status = 'unverified'
-            AND date_joined < DATE_SUB(NOW(), INTERVAL 24 HOUR)
-        """)
-        
-        users_to_delete = cursor.fetchall()
-        deleted_count = 0
-        
-        for user in users_to_delete:
-            try:
-                # Delete the user
-                cursor.execute("DELETE FROM users WHERE user_id = %s", (user['user_id'],))
-                deleted_count += 1
-                
-                # Log the action
-                cursor.execute("""
-                    INSERT INTO admin_actions (admin_id, action_type, target_entity, action_description)
-                    VALUES (%s, %s, %s, %s)
-                """, (
-                    current_user['user_id'], 
-                    "cleanup_unverified", 
-                    f"user_{user['user_id']}", 
-                    f"Deleted unverified user {user['username']} with email {user['email']} after 24 hours"
-                ))
-            except Exception as e:
-                print(f"Error deleting user {user['user_id']}: {e}")
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
+        deleted = cleanup_expired_accounts(conn, before_delete=log_deletions)
         
         return jsonify({
-            'message': f'Deleted {deleted_count} unverified users',
-            'deleted_users_count': deleted_count
+            'message': f'Deleted {len(deleted)} unverified users',
+            'deleted_users_count': len(deleted)
         }), 200
         
     except Exception as e:
-        return jsonify({'error': f'Failed to cleanup unverified users: {str(e)}'}), 500
\ No newline at end of file
+        return jsonify({'error': f'Failed to cleanup unverified users: {str(e)}'}), 500
@@ -0,0 +1,168 @@
+# compare gunicorn worker classes by concurrent slow requests per MB of RAM
+#
+# starts gunicorn once per worker class with this directory's gunicorn.conf.py,
+# fires --concurrency simultaneous requests at it and reports latency, how many
+# requests were served without queueing behind others, and the resident memory
+# of the master plus its workers
+#
+# the default target is the tiny app below, which sleeps --delay seconds per
+# request, standing in for a request blocked on SES or a parked long poll
+# without needing MySQL. --target app runs the real backend against --path
+#
+# usage: python bench_workers.py --concurrency 200 --delay 2
+#        python bench_workers.py --classes gthread gevent --target app --path /
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def slow_app(environ, start_response):
+    """WSGI app that waits like a request blocked on network I/O"""
+    time.sleep(float(os.getenv('BENCH_DELAY', 1)))
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [b'ok']
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"gunicorn didn't open port {port}")
+
+
+def rss_mb(pid):
+    """Resident memory of a process and its children, from /proc"""
+    pids = [pid]
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                    pids.append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+    total_kb = 0
+    for p in pids:
+        try:
+            with open(f'/proc/{p}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total_kb += int(line.split()[1])
+        except OSError:
+            pass
+    return total_kb / 1024
+
+
+def run(worker_class, args):
+    port = free_port()
+    env = dict(os.environ,
+               GUNICORN_WORKER_CLASS=worker_class,
+               GUNICORN_WORKERS=str(args.workers),
+               # gunicorn quietly runs sync as gthread when threads > 1
+               GUNICORN_THREADS=str(1 if worker_class == 'sync' else args.threads),
+               GUNICORN_WORKER_CONNECTIONS=str(args.concurrency),
+               GUNICORN_ACCESS_LOG='',
+               BENCH_DELAY=str(args.delay))
+    target = 'bench_workers:slow_app' if args.target == 'slow' else 'app:app'
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', '--log-level', 'warning', target],
+        cwd=HERE, env=env)
+    try:
+        wait_for_port(port)
+        time.sleep(0.5)
+        idle_mb = rss_mb(server.pid)
+
+        latencies, errors, peak = [], [], [idle_mb]
+        lock = threading.Lock()
+        url = f'http://127.0.0.1:{port}{args.path}'
+
+        def client():
+            started = time.monotonic()
+            try:
+                with urllib.request.urlopen(url, timeout=args.timeout) as response:
+                    response.read()
+                with lock:
+                    latencies.append(time.monotonic() - started)
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+
+        def sample():
+            while any(t.is_alive() for t in clients):
+                peak.append(rss_mb(server.pid))
+                time.sleep(0.2)
+
+        clients = [threading.Thread(target=client) for _ in range(args.concurrency)]
+        started = time.monotonic()
+        for t in clients:
+            t.start()
+        sampler = threading.Thread(target=sample)
+        sampler.start()
+        for t in clients:
+            t.join()
+        sampler.join()
+        wall = time.monotonic() - started
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    # served in parallel: finished within one delay plus scheduling slack
+    parallel = sum(1 for latency in latencies if latency <= args.delay + 0.5)
+    latencies.sort()
+    return {
+        'class': worker_class,
+        'ok': len(latencies),
+        'errors': len(errors),
+        'p50': statistics.median(latencies) if latencies else None,
+        'p95': latencies[int(len(latencies) * 0.95) - 1] if latencies else None,
+        'wall': wall,
+        'parallel': parallel,
+        'idle_mb': idle_mb,
+        'peak_mb': max(peak),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--classes', nargs='+', default=['sync', 'gthread', 'gevent'])
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--delay', type=float, default=2.0, help='seconds each slow request waits')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--timeout', type=float, default=60.0, help='client timeout per request')
+    parser.add_argument('--target', choices=['slow', 'app'], default='slow')
+    parser.add_argument('--path', default='/')
+    args = parser.parse_args()
+
+    print(f"{args.concurrency} concurrent requests, {args.workers} workers, "
+          f"{'%.1fs simulated I/O' % args.delay if args.target == 'slow' else 'real app ' + args.path}")
+    print(f"{'class':<8} {'ok':>5} {'err':>5} {'p50 s':>7} {'p95 s':>7} {'wall s':>7} "
+          f"{'parallel':>8} {'idle MB':>8} {'peak MB':>8} {'parallel/MB':>11}")
+    for worker_class in args.classes:
+        r = run(worker_class, args)
+        fmt = lambda v: f"{v:7.2f}" if v is not None else '      -'
+        print(f"{r['class']:<8} {r['ok']:>5} {r['errors']:>5} {fmt(r['p50'])} {fmt(r['p95'])} {r['wall']:7.2f} "
+              f"{r['parallel']:>8} {r['idle_mb']:8.1f} {r['peak_mb']:8.1f} {r['parallel'] / r['peak_mb']:11.2f}")
+
+
+if __name__ == '__main__':
+    main()
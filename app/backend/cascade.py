@@ -0,0 +1,220 @@
+# set based deletes of listings and accounts with every row that references them
+#
+# delete_products / delete_users run a fixed number of statements no matter how
+# many conversations, messages or wishlist rows hang off the rows being deleted:
+# ids are gathered with one SELECT per level and each dependent table is cleared
+# with one IN (...) DELETE. they use the caller's cursor inside the caller's
+# transaction, so a view can check ownership, cascade and commit once
+#
+# CASCADE_SOFT_DELETE=true makes remove_products / remove_users only flag the
+# rows (status / account_status = 'deleted' plus deleted_at), which hides them
+# from every read right away. purge_deleted(), run by the scheduler, hard
+# deletes flagged rows older than CASCADE_PURGE_AFTER minutes in chunks
+import logging
+import os
+import threading
+from datetime import datetime
+
+from app import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+SOFT_DELETE = os.getenv('CASCADE_SOFT_DELETE', 'false').lower() == 'true'
+PURGE_AFTER_MINUTES = int(os.getenv('CASCADE_PURGE_AFTER', 10))
+PURGE_CHUNK = int(os.getenv('CASCADE_PURGE_CHUNK', 100))
+
+_stats = {'purge_runs': 0, 'purged_users': 0, 'purged_products': 0, 'last_purge_at': None}
+_stats_lock = threading.Lock()
+
+
+def _in(ids):
+    return ', '.join(['%s'] * len(ids))
+
+
+def _column(cursor, key):
+    # works with tuple and dictionary cursors
+    return [row[key] if isinstance(row, dict) else row[0] for row in cursor.fetchall()]
+
+
+def _lock_products(cursor, product_ids, live_only=False):
+    # the requested listings that exist, locked so the result names exactly what was removed
+    product_ids = list(product_ids)
+    if not product_ids:
+        return []
+    live = " AND deleted_at IS NULL" if live_only else ""
+    cursor.execute(f"SELECT product_id FROM products WHERE product_id IN ({_in(product_ids)}){live} FOR UPDATE",
+                   product_ids)
+    return _column(cursor, 'product_id')
+
+
+def _log_changes(cursor, product_ids):
+    cursor.execute(f"INSERT INTO catalog_changes (product_id) VALUES {', '.join(['(%s)'] * len(product_ids))}",
+                   product_ids)
+
+
+# ---- hard deletes ----
+
+def delete_conversations(cursor, conversation_ids):
+    """Delete conversations with their messages, participants and inbox summaries"""
+    conversation_ids = list(conversation_ids)
+    if not conversation_ids:
+        return 0
+    placeholders = _in(conversation_ids)
+    for table in ('messages', 'conversation_summaries', 'conversation_participants'):
+        cursor.execute(f"DELETE FROM {table} WHERE conversation_id IN ({placeholders})", conversation_ids)
+    cursor.execute(f"DELETE FROM conversations WHERE conversation_id IN ({placeholders})", conversation_ids)
+    return cursor.rowcount
+
+
+def delete_products(cursor, product_ids):
+    """Delete listings with their conversations, wishlist rows and images
+
+    Returns {'products': [ids deleted], 'conversations': count}.
+    """
+    product_ids = _lock_products(cursor, product_ids)
+    if not product_ids:
+        return {'products': [], 'conversations': 0}
+    placeholders = _in(product_ids)
+
+    cursor.execute(f"SELECT conversation_id FROM conversations WHERE product_id IN ({placeholders})",
+                   product_ids)
+    conversations = delete_conversations(cursor, _column(cursor, 'conversation_id'))
+
+    cursor.execute(f"DELETE FROM wishlist_tracking WHERE product_id IN ({placeholders})", product_ids)
+    cursor.execute(f"DELETE FROM product_images WHERE product_id IN ({placeholders})", product_ids)
+    # other workers drop the listings from their catalogs on their next poll
+    _log_changes(cursor, product_ids)
+    cursor.execute(f"DELETE FROM products WHERE product_id IN ({placeholders})", product_ids)
+    return {'products': product_ids, 'conversations': conversations}
+
+
+def delete_users(cursor, user_ids):
+    """Delete accounts with their listings, conversations, reports and reviews
+
+    Returns {'users': count, 'products': [ids deleted], 'conversations': count}.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {'users': 0, 'products': [], 'conversations': 0}
+    placeholders = _in(user_ids)
+
+    cursor.execute(f"SELECT product_id FROM products WHERE user_id IN ({placeholders})", user_ids)
+    result = delete_products(cursor, _column(cursor, 'product_id'))
+
+    # conversations about other people's listings, the other side's participant
+    # row goes too so no unread counter or summary is left behind
+    cursor.execute(f"""
+        SELECT DISTINCT conversation_id FROM conversation_participants WHERE user_id IN ({placeholders})
+    """, user_ids)
+    result['conversations'] += delete_conversations(cursor, _column(cursor, 'conversation_id'))
+
+    cursor.execute(f"DELETE FROM wishlist_tracking WHERE user_id IN ({placeholders})", user_ids)
+    cursor.execute(f"""
+        DELETE FROM user_reports WHERE reporter_id IN ({placeholders}) OR reported_user_id IN ({placeholders})
+    """, user_ids + user_ids)
+    cursor.execute(f"DELETE FROM reviews WHERE seller_id IN ({placeholders})", user_ids)
+    cursor.execute(f"DELETE FROM seller_ratings WHERE seller_id IN ({placeholders})", user_ids)
+    cursor.execute(f"DELETE FROM users WHERE user_id IN ({placeholders})", user_ids)
+    result['users'] = cursor.rowcount
+    return result
+
+
+# ---- soft deletes ----
+
+def soft_delete_products(cursor, product_ids):
+    product_ids = _lock_products(cursor, product_ids, live_only=True)
+    if not product_ids:
+        return {'products': [], 'conversations': 0}
+    cursor.execute(f"""
+        UPDATE products SET status = 'deleted', deleted_at = NOW()
+        WHERE product_id IN ({_in(product_ids)})
+    """, product_ids)
+    _log_changes(cursor, product_ids)
+    return {'products': product_ids, 'conversations': 0}
+
+
+def soft_delete_users(cursor, user_ids):
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {'users': 0, 'products': [], 'conversations': 0}
+    placeholders = _in(user_ids)
+    cursor.execute(f"""
+        UPDATE users SET account_status = 'deleted', deleted_at = NOW()
+        WHERE user_id IN ({placeholders}) AND deleted_at IS NULL
+    """, user_ids)
+    users = cursor.rowcount
+    cursor.execute(f"SELECT product_id FROM products WHERE user_id IN ({placeholders})", user_ids)
+    result = soft_delete_products(cursor, _column(cursor, 'product_id'))
+    result['users'] = users
+    return result
+
+
+def remove_products(cursor, product_ids):
+    """Soft or hard delete listings depending on CASCADE_SOFT_DELETE"""
+    return soft_delete_products(cursor, product_ids) if SOFT_DELETE else delete_products(cursor, product_ids)
+
+
+def remove_users(cursor, user_ids):
+    """Soft or hard delete accounts depending on CASCADE_SOFT_DELETE"""
+    return soft_delete_users(cursor, user_ids) if SOFT_DELETE else delete_users(cursor, user_ids)
+
+
+# ---- background purge of soft deleted rows ----
+
+def _purge_chunk(conn, table, key, delete):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("START TRANSACTION")
+        cursor.execute(f"""
+            SELECT {key} FROM {table}
+            WHERE deleted_at < NOW() - INTERVAL %s MINUTE
+            ORDER BY {key}
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (PURGE_AFTER_MINUTES, PURGE_CHUNK))
+        ids = _column(cursor, key)
+        result = delete(cursor, ids)
+        conn.commit()
+        return ids, result
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def purge_deleted(conn):
+    """Hard delete soft deleted accounts and listings, a chunk per transaction"""
+    purged = {'users': 0, 'products': 0}
+    for table, key, delete in (('users', 'user_id', delete_users), ('products', 'product_id', delete_products)):
+        while True:
+            ids, result = _purge_chunk(conn, table, key, delete)
+            purged[table] += len(ids)
+            if len(ids) < PURGE_CHUNK:
+                break
+    with _stats_lock:
+        _stats['purge_runs'] += 1
+        _stats['purged_users'] += purged['users']
+        _stats['purged_products'] += purged['products']
+        _stats['last_purge_at'] = datetime.now().isoformat()
+    return purged
+
+
+def purge_job():
+    """Scheduler entry point, owns its connection"""
+    conn = get_db_connection()
+    if conn is None:
+        return
+    try:
+        purged = purge_deleted(conn)
+        if purged['users'] or purged['products']:
+            logger.info(f"Purged {purged['users']} deleted accounts and {purged['products']} deleted listings")
+    except Exception as e:
+        logger.error(f"Purge of deleted rows failed: {e}")
+    finally:
+        conn.close()
+
+
+def cascade_stats():
+    with _stats_lock:
+        return dict(_stats, soft_delete=SOFT_DELETE, purge_after_minutes=PURGE_AFTER_MINUTES)
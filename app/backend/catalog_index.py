@@ -0,0 +1,455 @@
+# in memory index of approved listings for the public product read paths
+# /products/search and /products/<id> are answered from here instead of MySQL
+#
+# loaded when each gunicorn worker starts (post_worker_init in gunicorn.conf.py),
+# or on the first read when running without gunicorn, kept current by
+#   - the write paths in products.py / admin.py, which log the product id to
+#     catalog_changes inside their transaction and refresh it locally after commit
+#   - a throttled poll of catalog_changes and seller_ratings on reads, which
+#     picks up writes made by other gunicorn workers
+#
+# relevance sorted searches still go to MySQL, the FULLTEXT score isn't reproduced here
+# catalog_changes older than a day is pruned by the prune_changes_job scheduler job
+import bisect
+import logging
+import os
+import threading
+import time
+from app import get_db_connection
+from text_search import TOKEN_RE, search_tokens
+
+logger = logging.getLogger(__name__)
+
+# change ids come from AUTO_INCREMENT when the row is inserted, not when it
+# commits, so a lower id can become visible after a higher one was read. each
+# poll re-reads the last CHANGE_WINDOW ids and skips the ones already applied
+CHANGE_WINDOW = int(os.getenv('CATALOG_CHANGE_WINDOW', 500))
+CHANGE_BATCH = 1000
+
+
+class CatalogEntry:
+    """One listing, row holds the products columns in CatalogIndex.columns order"""
+
+    __slots__ = ('product_id', 'user_id', 'category', 'status', 'created_at',
+                 'username', 'row', 'images', 'tokens', 'text')
+
+    def __init__(self, row, columns, username, category, images):
+        values = dict(zip(columns, row))
+        self.product_id = values['product_id']
+        self.user_id = values['user_id']
+        self.status = values['status']
+        self.created_at = values['created_at']
+        self.category = (category or '').lower()
+        self.username = username
+        self.row = row
+        self.images = tuple(images)
+        # lowercase text for LIKE style matching of short terms
+        self.text = f"{values.get('name') or ''}\n{values.get('description') or ''}".lower()
+        self.tokens = frozenset(TOKEN_RE.findall(self.text))
+
+    @property
+    def sort_key(self):
+        return (self.created_at, self.product_id)
+
+
+class CatalogIndex:
+    """Approved listings that aren't deleted, with secondary indexes for search filters"""
+
+    def __init__(self, poll_interval=2.0, retry_interval=30.0):
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+        self.columns = None
+        self._lock = threading.RLock()
+        self._reset()
+        self._loaded = False
+        self._last_load_attempt = 0.0
+        self._last_poll = 0.0
+        self._last_change_id = 0
+        # change ids at or below _last_change_id inside the window that were applied
+        self._applied_changes = set()
+        self._ratings_seen_at = None
+        self._counters = {'loads': 0, 'polls': 0, 'refreshed': 0, 'searches': 0, 'lookups': 0}
+        self._listeners = []
+
+    def _reset(self):
+        self._by_id = {}
+        self._by_user = {}
+        self._by_category = {}
+        # token -> product ids, plus the sorted vocabulary for prefix lookups
+        self._postings = {}
+        self._vocab = []
+        # (created_at, product_id) of every entry in ascending order
+        self._order = []
+        self._ratings = {}
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    # ---- keeping the index current ----
+
+    def add_listener(self, callback):
+        """Call callback(products, seller_ids) after listings or ratings change
+
+        products maps each refreshed product id to the (user_id, category) it
+        had before and after the refresh, local and remote writes alike.
+        """
+        self._listeners.append(callback)
+
+    def _notify(self, products=None, seller_ids=()):
+        for callback in self._listeners:
+            try:
+                callback(products or {}, seller_ids)
+            except Exception as e:
+                logger.error(f"Catalog listener failed: {e}")
+
+    def ensure_fresh(self):
+        """Load on first use and poll for other workers' changes, True when usable"""
+        now = time.monotonic()
+        if self._loaded and now - self._last_poll < self.poll_interval:
+            return True
+        if not self._loaded and now - self._last_load_attempt < self.retry_interval:
+            return False
+
+        conn = get_db_connection()
+        if conn is None:
+            self._last_load_attempt = now
+            return self._loaded
+        try:
+            if self._loaded:
+                self.poll(conn)
+            else:
+                self.load(conn)
+        except Exception as e:
+            logger.error(f"Catalog index refresh failed: {e}")
+            # back off instead of retrying on every request
+            self._last_load_attempt = now
+            self._last_poll = now
+        finally:
+            conn.close()
+        return self._loaded
+
+    def load(self, conn):
+        self._last_load_attempt = time.monotonic()
+        cursor = conn.cursor(dictionary=True)
+        try:
+            # read the change log position first so nothing written during the load is missed
+            cursor.execute("SELECT COALESCE(MAX(change_id), 0) AS last_id FROM catalog_changes")
+            last_change_id = cursor.fetchone()['last_id']
+            # already committed, so the products read below include them
+            cursor.execute("SELECT change_id FROM catalog_changes WHERE change_id > %s",
+                           (max(0, last_change_id - CHANGE_WINDOW),))
+            applied = {r['change_id'] for r in cursor.fetchall()}
+            cursor.execute("SELECT MAX(updated_at) AS seen_at FROM seller_ratings")
+            ratings_seen_at = cursor.fetchone()['seen_at']
+            rows = self._fetch_products(cursor)
+            cursor.execute("SELECT seller_id, rating_avg FROM seller_ratings")
+            ratings = {r['seller_id']: float(r['rating_avg']) for r in cursor.fetchall() if r['rating_avg']}
+        finally:
+            cursor.close()
+
+        with self._lock:
+            self._reset()
+            self._ratings = ratings
+            for entry in rows:
+                self._add(entry)
+            self._last_change_id = last_change_id
+            self._applied_changes = applied
+            self._ratings_seen_at = ratings_seen_at
+            self._loaded = True
+            self._last_poll = time.monotonic()
+            self._counters['loads'] += 1
+        logger.info(f"Catalog index loaded {len(rows)} listings")
+
+    def poll(self, conn):
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute("""
+                SELECT change_id, product_id
+                FROM catalog_changes
+                WHERE change_id > %s
+                ORDER BY change_id ASC
+                LIMIT %s
+            """, (max(0, self._last_change_id - CHANGE_WINDOW), CHANGE_WINDOW + CHANGE_BATCH))
+            changes = [c for c in cursor.fetchall() if c['change_id'] not in self._applied_changes]
+
+            cursor.execute("""
+                SELECT seller_id, rating_avg, updated_at
+                FROM seller_ratings
+                WHERE updated_at >= %s
+            """, (self._ratings_seen_at or '1970-01-02',))
+            ratings = cursor.fetchall()
+        finally:
+            cursor.close()
+
+        if changes:
+            self.refresh_products(conn, {c['product_id'] for c in changes})
+        rerated = []
+        with self._lock:
+            if changes:
+                self._last_change_id = max(self._last_change_id, changes[-1]['change_id'])
+                self._applied_changes.update(c['change_id'] for c in changes)
+                floor = self._last_change_id - CHANGE_WINDOW
+                self._applied_changes = {i for i in self._applied_changes if i > floor}
+            for r in ratings:
+                # the >= window re-reads the newest rows, only report real changes
+                if self._ratings.get(r['seller_id']) != (float(r['rating_avg']) if r['rating_avg'] else None):
+                    rerated.append(r['seller_id'])
+                self._set_rating(r['seller_id'], r['rating_avg'])
+                if self._ratings_seen_at is None or r['updated_at'] > self._ratings_seen_at:
+                    self._ratings_seen_at = r['updated_at']
+            self._last_poll = time.monotonic()
+            self._counters['polls'] += 1
+
+        if rerated:
+            self._notify(seller_ids=rerated)
+        return [c['product_id'] for c in changes]
+
+    def refresh_products(self, conn, product_ids):
+        """Re-read listings from MySQL, dropping the ones that are no longer public"""
+        product_ids = list(product_ids)
+        if not product_ids or not self._loaded:
+            return
+        cursor = conn.cursor(dictionary=True)
+        try:
+            rows = self._fetch_products(cursor, product_ids)
+        finally:
+            cursor.close()
+        scopes = {product_id: [] for product_id in product_ids}
+        with self._lock:
+            for product_id in product_ids:
+                entry = self._by_id.get(product_id)
+                if entry is not None:
+                    scopes[product_id].append((entry.user_id, entry.category))
+                self._remove(product_id)
+            for entry in rows:
+                self._add(entry)
+                scopes[entry.product_id].append((entry.user_id, entry.category))
+            self._counters['refreshed'] += len(product_ids)
+        self._notify(products=scopes)
+
+    def refresh_seller_rating(self, conn, seller_id):
+        if not self._loaded:
+            return
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute("SELECT rating_avg FROM seller_ratings WHERE seller_id = %s", (seller_id,))
+            row = cursor.fetchone()
+        finally:
+            cursor.close()
+        with self._lock:
+            self._set_rating(seller_id, row['rating_avg'] if row else None)
+        self._notify(seller_ids=[seller_id])
+
+    def _fetch_products(self, cursor, product_ids=None):
+        query = """
+            SELECT p.*, u.username AS _username, c.name AS _category
+            FROM products p
+            JOIN users u ON p.user_id = u.user_id
+            JOIN categories c ON p.category_id = c.category_id
+            WHERE p.approval_status = 'approved' AND p.status IN ('active', 'sold')
+        """
+        params = ()
+        if product_ids is not None:
+            query += f" AND p.product_id IN ({', '.join(['%s'] * len(product_ids))})"
+            params = tuple(product_ids)
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+        if not rows:
+            return []
+
+        if product_ids is None:
+            cursor.execute("SELECT product_id, image_url FROM product_images ORDER BY image_id ASC")
+        else:
+            cursor.execute(f"""
+                SELECT product_id, image_url
+                FROM product_images
+                WHERE product_id IN ({', '.join(['%s'] * len(product_ids))})
+                ORDER BY image_id ASC
+            """, params)
+        images = {}
+        for img in cursor.fetchall():
+            images.setdefault(img['product_id'], []).append(img['image_url'])
+
+        if self.columns is None:
+            self.columns = tuple(k for k in rows[0] if k not in ('_username', '_category'))
+        return [
+            CatalogEntry(tuple(r[c] for c in self.columns), self.columns,
+                         r['_username'], r['_category'], images.get(r['product_id'], ()))
+            for r in rows
+        ]
+
+    def _set_rating(self, seller_id, rating):
+        if rating:
+            self._ratings[seller_id] = float(rating)
+        else:
+            self._ratings.pop(seller_id, None)
+
+    def _add(self, entry):
+        self._by_id[entry.product_id] = entry
+        self._by_user.setdefault(entry.user_id, set()).add(entry.product_id)
+        self._by_category.setdefault(entry.category, set()).add(entry.product_id)
+        for token in entry.tokens:
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = set()
+                bisect.insort(self._vocab, token)
+            postings.add(entry.product_id)
+        bisect.insort(self._order, entry.sort_key)
+
+    def _remove(self, product_id):
+        entry = self._by_id.pop(product_id, None)
+        if entry is None:
+            return
+        self._discard(self._by_user, entry.user_id, product_id)
+        self._discard(self._by_category, entry.category, product_id)
+        for token in entry.tokens:
+            if self._discard(self._postings, token, product_id):
+                del self._vocab[bisect.bisect_left(self._vocab, token)]
+        del self._order[bisect.bisect_left(self._order, entry.sort_key)]
+
+    @staticmethod
+    def _discard(index, key, product_id):
+        # returns True when the key has no products left and was dropped
+        ids = index.get(key)
+        if ids is None:
+            return False
+        ids.discard(product_id)
+        if not ids:
+            del index[key]
+            return True
+        return False
+
+    # ---- reads ----
+
+    def _as_dict(self, entry):
+        product = dict(zip(self.columns, entry.row))
+        product['username'] = entry.username
+        product['images'] = list(entry.images)
+        product['seller_rating'] = self._ratings.get(entry.user_id, 0.0)
+        return product
+
+    def get(self, product_id):
+        with self._lock:
+            self._counters['lookups'] += 1
+            entry = self._by_id.get(product_id)
+            return self._as_dict(entry) if entry else None
+
+    def _prefix_matches(self, stem):
+        # every product with an indexed word starting with stem, like +stem* in MySQL
+        matches = set()
+        i = bisect.bisect_left(self._vocab, stem)
+        while i < len(self._vocab) and self._vocab[i].startswith(stem):
+            matches |= self._postings[self._vocab[i]]
+            i += 1
+        return matches
+
+    def search(self, term=None, category=None, user_id=None, after=None, limit=None):
+        """Same filters and newest first order as the SQL search
+
+        after is the (created_at, product_id) keyset cursor, limit None returns
+        everything. Returns (products, has_more).
+        """
+        with self._lock:
+            self._counters['searches'] += 1
+            candidates = None
+            if user_id is not None:
+                candidates = set(self._by_user.get(user_id, ()))
+            if category:
+                in_category = self._by_category.get(category.lower(), set())
+                candidates = set(in_category) if candidates is None else candidates & in_category
+
+            substring = None
+            if term:
+                stems = search_tokens(term)
+                if not stems:
+                    substring = term.lower()
+                for alternatives in stems:
+                    matches = set().union(*(self._prefix_matches(prefix) for prefix in alternatives))
+                    candidates = matches if candidates is None else candidates & matches
+
+            def wanted(entry):
+                if user_id is None and entry.status != 'active':
+                    return False
+                return substring is None or substring in entry.text
+
+            if candidates is None:
+                # no selective filter, walk the feed order from the cursor
+                end = bisect.bisect_left(self._order, after) if after else len(self._order)
+                keys = (self._order[i] for i in range(end - 1, -1, -1))
+            else:
+                keys = sorted((self._by_id[pid].sort_key for pid in candidates), reverse=True)
+                if after:
+                    keys = (k for k in keys if k < after)
+
+            results = []
+            for key in keys:
+                entry = self._by_id[key[1]]
+                if not wanted(entry):
+                    continue
+                if limit is not None and len(results) == limit:
+                    return results, True
+                results.append(self._as_dict(entry))
+            return results, False
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({
+                'loaded': self._loaded,
+                'listings': len(self._by_id),
+                'vocabulary': len(self._vocab),
+                'last_change_id': self._last_change_id,
+            })
+        return stats
+
+
+catalog = CatalogIndex(poll_interval=float(os.getenv('CATALOG_POLL_INTERVAL', 2)))
+
+
+def preload():
+    """Load the index before the worker takes requests, so none of them pays for it"""
+    from app import app
+    if app.config['CATALOG_INDEX_ENABLED'] and not catalog.ensure_fresh():
+        logger.warning("Catalog index preload failed, reads use MySQL until it loads")
+
+
+def prune_changes_job():
+    """Scheduler entry point, owns its connection
+
+    every worker reads the log within seconds, a day of history is plenty
+    """
+    conn = get_db_connection()
+    if conn is None:
+        return
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM catalog_changes WHERE changed_at < NOW() - INTERVAL 1 DAY LIMIT 5000")
+        conn.commit()
+    except Exception as e:
+        logger.error(f"Catalog change log prune failed: {e}")
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def record_product_change(cursor, product_id):
+    """Log a product write for the other workers' catalogs, call inside the write transaction"""
+    cursor.execute("INSERT INTO catalog_changes (product_id) VALUES (%s)", (product_id,))
+
+
+def product_changed(conn, product_id):
+    """Refresh this worker's copy of a product, call after the write is committed"""
+    try:
+        catalog.refresh_products(conn, [product_id])
+    except Exception as e:
+        # the poll will pick the change up again, a stale entry for a few seconds is fine
+        logger.error(f"Catalog refresh failed for product {product_id}: {e}")
+
+
+def seller_rating_changed(conn, seller_id):
+    """Refresh this worker's copy of a seller's rating, call after the review is committed"""
+    try:
+        catalog.refresh_seller_rating(conn, seller_id)
+    except Exception as e:
+        logger.error(f"Catalog rating refresh failed for seller {seller_id}: {e}")
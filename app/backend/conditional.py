@@ -0,0 +1,51 @@
+# conditional GET support for read endpoints the SPA fetches over and over
+# responses carry a strong ETag and Cache-Control: no-cache, so the browser
+# keeps its copy and revalidates with If-None-Match, getting an empty 304
+# back when nothing changed
+#
+# endpoints with a cheap version (a cached entry, a rating row) check it with
+# not_modified() before running their queries, the rest hash the body
+import hashlib
+from functools import wraps
+from flask import current_app, request
+
+
+def etag_for(*parts):
+    """Strong ETag value from a response body or version values"""
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _cache_headers(response, etag, private):
+    response.set_etag(etag)
+    # store it but always revalidate, per user data stays out of shared caches
+    response.headers['Cache-Control'] = 'private, no-cache' if private else 'no-cache'
+    return response
+
+
+def not_modified(etag, private=False):
+    """A 304 response when the client's copy has this ETag, otherwise None"""
+    if etag and request.if_none_match.contains(etag):
+        return _cache_headers(current_app.response_class(status=304), etag, private)
+    return None
+
+
+def conditional(response, etag=None, private=False):
+    """Tag a 200 response with an ETag and answer If-None-Match with a 304"""
+    if request.method != 'GET' or response.status_code != 200:
+        return response
+    _cache_headers(response, etag or etag_for(response.get_data()), private)
+    return response.make_conditional(request)
+
+
+def conditional_json(private=False):
+    """Decorator for GET views whose body is hashed into the ETag"""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            return conditional(current_app.make_response(f(*args, **kwargs)), private=private)
+        return wrapper
+    return decorator
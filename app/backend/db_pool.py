@@ -0,0 +1,213 @@
+# pooled MySQL connections shared by every blueprint through app.get_db_connection
+# keeps a small set of authenticated connections open instead of doing a
+# TCP + auth handshake per request, with overflow, checkout timeout,
+# health check on borrow and recycling of old connections
+import collections
+import threading
+import time
+import mysql.connector
+from mysql.connector.errors import PoolError
+
+
+class PooledConnection:
+    """Wraps a raw mysql.connector connection, close() returns it to the pool"""
+
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+        self._released = False
+
+    def __getattr__(self, name):
+        # everything except close() goes straight to the real connection
+        return getattr(self._raw, name)
+
+    def close(self):
+        if self._released:
+            return
+        self._released = True
+        self._pool._release(self._raw, self._created_at)
+
+
+class ConnectionPool:
+    """Thread safe MySQL connection pool
+
+    size          connections kept open while idle
+    max_overflow  extra connections allowed under load, closed when returned
+    timeout       seconds to wait for a free connection before raising PoolError
+    recycle       seconds after which a connection is closed and reopened
+    pre_ping      ping connections that sat idle longer than ping_after on borrow
+    """
+
+    def __init__(self, connect_args, size=3, max_overflow=2, timeout=10.0,
+                 recycle=1800, pre_ping=True, ping_after=5.0):
+        self.connect_args = connect_args
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self.ping_after = ping_after
+
+        # idle entries are (raw connection, created_at, returned_at)
+        self._idle = collections.deque()
+        self._checked_out = 0
+        self._cond = threading.Condition()
+        self._counters = {
+            'checkouts': 0,
+            'connects': 0,
+            'recycled': 0,
+            'invalidated': 0,
+            'timeouts': 0,
+            'overflow_closed': 0,
+            'wait_time_total': 0.0,
+        }
+
+    def connect(self):
+        """Borrow a connection, blocking up to timeout seconds when the pool is exhausted"""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        entry = None
+
+        with self._cond:
+            while True:
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._checked_out + len(self._idle) < self.size + self.max_overflow:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters['timeouts'] += 1
+                    raise PoolError(
+                        f"Connection pool exhausted: {self._checked_out} connections "
+                        f"checked out, waited {self.timeout}s"
+                    )
+                self._cond.wait(remaining)
+            self._checked_out += 1
+            self._counters['checkouts'] += 1
+            self._counters['wait_time_total'] += time.monotonic() - started
+
+        try:
+            raw, created_at = self._validate(entry)
+            if raw is None:
+                raw = mysql.connector.connect(**self.connect_args)
+                created_at = time.monotonic()
+                with self._cond:
+                    self._counters['connects'] += 1
+        except Exception:
+            # give the slot back so a failed connect doesn't shrink the pool forever
+            with self._cond:
+                self._checked_out -= 1
+                self._cond.notify()
+            raise
+
+        return PooledConnection(self, raw, created_at)
+
+    def _validate(self, entry):
+        # returns (raw, created_at) for a usable idle connection or (None, None)
+        if entry is None:
+            return None, None
+        raw, created_at, returned_at = entry
+        now = time.monotonic()
+
+        if self.recycle and now - created_at > self.recycle:
+            self._discard(raw)
+            with self._cond:
+                self._counters['recycled'] += 1
+            return None, None
+
+        if self.pre_ping and now - returned_at > self.ping_after:
+            try:
+                raw.ping(reconnect=False)
+            except Exception:
+                self._discard(raw)
+                with self._cond:
+                    self._counters['invalidated'] += 1
+                return None, None
+
+        return raw, created_at
+
+    def _release(self, raw, created_at):
+        healthy = True
+        try:
+            # end any open transaction so the next borrower gets a fresh snapshot
+            # and no half finished writes; this also drains unread results
+            if raw.in_transaction:
+                raw.rollback()
+        except Exception:
+            healthy = False
+
+        with self._cond:
+            self._checked_out -= 1
+            keep = healthy and len(self._idle) < self.size
+            if keep:
+                self._idle.append((raw, created_at, time.monotonic()))
+            elif healthy:
+                self._counters['overflow_closed'] += 1
+            else:
+                self._counters['invalidated'] += 1
+            self._cond.notify()
+
+        if not keep:
+            self._discard(raw)
+
+    @staticmethod
+    def _discard(raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def dispose(self):
+        """Close every idle connection, checked out ones are closed when returned"""
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+        for raw, _, _ in idle:
+            self._discard(raw)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._counters)
+            stats.update({
+                'size': self.size,
+                'max_overflow': self.max_overflow,
+                'checked_out': self._checked_out,
+                'idle': len(self._idle),
+                'overflow': max(0, self._checked_out + len(self._idle) - self.size),
+            })
+        stats['wait_time_total'] = round(stats['wait_time_total'], 4)
+        return stats
+
+
+class RequestConnection:
+    """Connection shared by everything that runs during one request
+
+    close() is a no-op so the decorator and the view can both "close" it,
+    the app teardown hook commits or rolls back and returns it to the pool.
+    Cursors default to buffered so a half read result set from one caller
+    can't block the next query on the shared connection.
+    """
+
+    def __init__(self, pooled):
+        self._pooled = pooled
+
+    def __getattr__(self, name):
+        return getattr(self._pooled, name)
+
+    def cursor(self, *args, **kwargs):
+        kwargs.setdefault('buffered', True)
+        return self._pooled.cursor(*args, **kwargs)
+
+    def close(self):
+        pass
+
+    def release(self, commit):
+        try:
+            if commit:
+                self._pooled.commit()
+            else:
+                self._pooled.rollback()
+        finally:
+            self._pooled.close()
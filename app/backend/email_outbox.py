@@ -0,0 +1,387 @@
+# durable outbox for outgoing email
+#
+# views call enqueue_email() inside their own transaction and respond right away,
+# a background job (APScheduler in every gunicorn worker, or the
+# `flask --app app email send-outbox` command) claims due rows with
+# FOR UPDATE SKIP LOCKED so several senders never pick the same mail, hands
+# them to the transport outside any transaction (and without holding a pooled
+# connection) and records the outcome:
+#   sent     delivered to the transport
+#   pending  failed, retried after an exponential backoff
+#   dead     failed EMAIL_OUTBOX_MAX_ATTEMPTS times or rejected outright,
+#            kept with last_error for a human to look at
+#
+# EMAIL_TRANSPORT picks where mail goes:
+#   ses   AWS SES (default)
+#   file  one .eml file per mail in EMAIL_OUTBOX_DIR, for development and tests
+#   smtp  plain SMTP to SMTP_HOST:SMTP_PORT, e.g. a local mail sink
+import logging
+import os
+import smtplib
+import threading
+import time
+from datetime import datetime
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import click
+from flask import Blueprint
+from app import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+email_outbox_bp = Blueprint('email', __name__)
+
+BATCH_SIZE = int(os.getenv('EMAIL_OUTBOX_BATCH_SIZE', 20))
+MAX_ATTEMPTS = int(os.getenv('EMAIL_OUTBOX_MAX_ATTEMPTS', 8))
+# seconds before the first retry, doubled for every later one up to BACKOFF_MAX
+BACKOFF_BASE = int(os.getenv('EMAIL_OUTBOX_BACKOFF', 30))
+BACKOFF_MAX = int(os.getenv('EMAIL_OUTBOX_BACKOFF_MAX', 3600))
+# longest a single send may block (SMTP socket timeout, SES connect/read timeouts)
+SEND_TIMEOUT = int(os.getenv('EMAIL_SEND_TIMEOUT', 10))
+# a claimed row whose sender died is picked up again after this many seconds,
+# long enough for a whole batch of sends at SEND_TIMEOUT
+LEASE_SECONDS = int(os.getenv('EMAIL_OUTBOX_LEASE', BATCH_SIZE * SEND_TIMEOUT + 60))
+# sent rows are kept this long, dead ones until someone deletes them
+KEEP_SENT_DAYS = int(os.getenv('EMAIL_OUTBOX_KEEP_DAYS', 7))
+
+
+class PermanentEmailError(Exception):
+    """The transport refused the mail, retrying won't help"""
+
+
+def build_message(to_email, subject, text_body, html_body=None, sender=None):
+    message = MIMEMultipart('alternative')
+    message['Subject'] = subject
+    message['From'] = sender or os.getenv("SES_FROM_EMAIL", "noreply@gator.market")
+    message['To'] = to_email
+    message.attach(MIMEText(text_body, 'plain'))
+    if html_body:
+        message.attach(MIMEText(html_body, 'html'))
+    return message
+
+
+# ---- transports, each has send(message) and raises on failure ----
+
+class SesTransport:
+    # SES error codes that mean the mail itself is bad
+    permanent_errors = {'MessageRejected', 'MailFromDomainNotVerifiedException', 'InvalidParameterValue'}
+
+    def __init__(self, region):
+        import boto3
+        from botocore.config import Config
+        # no hidden retries, the outbox retries with backoff and the lease bounds a send
+        self.client = boto3.client('ses', region_name=region, config=Config(
+            connect_timeout=SEND_TIMEOUT, read_timeout=SEND_TIMEOUT, retries={'max_attempts': 1}))
+
+    def send(self, message):
+        from botocore.exceptions import ClientError
+        try:
+            response = self.client.send_raw_email(
+                Source=message['From'],
+                Destinations=[message['To']],
+                RawMessage={'Data': message.as_string()}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] in self.permanent_errors:
+                raise PermanentEmailError(e.response['Error']['Message'])
+            raise
+        return response['MessageId']
+
+
+class FileTransport:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def send(self, message):
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{time.time_ns()}-{message['To']}.eml"
+        with open(os.path.join(self.directory, name), 'w') as f:
+            f.write(message.as_string())
+        return name
+
+
+class SmtpTransport:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+
+    def send(self, message):
+        try:
+            with smtplib.SMTP(self.host, self.port, timeout=SEND_TIMEOUT) as smtp:
+                smtp.send_message(message)
+        except smtplib.SMTPRecipientsRefused as e:
+            raise PermanentEmailError(str(e))
+        return message['To']
+
+
+def transport_from_env():
+    name = os.getenv('EMAIL_TRANSPORT', 'ses')
+    if name == 'file':
+        return FileTransport(os.getenv('EMAIL_OUTBOX_DIR', '/tmp/gatormarket-mail'))
+    if name == 'smtp':
+        return SmtpTransport(os.getenv('SMTP_HOST', 'localhost'), int(os.getenv('SMTP_PORT', 1025)))
+    return SesTransport(os.getenv("AWS_REGION", "us-west-1"))
+
+
+_transport = None
+
+
+def get_transport():
+    global _transport
+    if _transport is None:
+        _transport = transport_from_env()
+    return _transport
+
+
+# ---- queueing ----
+
+def enqueue_email(cursor, to_email, subject, text_body, html_body=None):
+    """Queue a mail, call inside the transaction that made it necessary"""
+    cursor.execute("""
+        INSERT INTO email_outbox (to_email, subject, text_body, html_body)
+        VALUES (%s, %s, %s, %s)
+    """, (to_email, subject, text_body, html_body))
+    return cursor.lastrowid
+
+
+def backoff_seconds(attempts):
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** max(attempts - 1, 0))
+
+
+# per worker counters for /admin/email-outbox
+_counters = {'sent': 0, 'retried': 0, 'dead': 0, 'runs': 0, 'last_run': None}
+_counters_lock = threading.Lock()
+
+
+def _count(**changes):
+    with _counters_lock:
+        for name, value in changes.items():
+            _counters[name] += value
+
+
+def claim_batch(conn, limit=BATCH_SIZE):
+    """Lease up to limit due mails to this sender and return them"""
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("START TRANSACTION")
+        cursor.execute("""
+            SELECT email_id, to_email, subject, text_body, html_body, attempts
+            FROM email_outbox
+            WHERE (status = 'pending' AND next_attempt_at <= NOW())
+               OR (status = 'sending' AND locked_until < NOW())
+            ORDER BY email_id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (limit,))
+        rows = cursor.fetchall()
+        if rows:
+            ids = [row['email_id'] for row in rows]
+            placeholders = ', '.join(['%s'] * len(ids))
+            cursor.execute(f"""
+                UPDATE email_outbox
+                SET status = 'sending', attempts = attempts + 1,
+                    locked_until = NOW() + INTERVAL %s SECOND
+                WHERE email_id IN ({placeholders})
+            """, (LEASE_SECONDS, *ids))
+        conn.commit()
+        for row in rows:
+            row['attempts'] += 1
+        return rows
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def _record(cursor, row, error, permanent):
+    if error is None:
+        cursor.execute("""
+            UPDATE email_outbox
+            SET status = 'sent', sent_at = NOW(), locked_until = NULL, last_error = NULL
+            WHERE email_id = %s
+        """, (row['email_id'],))
+        _count(sent=1)
+    elif permanent or row['attempts'] >= MAX_ATTEMPTS:
+        cursor.execute("""
+            UPDATE email_outbox
+            SET status = 'dead', locked_until = NULL, last_error = %s
+            WHERE email_id = %s
+        """, (str(error)[:1000], row['email_id']))
+        _count(dead=1)
+        logger.error(f"Email {row['email_id']} to {row['to_email']} dead-lettered: {error}")
+    else:
+        cursor.execute("""
+            UPDATE email_outbox
+            SET status = 'pending', locked_until = NULL, last_error = %s,
+                next_attempt_at = NOW() + INTERVAL %s SECOND
+            WHERE email_id = %s
+        """, (str(error)[:1000], backoff_seconds(row['attempts']), row['email_id']))
+        _count(retried=1)
+        logger.warning(f"Email {row['email_id']} attempt {row['attempts']} failed: {error}")
+
+
+def _release(cursor, rows):
+    # hand unsent rows back while the lease is still ours, the claim's attempt doesn't count
+    ids = [row['email_id'] for row in rows]
+    placeholders = ', '.join(['%s'] * len(ids))
+    cursor.execute(f"""
+        UPDATE email_outbox
+        SET status = 'pending', attempts = attempts - 1, locked_until = NULL
+        WHERE email_id IN ({placeholders}) AND status = 'sending'
+    """, ids)
+
+
+def _write(update, *args):
+    # a connection is borrowed for each write and never held across a send,
+    # a batch of slow sends would otherwise sit on a pooled connection
+    conn = get_db_connection()
+    if conn is None:
+        raise RuntimeError("No database connection to record email results")
+    cursor = conn.cursor()
+    try:
+        update(cursor, *args)
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def send_batch(transport, limit=BATCH_SIZE):
+    """Claim and deliver one batch, returns how many mails were claimed
+
+    Each result is committed as soon as the mail is sent, and no send starts
+    unless the lease still covers it, so a row is never sent by two senders.
+    """
+    conn = get_db_connection()
+    if conn is None:
+        return 0
+    try:
+        rows = claim_batch(conn, limit)
+    finally:
+        conn.close()
+    leased_at = time.monotonic()
+    for i, row in enumerate(rows):
+        # a send plus its bookkeeping fits in a few SEND_TIMEOUTs
+        if time.monotonic() - leased_at > LEASE_SECONDS - 3 * SEND_TIMEOUT:
+            _write(_release, rows[i:])
+            logger.warning(f"Email lease running out, released {len(rows) - i} unsent mails")
+            break
+        try:
+            message = build_message(row['to_email'], row['subject'], row['text_body'], row['html_body'])
+            transport.send(message)
+            result = (None, False)
+        except PermanentEmailError as e:
+            result = (e, True)
+        except Exception as e:
+            result = (e, False)
+        _write(_record, row, *result)
+    return len(rows)
+
+
+def purge_sent(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            DELETE FROM email_outbox
+            WHERE status = 'sent' AND sent_at < NOW() - INTERVAL %s DAY
+            LIMIT 5000
+        """, (KEEP_SENT_DAYS,))
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        cursor.close()
+
+
+# only one run at a time per worker, a wake() during a run is picked up by its next batch
+_run_lock = threading.Lock()
+
+
+def run_outbox(max_batches=10):
+    """Send due mail until the outbox is drained or max_batches ran, for the scheduler"""
+    if not _run_lock.acquire(blocking=False):
+        return 0
+    sent = 0
+    try:
+        transport = get_transport()
+        for _ in range(max_batches):
+            claimed = send_batch(transport)
+            sent += claimed
+            if claimed < BATCH_SIZE:
+                break
+        _count(runs=1)
+        with _counters_lock:
+            _counters['last_run'] = datetime.now().isoformat()
+    except Exception as e:
+        logger.error(f"Email outbox run failed: {e}")
+    finally:
+        _run_lock.release()
+    return sent
+
+
+def purge_sent_job():
+    conn = get_db_connection()
+    if conn is None:
+        return
+    try:
+        purged = purge_sent(conn)
+        if purged:
+            logger.info(f"Email outbox purged {purged} sent mails")
+    except Exception as e:
+        logger.error(f"Email outbox purge failed: {e}")
+    finally:
+        conn.close()
+
+
+def schedule_jobs(scheduler):
+    scheduler.add_job(id='email_outbox', func=run_outbox, trigger='interval',
+                      seconds=int(os.getenv('EMAIL_OUTBOX_INTERVAL', 10)),
+                      max_instances=1, coalesce=True)
+    scheduler.add_job(id='email_outbox_purge', func=purge_sent_job, trigger='interval',
+                      hours=6, max_instances=1, coalesce=True)
+
+
+def wake(scheduler):
+    """Run the sender now instead of at its next interval, e.g. right after enqueueing"""
+    job = scheduler.get_job('email_outbox') if scheduler.running else None
+    if job is not None:
+        try:
+            job.modify(next_run_time=datetime.now())
+        except Exception as e:
+            logger.error(f"Could not wake the email outbox: {e}")
+
+
+def outbox_stats(conn):
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("SELECT status, COUNT(*) AS count FROM email_outbox GROUP BY status")
+        statuses = {row['status']: row['count'] for row in cursor.fetchall()}
+        cursor.execute("""
+            SELECT MIN(created_at) AS oldest FROM email_outbox WHERE status IN ('pending', 'sending')
+        """)
+        oldest = cursor.fetchone()['oldest']
+    finally:
+        cursor.close()
+    with _counters_lock:
+        counters = dict(_counters)
+    return {
+        'statuses': statuses,
+        'oldest_unsent': oldest.isoformat() if oldest else None,
+        'worker': counters,
+        'transport': type(get_transport()).__name__,
+    }
+
+
+# Deliver the outbox from a separate process instead of (or besides) the web workers
+# usage: flask --app app email send-outbox [--loop]
+@email_outbox_bp.cli.command('send-outbox')
+@click.option('--loop', is_flag=True, help='keep polling instead of exiting once drained')
+@click.option('--interval', default=5.0, help='seconds between polls with --loop')
+def send_outbox(loop, interval):
+    while True:
+        sent = run_outbox(max_batches=1000)
+        print(f"Email outbox: {sent} mails processed")
+        if not loop:
+            return
+        time.sleep(interval)
@@ -0,0 +1,40 @@
+# gunicorn settings, read automatically when gunicorn starts in this directory
+# e.g. gunicorn app:app
+#
+# GUNICORN_WORKER_CLASS picks how a worker waits on slow work (SES, bcrypt,
+# MySQL, long polls and event streams):
+#   sync     one request per process, the old behaviour (needs GUNICORN_THREADS=1,
+#            gunicorn switches to gthread otherwise)
+#   gthread  GUNICORN_THREADS requests per process on OS threads
+#   gevent   GUNICORN_WORKER_CONNECTIONS requests per process on greenlets,
+#            sockets are monkey patched and MySQL uses the pure python driver.
+#            the default, and the only mode with event streams and long polls
+#            (/messaging/stream, ?wait=), which would each hold an OS thread
+#            for minutes in gthread. elsewhere clients poll instead
+# compare them with: python bench_workers.py
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gevent')
+workers = int(os.getenv('GUNICORN_WORKERS', 2))
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 200))
+
+# long polls park for up to MESSAGE_MAX_WAIT and streams stay open far longer,
+# on greenlets neither blocks the worker's heartbeat
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+# recycle workers now and then so a slow leak can't reach the container limit
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 200))
+
+# empty turns the access log off
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-') or None
+
+
+def post_worker_init(worker):
+    # build the catalog index now instead of on the worker's first request
+    from catalog_index import preload
+    preload()
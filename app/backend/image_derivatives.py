@@ -0,0 +1,211 @@
+# resized copies of product images for listing pages
+#
+# /products/serve-image/<name>?size=thumb|medium answers with a copy that is
+# IMAGE_SIZES wide instead of the full upload. copies are kept on disk under
+# <upload folder>/derived/<size>/ next to the originals, so IMAGE_ACCEL and the
+# nginx /protected-images/ alias serve them like any other file. a copy is made
+# the first time it's asked for, and right after upload when
+# IMAGE_DERIVE_ON_UPLOAD is on (one background thread per worker). it's written
+# to a temp file and renamed into place, a half written copy is never served.
+# an original already narrower than the size (or too large to decode) is hard
+# linked in as its own copy, image_store's cleanup removes it with the rest
+#
+# images larger than IMAGE_MAX_PIXELS once decoded are never resized, uploads
+# are warmed before moderation and a small PNG can decode to hundreds of MB
+#
+# browsers that send Accept: image/webp get a WebP copy when IMAGE_WEBP is on.
+# Pillow is optional: without it, or for an image it can't read, every size
+# falls back to the original
+import logging
+import mimetypes
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app import green_sockets
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+mimetypes.add_type('image/webp', '.webp')
+
+# name=width pairs, e.g. "thumb=320,medium=800"
+SIZES = {name: int(width) for name, width in
+         (pair.split('=') for pair in os.getenv('IMAGE_SIZES', 'thumb=320,medium=800').split(','))}
+QUALITY = int(os.getenv('IMAGE_QUALITY', 80))
+WEBP = os.getenv('IMAGE_WEBP', 'true').lower() == 'true' and Image is not None and features.check('webp')
+DERIVE_ON_UPLOAD = os.getenv('IMAGE_DERIVE_ON_UPLOAD', 'true').lower() == 'true'
+DERIVED_DIR = 'derived'
+
+# largest image decoded for a copy, after JPEG draft scaling. a 9000x9000 PNG
+# is a few MB on disk and ~240MB decoded, anything over this sends the original
+MAX_PIXELS = int(os.getenv('IMAGE_MAX_PIXELS', 8_000_000))
+# a decoded photo is tens of MB, resize one at a time per worker (128M container)
+_resize_slots = threading.BoundedSemaphore(int(os.getenv('IMAGE_RESIZE_CONCURRENCY', 1)))
+# one lock per copy being made, held by the request making it, so a burst of
+# requests for it makes it once
+_building = {}
+_building_lock = threading.Lock()
+_executor = None
+_executor_pid = None
+
+_stats = {'hits': 0, 'generated': 0, 'originals': 0, 'too_large': 0, 'errors': 0, 'queued': 0}
+_stats_lock = threading.Lock()
+
+
+def available():
+    return Image is not None
+
+
+def accepts_webp(accept_header):
+    return WEBP and 'image/webp' in (accept_header or '')
+
+
+def _count(key):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+def derived_name(filename, size, webp=False):
+    """Path of a copy relative to the upload folder"""
+    name = f"{filename}.webp" if webp else filename
+    return os.path.join(DERIVED_DIR, size, name)
+
+
+def _write(image, path, fmt):
+    # temp file in the same directory so the rename is atomic
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            if fmt == 'WEBP':
+                image.save(out, 'WEBP', quality=QUALITY, method=4)
+            elif fmt == 'PNG':
+                image.save(out, 'PNG', optimize=True)
+            else:
+                if image.mode not in ('RGB', 'L'):
+                    image = image.convert('RGB')
+                image.save(out, 'JPEG', quality=QUALITY, optimize=True, progressive=True)
+        os.replace(tmp, path)
+    except Exception:
+        os.unlink(tmp)
+        raise
+
+
+def _resize(source, target, width, webp):
+    """Write the copy, returns False when the original is already small enough"""
+    with Image.open(source) as image:
+        if image.width <= width and not webp:
+            return False
+        fmt = 'WEBP' if webp else image.format
+        # JPEGs decode straight at 1/2, 1/4 or 1/8 scale, a fraction of the memory
+        image.draft('RGB', (width, max(1, image.height * width // image.width)))
+        # only the header has been read so far, size is what decoding would allocate
+        if image.width * image.height > MAX_PIXELS:
+            _count('too_large')
+            return False
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((width, width * 4), Image.LANCZOS)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        _write(image, target, fmt)
+    return True
+
+
+def _link_original(source, target):
+    # an original that needs no resizing is linked in as its own copy, so later
+    # requests find it on disk instead of opening the image again
+    try:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.link(source, target)
+    except FileExistsError:
+        pass
+    except OSError as e:
+        logger.warning(f"Could not link {source} as its own copy: {e}")
+
+
+def derive(folder, filename, size, webp=False):
+    """Name (relative to folder) of the file to send for filename at size
+
+    Makes the copy if it doesn't exist yet, returns filename itself when there
+    is nothing smaller to send.
+    """
+    if Image is None or size not in SIZES:
+        return filename
+    name = derived_name(filename, size, webp)
+    target = os.path.join(folder, name)
+    if os.path.exists(target):
+        _count('hits')
+        return name
+
+    # the first request for a copy makes it, later ones wait for that instead
+    # of making it again. only the builder removes the entry
+    with _building_lock:
+        lock = _building.get(name)
+        building = lock is None
+        if building:
+            lock = _building[name] = threading.Lock()
+            lock.acquire()
+    if not building:
+        with lock:
+            pass
+        if os.path.exists(target):
+            _count('hits')
+            return name
+        _count('originals')
+        return filename
+
+    try:
+        # the previous builder may have finished just before we registered
+        if os.path.exists(target):
+            _count('hits')
+            return name
+        source = os.path.join(folder, filename)
+        with _resize_slots:
+            made = _resize(source, target, SIZES[size], webp)
+        if not made:
+            # a WebP copy is a different format, the original can't stand in for it
+            if not webp:
+                _link_original(source, target)
+            _count('originals')
+            return filename
+        _count('generated')
+        return name
+    except Exception as e:
+        _count('errors')
+        logger.error(f"Could not make {size} copy of {filename}: {e}")
+        return filename
+    finally:
+        with _building_lock:
+            _building.pop(name, None)
+        lock.release()
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    # gunicorn forks workers after import and threads don't survive a fork
+    if _executor_pid != os.getpid():
+        if green_sockets():
+            from gevent.threadpool import ThreadPoolExecutor as Executor
+        else:
+            Executor = ThreadPoolExecutor
+        _executor = Executor(max_workers=1)
+        _executor_pid = os.getpid()
+    return _executor
+
+
+def warm(folder, filename):
+    """Make every size of a new upload in the background"""
+    if Image is None or not DERIVE_ON_UPLOAD:
+        return
+    _count('queued')
+    for size in SIZES:
+        _get_executor().submit(derive, folder, filename, size, WEBP)
+
+
+def derivative_stats():
+    with _stats_lock:
+        return dict(_stats, available=available(), webp=WEBP, sizes=SIZES)
@@ -0,0 +1,330 @@
+# content addressed storage for uploaded product images
+#
+# an upload is saved as <sha256 of its bytes>.<ext> under two levels of shard
+# directories (ab/cd/abcd....jpg), so the same photo uploaded for several
+# listings, or again after an edit, is stored once. the name never points at
+# different bytes, which is what lets serve_image mark approved images as
+# immutable. uploads from before this keep their flat uuid_name files
+#
+# there is no counter to keep in sync: the product_images rows naming a file
+# are its references. collect_garbage() deletes files (and their resized
+# copies) that no row names any more, but only once they are older than
+# IMAGE_GC_GRACE_HOURS. /upload-image hands out a url before any row exists and
+# a duplicate upload touches the file it reuses, so both stay safe until the
+# listing is saved. runs daily from the scheduler and from
+# `flask --app app images gc`
+#
+# UploadRequest (app.request_class) streams every uploaded file straight into
+# a temp file in the store as the body arrives, hashing it on the way and
+# answering 413 as soon as a file passes IMAGE_MAX_BYTES. storing it is then a
+# fsync and a rename, no copy. persist_uploads() validates and stores a
+# listing's files on IMAGE_IO_WORKERS threads, so views can do it with no
+# database connection held and open their transaction once the files are durable
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import magic
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import Blueprint, Request
+from werkzeug.exceptions import RequestEntityTooLarge
+from app import get_db_connection, green_sockets
+from image_derivatives import DERIVED_DIR, SIZES, derived_name
+
+logger = logging.getLogger(__name__)
+
+image_store_bp = Blueprint('images', __name__)
+
+UPLOAD_FOLDER = '/app/product_images'
+GC_GRACE_HOURS = int(os.getenv('IMAGE_GC_GRACE_HOURS', 24))
+# names checked against product_images per query
+GC_BATCH = 500
+READ_CHUNK = 64 * 1024
+MAX_IMAGE_BYTES = int(os.getenv('IMAGE_MAX_BYTES', 10 * 1024 * 1024))
+IO_WORKERS = int(os.getenv('IMAGE_IO_WORKERS', 4))
+
+# stored extension by sniffed content type, the client's filename isn't trusted
+MIME_EXTENSIONS = {'image/jpeg': 'jpg', 'image/png': 'png'}
+HASH_NAME = re.compile(r'^([0-9a-f]{2})([0-9a-f]{2})[0-9a-f]{60}\.[a-z]+$')
+TEMP_SUFFIX = '.upload'
+
+_stats = {'stored': 0, 'deduplicated': 0, 'gc_runs': 0, 'gc_removed': 0, 'gc_bytes': 0,
+          'last_gc_at': None, 'last_gc_error': None}
+_stats_lock = threading.Lock()
+_executor = None
+_executor_pid = None
+
+
+class InvalidUpload(Exception):
+    """An uploaded file failed validation"""
+
+    def __init__(self, filename):
+        super().__init__(f"invalid upload {filename}")
+        self.filename = filename
+
+
+class UploadFile:
+    """Temp file in the store an upload streams into, hashed as it arrives"""
+
+    def __init__(self, folder, limit):
+        fd, self.path = tempfile.mkstemp(dir=folder, suffix=TEMP_SUFFIX)
+        self.file = os.fdopen(fd, 'w+b')
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.limit = limit
+        self.kept = False
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.limit:
+            self.close()
+            raise RequestEntityTooLarge(f"Each image must be at most {self.limit // (1024 * 1024)} MB")
+        self.digest.update(data)
+        return self.file.write(data)
+
+    def __getattr__(self, name):
+        # read, seek, tell... for FileStorage and libmagic
+        return getattr(self.file, name)
+
+    def keep(self, path):
+        """Make the file durable under path"""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.path, path)
+        self.kept = True
+        # the rename itself survives a crash once the directory is synced
+        fd = os.open(os.path.dirname(path), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+        if not self.kept:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+
+class UploadRequest(Request):
+    """Request whose uploaded files stream into the image store"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if content_length is not None and content_length > MAX_IMAGE_BYTES:
+            raise RequestEntityTooLarge(f"Each image must be at most {MAX_IMAGE_BYTES // (1024 * 1024)} MB")
+        upload = UploadFile(UPLOAD_FOLDER, MAX_IMAGE_BYTES)
+        # files parsed before a failure never reach request.files, close them here
+        self.__dict__.setdefault('_uploads', []).append(upload)
+        return upload
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            for upload in self.__dict__.pop('_uploads', []):
+                upload.close()
+
+
+def stored_path(name):
+    """Path of an image relative to the upload folder, sharded for content names"""
+    match = HASH_NAME.match(name)
+    if not match:
+        return name
+    return os.path.join(match.group(1), match.group(2), name)
+
+
+def upload_extension(file):
+    """Extension for an upload from its libmagic content type, None if not an image"""
+    head = file.stream.read(2048)
+    file.stream.seek(0)
+    return MIME_EXTENSIONS.get(magic.from_buffer(head, mime=True))
+
+
+def save_upload(file, ext, folder=UPLOAD_FOLDER):
+    """Store an uploaded file under its content hash, returns the name
+
+    Files streamed in by UploadRequest are already hashed and only need to be
+    synced and renamed. Anything else is hashed while it is copied to a temp
+    file first. The temp file is dropped when the same content is stored.
+    """
+    ext = 'jpg' if ext.lower() == 'jpeg' else ext.lower()
+    upload = file.stream
+    streamed = (isinstance(upload, UploadFile) and not upload.kept and not upload.file.closed
+                and os.path.dirname(os.path.abspath(upload.path)) == os.path.abspath(folder))
+    if not streamed:
+        upload = UploadFile(folder, float('inf'))
+        try:
+            file.stream.seek(0)
+            for chunk in iter(lambda: file.stream.read(READ_CHUNK), b''):
+                upload.write(chunk)
+        except Exception:
+            upload.close()
+            raise
+
+    name = f"{upload.digest.hexdigest()}.{ext}"
+    path = os.path.join(folder, stored_path(name))
+    try:
+        try:
+            # a fresh reference, keep it out of the next collection's reach
+            os.utime(path)
+            counter = 'deduplicated'
+        except FileNotFoundError:
+            # not stored yet, or the GC removed it a moment ago
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            upload.keep(path)
+            counter = 'stored'
+    finally:
+        upload.close()
+    with _stats_lock:
+        _stats[counter] += 1
+    return name
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    # gunicorn forks workers after import and threads don't survive a fork
+    if _executor_pid != os.getpid():
+        if green_sockets():
+            from gevent.threadpool import ThreadPoolExecutor as Executor
+        else:
+            Executor = ThreadPoolExecutor
+        _executor = Executor(max_workers=IO_WORKERS)
+        _executor_pid = os.getpid()
+    return _executor
+
+
+def persist_uploads(files, validate, folder=UPLOAD_FOLDER):
+    """Validate then store a request's uploads in parallel, returns their names
+
+    validate(file) runs for every file before any is stored, the first one
+    failing raises InvalidUpload. Names come back in the order of files.
+    """
+    executor = _get_executor()
+    for file, valid in zip(files, executor.map(validate, files)):
+        if not valid:
+            raise InvalidUpload(file.filename)
+    return list(executor.map(lambda file: save_upload(file, upload_extension(file), folder), files))
+
+
+def stored_files(folder=UPLOAD_FOLDER):
+    """(name, relative path) of every original, sharded and older flat ones"""
+    for entry in os.scandir(folder):
+        if entry.name.startswith('.') or entry.name == DERIVED_DIR:
+            continue
+        if entry.is_file():
+            yield entry.name, entry.name
+        elif entry.is_dir() and len(entry.name) == 2:
+            for shard in os.scandir(entry.path):
+                if not shard.is_dir():
+                    continue
+                for image in os.scandir(shard.path):
+                    if image.is_file():
+                        yield image.name, os.path.join(entry.name, shard.name, image.name)
+
+
+def _remove(folder, path, cutoff):
+    full = os.path.join(folder, path)
+    try:
+        # re-check, a duplicate upload may have claimed it since the scan
+        if os.path.getmtime(full) >= cutoff:
+            return 0
+        size = os.path.getsize(full)
+        os.unlink(full)
+    except FileNotFoundError:
+        return 0
+    for size_name in SIZES:
+        for webp in (False, True):
+            try:
+                os.unlink(os.path.join(folder, derived_name(path, size_name, webp)))
+            except FileNotFoundError:
+                pass
+    return size
+
+
+def collect_garbage(conn, folder=UPLOAD_FOLDER, grace_hours=GC_GRACE_HOURS):
+    """Delete stored images no product_images row names, returns how many"""
+    cutoff = time.time() - grace_hours * 3600
+    candidates = []
+    for name, path in stored_files(folder):
+        try:
+            if os.path.getmtime(os.path.join(folder, path)) < cutoff:
+                candidates.append((name, path))
+        except FileNotFoundError:
+            pass
+
+    removed = freed = 0
+    cursor = conn.cursor()
+    try:
+        for start in range(0, len(candidates), GC_BATCH):
+            batch = candidates[start:start + GC_BATCH]
+            names = [name for name, path in batch if not name.endswith(TEMP_SUFFIX)]
+            referenced = set()
+            if names:
+                placeholders = ', '.join(['%s'] * len(names))
+                cursor.execute(f"""
+                    SELECT DISTINCT filename FROM product_images WHERE filename IN ({placeholders})
+                """, names)
+                referenced = {row[0] for row in cursor.fetchall()}
+            # stale temp files from interrupted uploads go too
+            for name, path in batch:
+                if name in referenced:
+                    continue
+                size = _remove(folder, path, cutoff)
+                if size:
+                    removed += 1
+                    freed += size
+    finally:
+        cursor.close()
+
+    with _stats_lock:
+        _stats['gc_runs'] += 1
+        _stats['gc_removed'] += removed
+        _stats['gc_bytes'] += freed
+        _stats['last_gc_at'] = datetime.now().isoformat()
+    return removed
+
+
+def gc_job():
+    """Scheduler entry point, owns its connection"""
+    conn = get_db_connection()
+    if conn is None:
+        return
+    try:
+        removed = collect_garbage(conn)
+        if removed:
+            logger.info(f"Image GC removed {removed} unreferenced images")
+        error = None
+    except Exception as e:
+        error = str(e)
+        logger.error(f"Image GC failed: {e}")
+    finally:
+        conn.close()
+    with _stats_lock:
+        _stats['last_gc_error'] = error
+
+
+def store_stats():
+    with _stats_lock:
+        return dict(_stats, gc_grace_hours=GC_GRACE_HOURS)
+
+
+# usage: flask --app app images gc
+@image_store_bp.cli.command('gc')
+def gc():
+    conn = get_db_connection()
+    try:
+        removed = collect_garbage(conn)
+        print(f"Removed {removed} unreferenced images")
+    except Exception as e:
+        print(f"Error collecting unreferenced images: {e}")
+    finally:
+        conn.close()
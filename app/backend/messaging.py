@@ -1,14 +1,279 @@
 # import necessary libraries and blueprints
-from flask import Blueprint, jsonify, request
-from app import get_db_connection
-from auth import token_required
+from flask import Blueprint, Response, jsonify, request
+from app import get_db_connection, release_db_connection, green_sockets
+from auth import token_required, generate_stream_ticket
+from notifier import notifier, user_channel, conversation_channel
 from datetime import datetime
 import json
+import logging
+import os
+import time
 import mysql.connector
 
 # set up blueprint w/ a base URL of /messaging
 messaging_bp = Blueprint('messaging', __name__, url_prefix='/messaging')
 
+# page sizes for paged message history
+DEFAULT_MESSAGE_PAGE = 50
+MAX_MESSAGE_PAGE = 200
+# longest ?wait= a message long poll may park for, in seconds
+MAX_MESSAGE_WAIT = int(os.getenv('MESSAGE_MAX_WAIT', 25))
+
+# seconds between keepalive comments, and before a stream ends and the browser reconnects
+STREAM_HEARTBEAT = int(os.getenv('MESSAGE_STREAM_HEARTBEAT', 20))
+STREAM_MAX_SECONDS = int(os.getenv('MESSAGE_STREAM_MAX_SECONDS', 300))
+
+# messages sent to the user that were not read yet, summed from the
+# per conversation counters (idx_participants_user_unread)
+def unread_count(conn, user_id):
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("""
+            SELECT COALESCE(SUM(unread_count), 0) as count
+            FROM conversation_participants
+            WHERE user_id = %s
+        """, (user_id,))
+        result = cursor.fetchone()
+        return int(result['count']) if result else 0
+    finally:
+        cursor.close()
+
+# a new message is unread for everyone in the conversation but its sender
+# call inside the transaction that inserts the message
+def count_unread_message(cursor, conversation_id, sender_id):
+    cursor.execute("""
+        UPDATE conversation_participants
+        SET unread_count = unread_count + 1
+        WHERE conversation_id = %s AND user_id != %s
+    """, (conversation_id, sender_id))
+
+# recompute counters from the messages table, for every participant or only
+# the conversations a user is in (e.g. before that user's rows are deleted)
+def reconcile_unread_counts(cursor, user_id=None):
+    scope = ""
+    params = ()
+    if user_id is not None:
+        scope = """
+            JOIN (
+                SELECT DISTINCT conversation_id FROM conversation_participants WHERE user_id = %s
+            ) mine ON mine.conversation_id = cp.conversation_id
+        """
+        params = (user_id,)
+    cursor.execute(f"""
+        UPDATE conversation_participants cp
+        {scope}
+        LEFT JOIN (
+            SELECT cp2.id, COUNT(*) AS unread
+            FROM conversation_participants cp2
+            JOIN messages m ON m.conversation_id = cp2.conversation_id
+                AND m.sender_id != cp2.user_id
+                AND (cp2.last_read_at IS NULL OR m.sent_at > cp2.last_read_at)
+            GROUP BY cp2.id
+        ) counts ON counts.id = cp.id
+        SET cp.unread_count = COALESCE(counts.unread, 0)
+    """, params)
+    return cursor.rowcount
+
+# Fix drifted unread counters, e.g. after deleting messages by hand
+# usage: flask --app app messaging reconcile-unread
+@messaging_bp.cli.command('reconcile-unread')
+def reconcile_unread():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        fixed = reconcile_unread_counts(cursor)
+        conn.commit()
+        print(f"Reconciled unread counters, {fixed} participants changed")
+    except Exception as e:
+        conn.rollback()
+        print(f"Error reconciling unread counters: {e}")
+    finally:
+        cursor.close()
+        conn.close()
+
+# a conversation's first product image, listings get their images when created
+FIRST_IMAGE_SQL = """
+    SELECT pi.image_url
+    FROM conversations c
+    JOIN product_images pi ON pi.product_id = c.product_id
+    WHERE c.conversation_id = {conversation}
+    ORDER BY pi.image_id ASC
+    LIMIT 1
+"""
+
+# bookkeeping for a message that was just inserted with cursor, same transaction:
+# the other participants' unread counters and the conversation's inbox summary
+def record_message(cursor, conversation_id, sender_id):
+    message_id = cursor.lastrowid
+    count_unread_message(cursor, conversation_id, sender_id)
+    # the first message creates the summary row, later ones move it forward
+    # (assignments run left to right, so last_message_id is compared last)
+    # existing values are qualified with the table name, `latest` has columns of
+    # the same names and MySQL rejects unqualified ones as ambiguous (1052)
+    cursor.execute(f"""
+        INSERT INTO conversation_summaries
+            (conversation_id, last_message_id, last_message_text, last_message_time, message_count, first_image_url)
+        SELECT * FROM (
+            SELECT m.conversation_id, m.message_id, m.message_text, m.sent_at, 1 AS message_count,
+                ({FIRST_IMAGE_SQL.format(conversation='m.conversation_id')}) AS first_image_url
+            FROM messages m
+            WHERE m.message_id = %s
+        ) AS latest
+        ON DUPLICATE KEY UPDATE
+            last_message_text = IF(conversation_summaries.last_message_id IS NULL
+                                   OR latest.message_id > conversation_summaries.last_message_id,
+                                   latest.message_text, conversation_summaries.last_message_text),
+            last_message_time = IF(conversation_summaries.last_message_id IS NULL
+                                   OR latest.message_id > conversation_summaries.last_message_id,
+                                   latest.sent_at, conversation_summaries.last_message_time),
+            last_message_id = GREATEST(COALESCE(conversation_summaries.last_message_id, 0), latest.message_id),
+            message_count = conversation_summaries.message_count + 1
+    """, (message_id,))
+
+# recompute inbox summaries from messages, for every conversation or only the
+# ones a user is in, used after messages are deleted
+def rebuild_conversation_summaries(cursor, user_id=None):
+    mine = ""
+    params = ()
+    if user_id is not None:
+        mine = """
+            JOIN (
+                SELECT DISTINCT conversation_id FROM conversation_participants WHERE user_id = %s
+            ) mine ON mine.conversation_id = {table}.conversation_id
+        """
+        params = (user_id,)
+    cursor.execute(f"""
+        DELETE cs FROM conversation_summaries cs
+        {mine.format(table='cs')}
+    """, params)
+    cursor.execute(f"""
+        INSERT INTO conversation_summaries
+            (conversation_id, last_message_id, last_message_text, last_message_time, message_count, first_image_url)
+        SELECT c.conversation_id, lm.message_id, lm.message_text, lm.sent_at, counts.message_count,
+            ({FIRST_IMAGE_SQL.format(conversation='c.conversation_id')})
+        FROM conversations c
+        {mine.format(table='c')}
+        JOIN (
+            SELECT conversation_id, COUNT(*) AS message_count, MAX(message_id) AS last_id
+            FROM messages
+            GROUP BY conversation_id
+        ) counts ON counts.conversation_id = c.conversation_id
+        JOIN messages lm ON lm.message_id = counts.last_id
+    """, params)
+    return cursor.rowcount
+
+# Rebuild every inbox summary from the messages table
+# usage: flask --app app messaging rebuild-summaries
+@messaging_bp.cli.command('rebuild-summaries')
+def rebuild_summaries():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        rebuilt = rebuild_conversation_summaries(cursor)
+        conn.commit()
+        print(f"Rebuilt {rebuilt} conversation summaries")
+    except Exception as e:
+        conn.rollback()
+        print(f"Error rebuilding conversation summaries: {e}")
+    finally:
+        cursor.close()
+        conn.close()
+
+# push fresh unread counts to the users' open streams, call after commit
+# a new message also tells the recipients which conversation it landed in
+# and wakes long polls parked on that conversation
+def push_unread(conn, user_ids, conversation_id=None, sender_id=None):
+    try:
+        if conversation_id is not None:
+            notifier.publish(conversation_channel(conversation_id), {
+                'type': 'message',
+                'data': {'conversation_id': conversation_id, 'sender_id': sender_id},
+            })
+        for user_id in user_ids:
+            if conversation_id is not None:
+                notifier.publish(user_channel(user_id), {
+                    'type': 'message',
+                    'data': {'conversation_id': conversation_id, 'sender_id': sender_id},
+                })
+            notifier.publish(user_channel(user_id), {
+                'type': 'unread',
+                'data': {'count': unread_count(conn, user_id)},
+            })
+    except Exception as e:
+        # the message is committed, streams resync when they reconnect
+        logging.error(f"Error pushing unread counts: {e}")
+
+def recipients(conn, conversation_id, sender_id):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT user_id FROM conversation_participants
+            WHERE conversation_id = %s AND user_id != %s
+        """, (conversation_id, sender_id))
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# a stream holds its request for minutes, only a greenlet is cheap enough for that
+# on sync and gthread workers it would pin a process or an OS thread, clients poll instead
+def streams_available():
+    return green_sockets()
+
+def stream_unavailable():
+    return jsonify({'error': 'Event streams need a gevent worker', 'code': 'STREAM_UNAVAILABLE'}), 503
+
+# short lived ticket for ?ticket= on /stream, EventSource can't send the Authorization header
+@messaging_bp.route('/stream-ticket', methods=['POST'])
+@token_required
+def stream_ticket(current_user):
+    if not streams_available():
+        return stream_unavailable()
+    return jsonify({'ticket': generate_stream_ticket(current_user['user_id'])})
+
+# server sent events with the user's unread count, replaces polling /unread-count
+# events: unread {count}, message {conversation_id, sender_id}
+@messaging_bp.route('/stream', methods=['GET'])
+@token_required
+def stream_events(current_user):
+    if not streams_available():
+        return stream_unavailable()
+
+    user_id = current_user['user_id']
+    # subscribe before counting so nothing sent in between is missed
+    subscription = notifier.subscribe(user_channel(user_id))
+    try:
+        count = unread_count(get_db_connection(), user_id)
+    except Exception as e:
+        subscription.close()
+        print(f"Error opening message stream: {e}")
+        return jsonify({'error': 'Failed to open message stream'}), 500
+    # nothing below touches MySQL, so the connection goes back to the pool now
+    release_db_connection()
+
+    def generate():
+        yield "retry: 5000\n" + sse('unread', {'count': count})
+        deadline = time.monotonic() + STREAM_MAX_SECONDS
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            event = subscription.get(timeout=min(STREAM_HEARTBEAT, remaining))
+            if event is None:
+                yield ": keepalive\n\n"
+            else:
+                yield sse(event['type'], event['data'])
+
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # keep nginx from buffering the stream
+        'X-Accel-Buffering': 'no',
+    })
+    response.call_on_close(subscription.close)
+    return response
+
 # Get unread message count
 @messaging_bp.route('/unread-count', methods=['GET'])
 @token_required
@@ -18,18 +283,7 @@ def get_unread_count(current_user):
         cursor = conn.cursor(dictionary=True)
         
         try:
-            # coutns messages sent to current user that were not read yet
-            cursor.execute("""
-                SELECT COUNT(*) as count 
-                FROM messages m
-                JOIN conversation_participants cp ON m.conversation_id = cp.conversation_id
-                WHERE cp.user_id = %s 
-                AND m.sender_id != %s
-                AND (m.sent_at > cp.last_read_at OR cp.last_read_at IS NULL)
-            """, (current_user['user_id'], current_user['user_id']))
-            
-            result = cursor.fetchone()
-            return jsonify({'count': result['count'] if result else 0})
+            return jsonify({'count': unread_count(conn, current_user['user_id'])})
         except mysql.connector.Error as e:
             # Handle table not found errors
             if "Table 'gator_market.conversation_participants' doesn't exist" in str(e):
@@ -59,71 +313,55 @@ def get_conversations(current_user):
         cursor = conn.cursor(dictionary=True)
         
         try:
-            # Get conversations where user is a participant
+            # Get conversations where user is a participant in one pass: counters and
+            # the last message come from the summary, the other side through the
+            # (conversation_id, user_id) key
             cursor.execute("""
                 SELECT 
                     c.*,
-                    (
-                        SELECT COUNT(*) 
-                        FROM messages m 
-                        WHERE m.conversation_id = c.conversation_id AND 
-                              m.sender_id != %s AND 
-                              (m.sent_at > cp.last_read_at OR cp.last_read_at IS NULL)
-                    ) as unread_count,
-                    (
-                        SELECT COUNT(*) 
-                        FROM messages m 
-                        WHERE m.conversation_id = c.conversation_id
-                    ) as message_count,
-                    (
-                        SELECT MAX(m.sent_at) 
-                        FROM messages m 
-                        WHERE m.conversation_id = c.conversation_id
-                    ) as last_message_time,
-                    (
-                        SELECT m.message_text 
-                        FROM messages m 
-                        WHERE m.conversation_id = c.conversation_id 
-                        ORDER BY m.sent_at DESC LIMIT 1
-                    ) as last_message_text,
+                    cp.unread_count,
+                    COALESCE(cs.message_count, 0) as message_count,
+                    cs.last_message_time,
+                    cs.last_message_text,
+                    cs.first_image_url,
                     p.name as product_name,
                     p.price as product_price,
-                    p.product_id
-                FROM conversations c
-                JOIN conversation_participants cp ON c.conversation_id = cp.conversation_id
+                    p.product_id,
+                    op.user_id as other_user_id,
+                    op.role as other_role,
+                    u.username as other_username,
+                    u.profile_picture_url as other_profile_picture_url
+                FROM conversation_participants cp
+                JOIN conversations c ON c.conversation_id = cp.conversation_id
                 JOIN products p ON c.product_id = p.product_id
+                LEFT JOIN conversation_summaries cs ON cs.conversation_id = c.conversation_id
+                LEFT JOIN conversation_participants op
+                    ON op.conversation_id = c.conversation_id AND op.user_id != cp.user_id
+                LEFT JOIN users u ON op.user_id = u.user_id
                 WHERE cp.user_id = %s
                 ORDER BY last_message_time DESC
-            """, (user_id, user_id))
+            """, (user_id,))
             
             conversations = cursor.fetchall()
             
-            # Get images and other participant for each conversation
             for convo in conversations:
-                # Fetch product images
-                cursor.execute("""
-                    SELECT image_url 
-                    FROM product_images 
-                    WHERE product_id = %s 
-                    ORDER BY image_id ASC
-                """, (convo['product_id'],))
-                images = cursor.fetchall()
+                first_image = convo.pop('first_image_url')
+                other_participant = None
+                if convo['other_user_id'] is not None:
+                    other_participant = {
+                        'user_id': convo['other_user_id'],
+                        'role': convo['other_role'],
+                        'username': convo['other_username'],
+                        'profile_picture_url': convo['other_profile_picture_url'],
+                    }
+                for key in ('other_user_id', 'other_role', 'other_username', 'other_profile_picture_url'):
+                    del convo[key]
                 
-                # Get other participant for each conversation
-                cursor.execute("""
-                    SELECT cp.user_id, cp.role, u.username, u.profile_picture_url
-                    FROM conversation_participants cp
-                    JOIN users u ON cp.user_id = u.user_id
-                    WHERE cp.conversation_id = %s AND cp.user_id != %s
-                """, (convo['conversation_id'], user_id))
-                
-                other_participant = cursor.fetchone()
-                
-                # Format the conversation data
+                # Format the conversation data, the inbox only shows the first image
                 convo['product'] = {
                     'product_id': convo['product_id'],
                     'name': convo['product_name'],
-                    'images': [img['image_url'] for img in images],
+                    'images': [first_image] if first_image else [],
                     'price': float(convo['price']) if convo.get('price') else None
                 }
                 
@@ -212,6 +450,7 @@ def create_conversation(current_user):
                     INSERT INTO messages (conversation_id, sender_id, message_text)
                     VALUES (%s, %s, %s)
                 """, (conversation_id, user_id, data['initial_message']))
+                record_message(cursor, conversation_id, user_id)
                 
                 cursor.execute("""
                     UPDATE conversations
@@ -220,6 +459,7 @@ def create_conversation(current_user):
                 """, (conversation_id,))
                 
                 conn.commit()
+                push_unread(conn, [data['recipient_id']], conversation_id, user_id)
                 
                 return jsonify({
                     'message': 'Message added to existing conversation',
@@ -250,8 +490,10 @@ def create_conversation(current_user):
                 INSERT INTO messages (conversation_id, sender_id, message_text)
                 VALUES (%s, %s, %s)
             """, (conversation_id, user_id, data['initial_message']))
+            record_message(cursor, conversation_id, user_id)
             
             conn.commit()
+            push_unread(conn, [data['recipient_id']], conversation_id, user_id)
             
             return jsonify({
                 'message': 'Conversation created successfully',
@@ -359,13 +601,60 @@ def get_conversation(current_user, conversation_id):
         if conn:
             conn.close()
             
+# one page of a conversation's messages, oldest first, plus whether more lie
+# past it, walking idx_messages_conversation with one extra row
+def fetch_message_page(cursor, conversation_id, limit, before=None, after=None):
+    if after is not None:
+        condition, params, order = "AND m.message_id > %s", (after,), "ASC"
+    elif before is not None:
+        condition, params, order = "AND m.message_id < %s", (before,), "DESC"
+    else:
+        condition, params, order = "", (), "DESC"
+    cursor.execute(f"""
+        SELECT m.*, u.username as sender_username
+        FROM messages m
+        JOIN users u ON m.sender_id = u.user_id
+        WHERE m.conversation_id = %s {condition}
+        ORDER BY m.message_id {order}
+        LIMIT %s
+    """, (conversation_id, *params, limit + 1))
+
+    messages = cursor.fetchall()
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if order == "DESC":
+        messages.reverse()
+    return messages, has_more
+
 # NEW ENDPOINT: Get messages for a conversation
+# with no paging params the whole history comes back as an array, like before
+# paged: ?limit=N is the latest page, ?before=<message_id> older messages and
+# ?after=<message_id> newer ones, as {'messages': [...oldest first], 'has_more': bool}
+# has_more says whether more messages lie past the page in the same direction
+# long poll: ?after=<message_id>&wait=<seconds> parks until a message arrives or
+# the wait runs out, holding no DB connection meanwhile
 @messaging_bp.route('/conversations/<int:conversation_id>/messages', methods=['GET'])
 @token_required
 def get_messages(current_user, conversation_id):
     user_id = current_user['user_id']
     conn = None
     cursor = None
+
+    paged = any(key in request.args for key in ('limit', 'before', 'after'))
+    try:
+        limit = max(1, min(int(request.args.get('limit', DEFAULT_MESSAGE_PAGE)), MAX_MESSAGE_PAGE))
+        before = int(request.args['before']) if request.args.get('before') else None
+        after = int(request.args['after']) if request.args.get('after') else None
+        wait = max(0.0, min(float(request.args.get('wait', 0)), MAX_MESSAGE_WAIT))
+    except ValueError:
+        return jsonify({'error': 'limit, before and after must be integers, wait a number'}), 400
+    if before is not None and after is not None:
+        return jsonify({'error': 'Use either before or after, not both'}), 400
+    # a parked poll holds its request for up to MAX_MESSAGE_WAIT, cheap only on a
+    # greenlet. sync and gthread workers answer right away and the client polls
+    if after is None or not green_sockets():
+        wait = 0
+    subscription = None
     
     try:
         conn = get_db_connection()
@@ -382,22 +671,44 @@ def get_messages(current_user, conversation_id):
         if not participant:
             return jsonify({'error': 'You are not a participant in this conversation'}), 403
         
-        # Get messages for this conversation
-        cursor.execute("""
-            SELECT m.*, u.username as sender_username
-            FROM messages m
-            JOIN users u ON m.sender_id = u.user_id
-            WHERE m.conversation_id = %s
-            ORDER BY m.sent_at ASC
-        """, (conversation_id,))
-        
-        messages = cursor.fetchall()
-        
-        return jsonify(messages)
+        if not paged:
+            # Get messages for this conversation
+            cursor.execute("""
+                SELECT m.*, u.username as sender_username
+                FROM messages m
+                JOIN users u ON m.sender_id = u.user_id
+                WHERE m.conversation_id = %s
+                ORDER BY m.sent_at ASC
+            """, (conversation_id,))
+            
+            messages = cursor.fetchall()
+            
+            return jsonify(messages)
+
+        # subscribe before reading so a message sent in between still wakes us
+        if wait:
+            subscription = notifier.subscribe(conversation_channel(conversation_id))
+
+        messages, has_more = fetch_message_page(cursor, conversation_id, limit, before, after)
+
+        if wait and not messages:
+            cursor.close()
+            cursor = None
+            release_db_connection()
+            if subscription.get(timeout=wait) is None:
+                return jsonify({'messages': [], 'has_more': False})
+            # woken by send_message, read with a fresh pooled connection
+            conn = get_db_connection()
+            cursor = conn.cursor(dictionary=True)
+            messages, has_more = fetch_message_page(cursor, conversation_id, limit, after=after)
+
+        return jsonify({'messages': messages, 'has_more': has_more})
     except Exception as e:
         print(f"Error getting messages: {e}")
         return jsonify({'error': str(e)}), 500
     finally:
+        if subscription:
+            subscription.close()
         if cursor:
             cursor.close()
         if conn:
@@ -439,6 +750,7 @@ def send_message(current_user, conversation_id):
             INSERT INTO messages (conversation_id, sender_id, message_text)
             VALUES (%s, %s, %s)
         """, (conversation_id, user_id, data['message_text']))
+        record_message(cursor, conversation_id, user_id)
         
         # Update the conversation's last_updated_at timestamp
         cursor.execute("""
@@ -448,6 +760,7 @@ def send_message(current_user, conversation_id):
         """, (conversation_id,))
         
         conn.commit()
+        push_unread(conn, recipients(conn, conversation_id, user_id), conversation_id, user_id)
         
         return jsonify({'message': 'Message sent successfully'}), 201
     except Exception as e:
@@ -473,14 +786,16 @@ def mark_as_read(current_user, conversation_id):
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        # Update the last_read_at timestamp for this user in this conversation
+        # Update the last_read_at timestamp and clear the unread counter for this user in this conversation
         cursor.execute("""
             UPDATE conversation_participants
-            SET last_read_at = CURRENT_TIMESTAMP
+            SET last_read_at = CURRENT_TIMESTAMP, unread_count = 0
             WHERE conversation_id = %s AND user_id = %s
         """, (conversation_id, user_id))
         
         conn.commit()
+        # the user's other tabs drop their badge too
+        push_unread(conn, [user_id])
         
         return jsonify({'message': 'Messages marked as read'}), 200
     except Exception as e:
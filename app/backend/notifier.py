@@ -0,0 +1,167 @@
+# in process pub/sub for pushing events to waiting clients, e.g. unread
+# counts to /messaging/stream and new messages to parked long polls
+#
+# gunicorn runs several worker processes, so an event published by one worker
+# also has to reach streams held open by the others. every worker that has a
+# subscriber binds a unix datagram socket in NOTIFY_SOCKET_DIR, and publish()
+# sends the event to each socket there besides delivering it locally
+# no broker and no database polling, idle streams cost nothing
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+
+logger = logging.getLogger(__name__)
+
+# datagrams larger than this are dropped, events are small json objects
+MAX_EVENT_BYTES = 8192
+
+
+class Subscription:
+    """Events for one channel, read with get() and closed when the stream ends"""
+
+    def __init__(self, notifier, channel, maxsize=100):
+        self.notifier = notifier
+        self.channel = channel
+        self.queue = queue.Queue(maxsize=maxsize)
+
+    def get(self, timeout=None):
+        """Next event dict, or None when nothing arrived within timeout"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.notifier.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Notifier:
+    def __init__(self, socket_dir):
+        self.socket_dir = socket_dir
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._pid = None
+        self._sock = None
+        self._path = None
+        self._counters = {'published': 0, 'delivered': 0, 'dropped': 0, 'peers_removed': 0}
+
+    # ---- local subscribers ----
+
+    def subscribe(self, channel):
+        self._listen()
+        subscription = Subscription(self, channel)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+    def _deliver(self, channel, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(event)
+                self._counters['delivered'] += 1
+            except queue.Full:
+                # a stuck client only loses its own events
+                self._counters['dropped'] += 1
+
+    # ---- publishing ----
+
+    def publish(self, channel, event):
+        """Send an event to every subscriber of channel in every worker"""
+        self._counters['published'] += 1
+        self._deliver(channel, event)
+        try:
+            self._broadcast(json.dumps({'channel': channel, 'event': event}, default=str).encode('utf-8'))
+        except Exception as e:
+            # pushes are best effort, clients resync on reconnect
+            logger.error(f"Notifier broadcast failed: {e}")
+
+    def _broadcast(self, payload):
+        if len(payload) > MAX_EVENT_BYTES or not os.path.isdir(self.socket_dir):
+            return
+        sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sender.setblocking(False)
+        try:
+            for name in os.listdir(self.socket_dir):
+                path = os.path.join(self.socket_dir, name)
+                if not name.endswith('.sock') or path == self._path:
+                    continue
+                try:
+                    sender.sendto(payload, path)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # the worker that owned it is gone
+                    self._remove_peer(path)
+                except BlockingIOError:
+                    self._counters['dropped'] += 1
+        finally:
+            sender.close()
+
+    def _remove_peer(self, path):
+        try:
+            os.unlink(path)
+            self._counters['peers_removed'] += 1
+        except OSError:
+            pass
+
+    # ---- receiving from other workers ----
+
+    def _listen(self):
+        # bind once per process, gunicorn forks workers after import
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            os.makedirs(self.socket_dir, exist_ok=True)
+            path = os.path.join(self.socket_dir, f"worker-{os.getpid()}.sock")
+            if os.path.exists(path):
+                os.unlink(path)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(path)
+            self._sock, self._path, self._pid = sock, path, os.getpid()
+        threading.Thread(target=self._receive, args=(sock,), name='notifier', daemon=True).start()
+
+    def _receive(self, sock):
+        while True:
+            try:
+                payload = sock.recv(MAX_EVENT_BYTES)
+                message = json.loads(payload)
+                self._deliver(message['channel'], message['event'])
+            except OSError:
+                return
+            except Exception as e:
+                logger.error(f"Notifier dropped a bad datagram: {e}")
+
+    def stats(self):
+        with self._lock:
+            subscribers = sum(len(s) for s in self._subscribers.values())
+        return dict(self._counters, subscribers=subscribers, listening=self._pid == os.getpid())
+
+
+notifier = Notifier(os.getenv('NOTIFY_SOCKET_DIR', '/tmp/gatormarket-notify'))
+
+
+def user_channel(user_id):
+    return f"user:{user_id}"
+
+
+def conversation_channel(conversation_id):
+    return f"conversation:{conversation_id}"
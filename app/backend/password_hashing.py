@@ -0,0 +1,135 @@
+# bcrypt hashing and checking, off the request thread
+#
+# one bcrypt call is tens of milliseconds of CPU, so a login burst run inline
+# starves every other endpoint. calls go to a pool of BCRYPT_WORKERS threads
+# (bcrypt releases the GIL while it works) with at most BCRYPT_MAX_QUEUE more
+# waiting. past that PasswordPoolBusy is raised and the view answers 429 with
+# Retry-After instead of queueing without limit
+#
+# BCRYPT_ROUNDS is the cost of new hashes, a successful login whose stored
+# hash has a different cost is rehashed with the current one
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+from flask import jsonify
+
+from app import green_sockets
+
+
+class PasswordPoolBusy(Exception):
+    """Every worker is busy and the queue is full"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"password hashing is saturated, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    def __init__(self, rounds=12, workers=2, max_queue=16):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._counters = {'rejected': 0, 'rehashed': 0}
+        self._latency = {op: {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'wait_ms': 0.0}
+                         for op in ('hash', 'check')}
+
+    def _get_executor(self):
+        # gunicorn forks workers after import and threads don't survive a fork
+        if self._pid != os.getpid():
+            if green_sockets():
+                # real OS threads, a patched greenlet "thread" would stall the hub
+                from gevent.threadpool import ThreadPoolExecutor as Executor
+            else:
+                Executor = ThreadPoolExecutor
+            self._executor = Executor(max_workers=self.workers)
+            self._pid = os.getpid()
+        return self._executor
+
+    def _retry_after(self):
+        # time to drain the queue at the average call cost, at least a second
+        calls = sum(s['count'] for s in self._latency.values())
+        total_ms = sum(s['total_ms'] for s in self._latency.values())
+        average = total_ms / calls / 1000 if calls else 0.25
+        return max(1, math.ceil(average * self._in_flight / self.workers))
+
+    def _run(self, op, fn, *args):
+        with self._lock:
+            if self._in_flight >= self.workers + self.max_queue:
+                self._counters['rejected'] += 1
+                raise PasswordPoolBusy(self._retry_after())
+            self._in_flight += 1
+            executor = self._get_executor()
+        submitted = time.monotonic()
+        try:
+            started, result = executor.submit(self._timed, fn, *args).result()
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+        finished = time.monotonic()
+        with self._lock:
+            stats = self._latency[op]
+            elapsed_ms = (finished - submitted) * 1000
+            stats['count'] += 1
+            stats['total_ms'] += elapsed_ms
+            stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+            stats['wait_ms'] += (started - submitted) * 1000
+        return result
+
+    @staticmethod
+    def _timed(fn, *args):
+        return time.monotonic(), fn(*args)
+
+    def hash(self, password):
+        """bcrypt hash of password at the current cost, as a str"""
+        salt = bcrypt.gensalt(rounds=self.rounds)
+        return self._run('hash', bcrypt.hashpw, password.encode('utf-8'), salt).decode('utf-8')
+
+    def check(self, password, password_hash):
+        return self._run('check', bcrypt.checkpw, password.encode('utf-8'), password_hash.encode('utf-8'))
+
+    def needs_rehash(self, password_hash):
+        """True when password_hash was made with a different cost than BCRYPT_ROUNDS"""
+        try:
+            # $2b$12$<salt+hash>
+            return int(password_hash.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def record_rehash(self):
+        with self._lock:
+            self._counters['rehashed'] += 1
+
+    def stats(self):
+        with self._lock:
+            latency = {}
+            for op, s in self._latency.items():
+                latency[op] = {
+                    'count': s['count'],
+                    'avg_ms': round(s['total_ms'] / s['count'], 1) if s['count'] else None,
+                    'max_ms': round(s['max_ms'], 1),
+                    'avg_wait_ms': round(s['wait_ms'] / s['count'], 1) if s['count'] else None,
+                }
+            return dict(self._counters, rounds=self.rounds, workers=self.workers,
+                        max_queue=self.max_queue, in_flight=self._in_flight, latency=latency)
+
+
+password_hasher = PasswordHasher(
+    rounds=int(os.getenv('BCRYPT_ROUNDS', 12)),
+    workers=int(os.getenv('BCRYPT_WORKERS', 2)),
+    max_queue=int(os.getenv('BCRYPT_MAX_QUEUE', 16)),
+)
+
+
+def too_busy(e):
+    """429 response for a PasswordPoolBusy"""
+    response = jsonify({'error': 'Server is busy, please try again shortly'})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 429
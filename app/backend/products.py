@@ -1,21 +1,45 @@
 # import necessary blueprints and libraries
-from flask import Blueprint, jsonify, request, send_from_directory
-from app import get_db_connection
+from flask import Blueprint, jsonify, request, send_from_directory, current_app
+from werkzeug.exceptions import RequestEntityTooLarge
+from app import get_db_connection, release_db_connection
 from auth import token_required
+from text_search import boolean_query
+from catalog_index import catalog, record_product_change, product_changed
+from cascade import remove_products
+from image_derivatives import SIZES, accepts_webp, derive, warm, WEBP
+from image_store import UPLOAD_FOLDER, InvalidUpload, persist_uploads, save_upload, stored_path, upload_extension
+from response_cache import cached_json, product_scope, invalidate_product, invalidate_from_catalog
 import os
-import uuid
 import re
 import magic  # for MIME type checking
 import traceback
+import base64
+import datetime
+import json
+import mimetypes
 
 # create blueprint for all product related routes
 products_bp = Blueprint('products', __name__, url_prefix='/products')
 
 # defining constants for image handling
-UPLOAD_FOLDER = '/app/product_images'
+# uploads live in image_store.UPLOAD_FOLDER, named by the sha256 of their bytes
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 ALLOWED_MIMES = {'image/png', 'image/jpeg'}
 
+# who sends approved image bytes once serve_image has checked the listing
+#   unset   Python streams the file with send_from_directory
+#   nginx   X-Accel-Redirect to IMAGE_ACCEL_PREFIX, an internal nginx location
+#           aliased to UPLOAD_FOLDER (app/frontend/my-app/nginx.conf)
+#   sendfile  X-Sendfile with the file's path, for Apache / lighttpd
+IMAGE_ACCEL = os.getenv('IMAGE_ACCEL', '').lower()
+IMAGE_ACCEL_PREFIX = os.getenv('IMAGE_ACCEL_PREFIX', '/protected-images/')
+# an image name never points at different bytes, browsers and CDNs keep approved ones
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# page sizes for /products/search
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
 # ensure image directory exists
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
@@ -55,52 +79,114 @@ def upload_image(current_user):
         if not verify_image_content(file):
             return jsonify({'error': 'Invalid image content or potentially unsafe file'}), 400
             
-        filename = secure_filename(file.filename)
-        unique_filename = f"{uuid.uuid4()}_{filename}"
-        file_path = os.path.join(UPLOAD_FOLDER, unique_filename)
-        file.save(file_path)
-        image_url = f'/products/serve-image/{unique_filename}'
+        # same bytes, same name: a repeated upload reuses the stored file
+        name = save_upload(file, upload_extension(file), UPLOAD_FOLDER)
+        warm(UPLOAD_FOLDER, stored_path(name))
+        image_url = f'/products/serve-image/{name}'
         return jsonify({'url': image_url}), 200
+    except RequestEntityTooLarge as e:
+        return jsonify({'error': e.description}), 413
     except Exception as e:
         print(f"Error uploading image: {e}")
         return jsonify({'error': f'Failed to upload image: {str(e)}'}), 500
 
+# response for an approved image, the front server sends the bytes when IMAGE_ACCEL is set
+def send_image(filename):
+    if IMAGE_ACCEL not in ('nginx', 'sendfile'):
+        return send_from_directory(UPLOAD_FOLDER, filename)
+    response = current_app.response_class(
+        mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+    if IMAGE_ACCEL == 'nginx':
+        response.headers['X-Accel-Redirect'] = IMAGE_ACCEL_PREFIX + filename
+    else:
+        response.headers['X-Sendfile'] = os.path.join(UPLOAD_FOLDER, filename)
+    return response
+
 # securely serves product images if approved
+# ?size=thumb|medium sends a resized copy (image_derivatives), listing pages
+# transfer a fraction of the bytes of the original upload
 @products_bp.route('/serve-image/<path:filename>', methods=['GET'])
 def serve_image(filename):
     clean_filename = os.path.basename(filename)
+    size = request.args.get('size')
+    if size and size not in SIZES:
+        return jsonify({'error': f"size must be one of {', '.join(SIZES)}"}), 400
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
+    # equality on the indexed filename column, one row whatever the table size
     cursor.execute("""
         SELECT p.product_id, p.approval_status 
-        FROM products p
-        JOIN product_images pi ON p.product_id = pi.product_id
-        WHERE pi.image_url LIKE %s
-    """, (f'%{clean_filename}',))
+        FROM product_images pi
+        JOIN products p ON p.product_id = pi.product_id
+        WHERE pi.filename = %s AND p.status != 'deleted'
+        ORDER BY p.approval_status = 'approved' DESC
+        LIMIT 1
+    """, (clean_filename,))
     product = cursor.fetchone()
     cursor.close()
-    conn.close()
+    # the rest is disk I/O, give the connection back first
+    release_db_connection()
 
     if product and product['approval_status'] == 'approved':
-        return send_from_directory(UPLOAD_FOLDER, clean_filename)
+        path = stored_path(clean_filename)
+        if size:
+            webp = accepts_webp(request.headers.get('Accept'))
+            response = send_image(derive(UPLOAD_FOLDER, path, size, webp))
+            if WEBP:
+                response.vary.add('Accept')
+        else:
+            response = send_image(path)
+        response.headers['Cache-Control'] = IMMUTABLE
+        return response
     elif product and product['approval_status'] == 'pending':
-        return send_from_directory('/app/static/images', 'pending_approval.png')
+        # the same url serves the real image once approved
+        response = send_from_directory('/app/static/images', 'pending_approval.png')
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
     else:
         return jsonify({'error': 'Image not found'}), 404
 
+# loads image urls for a whole page of products with one query instead of one per row
+def attach_images(cursor, products):
+    if not products:
+        return
+    product_ids = [product['product_id'] for product in products]
+    placeholders = ', '.join(['%s'] * len(product_ids))
+    cursor.execute(f"""
+        SELECT product_id, image_url
+        FROM product_images
+        WHERE product_id IN ({placeholders})
+        ORDER BY image_id ASC
+    """, tuple(product_ids))
+    images_by_product = {}
+    for img in cursor.fetchall():
+        images_by_product.setdefault(img['product_id'], []).append(img['image_url'])
+    for product in products:
+        product['images'] = images_by_product.get(product['product_id'], [])
+
+# other workers' writes reach this worker's response cache through the catalog poll
+catalog.add_listener(invalidate_from_catalog)
+
 # fetches full product details and related images
 @products_bp.route('/<int:product_id>', methods=['GET'])
+@cached_json()
 def get_product(product_id):
+    # approved listings come from the in memory catalog, anything else from MySQL
+    if current_app.config['CATALOG_INDEX_ENABLED'] and catalog.ensure_fresh():
+        product = catalog.get(product_id)
+        if product:
+            return jsonify(product)
+
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
 
     # Fetch product info
     cursor.execute("""
-        SELECT p.*, u.username,
-               (SELECT AVG(rating) FROM reviews WHERE seller_id = p.user_id) as seller_rating
+        SELECT p.*, u.username, sr.rating_avg as seller_rating
         FROM products p
         JOIN users u ON p.user_id = u.user_id
-        WHERE p.product_id = %s
+        LEFT JOIN seller_ratings sr ON sr.seller_id = p.user_id
+        WHERE p.product_id = %s AND p.status != 'deleted'
     """, (product_id,))
     product = cursor.fetchone()
 
@@ -120,30 +206,106 @@ def get_product(product_id):
     else:
         return jsonify({'error': 'Product not found'}), 404
 
+# pagination cursors are opaque tokens wrapping a small json list
+# recent sort: (created_at, product_id) of the last row served (keyset)
+# relevance sort: the offset of the next page
+def encode_cursor(*values):
+    values = [v.isoformat() if isinstance(v, datetime.datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+def decode_cursor(token):
+    return json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+
 # enables product filtering by search term, category, or user
+# returns {'products': [...], 'next_cursor': ...} pages of `limit` rows
+# pass next_cursor back as `cursor` for the following page
+# sort=recent (default) is newest first, sort=relevance ranks term matches
+# all=true returns every match as a plain array like before
+def search_scope():
+    # the result set a search reads from, see response_cache for the tags
+    user_id = request.args.get('user_id')
+    category = request.args.get('category')
+    if user_id:
+        return [f"listings:{user_id}"]
+    if category and category != "All Categories":
+        return [f"category:{category.lower()}"]
+    return ['catalog']
+
 @products_bp.route('/search', methods=['GET'])
+@cached_json(search_scope)
 def search_products():
     term = request.args.get('term')
     category = request.args.get('category')
     user_id = request.args.get('user_id')
+    sort = request.args.get('sort', 'recent')
+    return_all = request.args.get('all', 'false').lower() == 'true'
+
+    if sort not in ('recent', 'relevance'):
+        return jsonify({'error': 'sort must be recent or relevance'}), 400
+
+    # stemmed FULLTEXT query, None when the term has no indexable words
+    ft_query = boolean_query(term) if term else None
+    by_relevance = sort == 'relevance' and ft_query is not None
+
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+        after = decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+        offset = 0
+        if after and by_relevance:
+            offset = int(after[0])
+            if offset < 0:
+                raise ValueError('negative offset')
+        elif after:
+            after = (datetime.datetime.fromisoformat(after[0]), int(after[1]))
+    except (ValueError, TypeError, IndexError, KeyError):
+        return jsonify({'error': 'Invalid limit or cursor'}), 400
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    # the in memory catalog answers everything except relevance ranking
+    if (current_app.config['CATALOG_INDEX_ENABLED'] and not by_relevance
+            and (not user_id or user_id.isdigit()) and catalog.ensure_fresh()):
+        products, has_more = catalog.search(
+            term=term,
+            category=category if category != "All Categories" else None,
+            user_id=int(user_id) if user_id else None,
+            after=None if return_all else after,
+            limit=None if return_all else limit,
+        )
+        if return_all:
+            return jsonify(products)
+        next_cursor = None
+        if has_more:
+            next_cursor = encode_cursor(products[-1]['created_at'], products[-1]['product_id'])
+        return jsonify({'products': products, 'next_cursor': next_cursor})
 
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
     query = """
-        SELECT p.*, u.username,
-               (SELECT AVG(rating) FROM reviews WHERE seller_id = p.user_id) as seller_rating
+        SELECT p.*, u.username, sr.rating_avg as seller_rating
+    """
+    params = []
+    if by_relevance:
+        query += ", MATCH(p.name, p.description) AGAINST (%s IN BOOLEAN MODE) as relevance"
+        params.append(ft_query)
+    query += """
         FROM products p
         JOIN users u ON p.user_id = u.user_id
+        LEFT JOIN seller_ratings sr ON sr.seller_id = p.user_id
         JOIN categories c ON p.category_id = c.category_id
         WHERE p.approval_status = 'approved'
     """
-    params = []
 
     # filter out sold items if not viewing a specific user's listings
     if not user_id:
         query += "AND p.status = 'active'"
+    else:
+        query += "AND p.status != 'deleted'"
     
-    if term:
+    if ft_query:
+        query += " AND MATCH(p.name, p.description) AGAINST (%s IN BOOLEAN MODE)"
+        params.append(ft_query)
+    elif term:
+        # terms made only of short words or stopwords aren't in the FULLTEXT index
         query += " AND (p.name LIKE %s OR p.description LIKE %s)"
         params.extend([f"%{term}%", f"%{term}%"])
     if category and category != "All Categories":
@@ -152,21 +314,47 @@ def search_products():
     if user_id:
         query += " AND p.user_id = %s"
         params.append(user_id)
-    query += " ORDER BY p.created_at DESC"
+    if after and not return_all and not by_relevance:
+        query += " AND (p.created_at < %s OR (p.created_at = %s AND p.product_id < %s))"
+        params.extend([after[0], after[0], after[1]])
+    if by_relevance:
+        query += " ORDER BY relevance DESC, p.product_id DESC"
+    else:
+        query += " ORDER BY p.created_at DESC, p.product_id DESC"
+    if not return_all:
+        # one extra row tells us whether there is a next page
+        query += " LIMIT %s"
+        params.append(limit + 1)
+        if by_relevance:
+            query += " OFFSET %s"
+            params.append(offset)
 
     cursor.execute(query, tuple(params))
     products = cursor.fetchall()
-    for product in products:
-        cursor.execute("SELECT image_url FROM product_images WHERE product_id = %s", (product['product_id'],))
-        images = cursor.fetchall()
-        product['images'] = [img['image_url'] for img in images]
 
+    next_cursor = None
+    if not return_all and len(products) > limit:
+        products = products[:limit]
+        if by_relevance:
+            next_cursor = encode_cursor(offset + limit)
+        else:
+            next_cursor = encode_cursor(products[-1]['created_at'], products[-1]['product_id'])
+
+    attach_images(cursor, products)
+    for product in products:
+        product.pop('relevance', None)
         product['seller_rating'] = float(product['seller_rating']) if product['seller_rating'] else 0.0
     cursor.close()
     conn.close()
-    return jsonify(products)
+
+    if return_all:
+        return jsonify(products)
+    return jsonify({'products': products, 'next_cursor': next_cursor})
 
 # creates new product listing w/ image validation and saving
+# files stream to disk while the body arrives (image_store.UploadRequest), are
+# checked and synced a few at a time with no pooled connection held, and the
+# transaction only starts once every file is durable
 @products_bp.route('/', methods=['POST'])
 @token_required
 def create_product(current_user):
@@ -181,10 +369,11 @@ def create_product(current_user):
                 WHERE user_id = %s AND status = 'active'
             """, (current_user['user_id'],))
             product_count = cursor.fetchone()[0]
+            cursor.close()
+            # reading the upload is disk and network time, give the connection back
+            release_db_connection()
             
             if product_count >= 100:
-                cursor.close()
-                conn.close()
                 return jsonify({'error': 'You have reached the maximum limit of 100 active products'}), 400
 
             # Validate all images before creating the product
@@ -192,26 +381,21 @@ def create_product(current_user):
             
             # Check if any images were provided
             if not images or len(images) == 0:
-                cursor.close()
-                conn.close()
                 return jsonify({'error': 'At least one image is required for the product'}), 400
                 
             # Validate each image
             for file in images:
                 if not file or file.filename == '':
-                    cursor.close()
-                    conn.close()
                     return jsonify({'error': 'Invalid file uploaded'}), 400
                     
                 if not allowed_file(file.filename):
-                    cursor.close()
-                    conn.close()
                     return jsonify({'error': f'Invalid file type for {file.filename}. Allowed types: png, jpg, jpeg'}), 400
-                
-                if not verify_image_content(file):
-                    cursor.close()
-                    conn.close()
-                    return jsonify({'error': f'Invalid image content or potentially unsafe file: {file.filename}'}), 400
+            
+            # content checks for every file, then fsync'd into the image store
+            try:
+                stored = persist_uploads(images, verify_image_content, UPLOAD_FOLDER)
+            except InvalidUpload as e:
+                return jsonify({'error': f'Invalid image content or potentially unsafe file: {e.filename}'}), 400
             
             # If all images passed validation, continue with product creation
             name = request.form.get('name')
@@ -220,7 +404,9 @@ def create_product(current_user):
             condition = request.form.get('condition')
             category_id = request.form.get('category_id')
 
-            # Insert product
+            # Insert product, a failure here leaves the files to the image GC
+            conn = get_db_connection()
+            cursor = conn.cursor()
             cursor.execute("""
                 INSERT INTO products (
                     user_id, name, description, price, 
@@ -232,33 +418,32 @@ def create_product(current_user):
             ))
             product_id = cursor.lastrowid
 
-            # Save images - we've already validated them above
-            for file in images:
-                filename = secure_filename(file.filename)
-                unique_filename = f"{uuid.uuid4()}_{filename}"
-                file_path = os.path.join(UPLOAD_FOLDER, unique_filename)
-                file.save(file_path)
-                image_url = f'/products/serve-image/{unique_filename}'
-
-                cursor.execute("""
-                    INSERT INTO product_images (product_id, image_url)
-                    VALUES (%s, %s)
-                """, (product_id, image_url))
+            # one row per image, in upload order so the first stays the cover
+            cursor.executemany("""
+                INSERT INTO product_images (product_id, image_url)
+                VALUES (%s, %s)
+            """, [(product_id, f'/products/serve-image/{image}') for image in stored])
 
             conn.commit()
             cursor.close()
             conn.close()
 
+            for image in stored:
+                warm(UPLOAD_FOLDER, stored_path(image))
+
             return jsonify({'message': 'Product created successfully', 'product_id': product_id}), 201
 
         else:
             return jsonify({'error': 'Unsupported content type. Use multipart/form-data for file uploads.'}), 400
+    except RequestEntityTooLarge as e:
+        return jsonify({'error': e.description}), 413
     except Exception as e:
         print(f"Error creating product: {e}")
         return jsonify({'error': f'Failed to create product: {str(e)}'}), 500
 
 
 # route to update product details if user is owner
+# the request scoped connection is returned by the app teardown hook, early returns included
 @products_bp.route('/<int:product_id>', methods=['PUT'])
 @token_required
 def update_product(current_user, product_id):
@@ -270,6 +455,7 @@ def update_product(current_user, product_id):
         product = cursor.fetchone()
         if not product or product['user_id'] != current_user['user_id']:
             return jsonify({'error': 'Unauthorized to update this product'}), 403
+        before = product_scope(conn, product_id)
 
         query = """
             UPDATE products
@@ -288,7 +474,10 @@ def update_product(current_user, product_id):
             data.get('category_id'),
             product_id
         ))
+        record_product_change(cursor, product_id)
         conn.commit()
+        product_changed(conn, product_id)
+        invalidate_product(product_id, before, product_scope(conn, product_id))
 
         # Get updated product details
         cursor.execute("SELECT * FROM products WHERE product_id = %s", (product_id,))
@@ -300,7 +489,6 @@ def update_product(current_user, product_id):
         updated_product['images'] = [img['image_url'] for img in images]
 
         cursor.close()
-        conn.close()
 
         return jsonify({'message': 'Product updated successfully', 'product': updated_product}), 200
     except Exception as e:
@@ -323,36 +511,16 @@ def delete_product(current_user, product_id):
             cursor.close()
             conn.close()
             return jsonify({'error': 'Unauthorized to delete this product'}), 403
+        before = product_scope(conn, product_id)
         
-        
-        # Step 1: Delete from wishlist_tracking
-        cursor.execute("DELETE FROM wishlist_tracking WHERE product_id = %s", (product_id,))
-        
-        # Step 2: Find all conversations related to this product
-        cursor.execute("SELECT conversation_id FROM conversations WHERE product_id = %s", (product_id,))
-        conversations = cursor.fetchall()
-        
-        # Step 3: Delete messages from these conversations
-        for conv in conversations:
-            conversation_id = conv[0]
-            cursor.execute("DELETE FROM messages WHERE conversation_id = %s", (conversation_id,))
-            
-        # Step 4: Delete conversation participants
-        for conv in conversations:
-            conversation_id = conv[0]
-            cursor.execute("DELETE FROM conversation_participants WHERE conversation_id = %s", (conversation_id,))
-            
-        # Step 5: Delete conversations
-        cursor.execute("DELETE FROM conversations WHERE product_id = %s", (product_id,))
-        
-        # Step 6: Delete product images (This should happen automatically due to ON DELETE CASCADE)
-        
-        # Step 7: Finally delete the product
-        cursor.execute("DELETE FROM products WHERE product_id = %s", (product_id,))
-        affected = cursor.rowcount
+        # the listing, its conversations, wishlist rows and images in a fixed
+        # number of statements (or just flagged, with CASCADE_SOFT_DELETE)
+        affected = len(remove_products(cursor, [product_id])['products'])
         
         # Commit transaction
         conn.commit()
+        product_changed(conn, product_id)
+        invalidate_product(product_id, before)
         cursor.close()
         conn.close()
         
@@ -384,9 +552,11 @@ def mark_product_as_sold(current_user, product_id):
             return jsonify({'error': 'Unauthorized'}), 403
         cursor.execute("UPDATE products SET status = 'sold' WHERE product_id = %s", (product_id,))
         cursor.execute("UPDATE wishlist_tracking SET notified = FALSE WHERE product_id = %s", (product_id,))
+        record_product_change(cursor, product_id)
         conn.commit()
+        product_changed(conn, product_id)
+        invalidate_product(product_id, product_scope(conn, product_id))
         cursor.close()
-        conn.close()
         return jsonify({'message': 'Product marked as sold'}), 200
     except Exception as e:
         print(f"Error marking product as sold: {e}")
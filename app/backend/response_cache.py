@@ -0,0 +1,195 @@
+# cache of serialized JSON responses for the public product GET routes
+# bounded by entry count and total bytes (LRU), entries expire after a ttl and
+# are dropped early through tags:
+#   product:<id>   every response that contains the product
+#   seller:<id>    every response that contains one of the seller's products (ratings)
+#   listings:<id>  searches scoped to one seller's listings
+#   category:<nm>  searches scoped to one category
+#   catalog        every other search (feed, term search)
+import collections
+import os
+import threading
+import time
+from functools import wraps
+from urllib.parse import urlencode
+from flask import current_app, request
+from conditional import conditional, etag_for, not_modified
+from catalog_index import catalog
+
+
+class ResponseCache:
+    """LRU + TTL cache of response bodies with tag based invalidation"""
+
+    def __init__(self, ttl=30, max_entries=512, max_bytes=8 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # key -> (expires_at, body, etag, tags)
+        self._entries = collections.OrderedDict()
+        self._tags = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, key):
+        """(body, etag) of a live entry or None"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    self._drop(key)
+                self._counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+            return entry[1], entry[2]
+
+    def set(self, key, body, tags, etag=None):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, body, etag, frozenset(tags))
+            self._bytes += len(body)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            self._counters['stores'] += 1
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self._counters['evictions'] += 1
+
+    def invalidate(self, *tags):
+        with self._lock:
+            for tag in tags:
+                for key in self._tags.pop(tag, ()):
+                    if key in self._entries:
+                        self._drop(key)
+                        self._counters['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._bytes = 0
+
+    def _drop(self, key):
+        # caller holds the lock
+        _, body, _, tags = self._entries.pop(key)
+        self._bytes -= len(body)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({'entries': len(self._entries), 'bytes': self._bytes, 'ttl': self.ttl})
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
+
+
+response_cache = ResponseCache(
+    ttl=int(os.getenv('RESPONSE_CACHE_TTL', 30)),
+    max_entries=int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 512)),
+    max_bytes=int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 8 * 1024 * 1024)),
+)
+
+
+def _content_tags(data):
+    # tags for every product found in a product, product list or search page
+    if isinstance(data, dict) and isinstance(data.get('products'), list):
+        data = data['products']
+    products = data if isinstance(data, list) else [data]
+    tags = set()
+    for product in products:
+        if isinstance(product, dict) and 'product_id' in product:
+            tags.add(f"product:{product['product_id']}")
+            if 'user_id' in product:
+                tags.add(f"seller:{product['user_id']}")
+    return tags
+
+
+def cached_json(scope_tags=None):
+    """Cache 200 JSON responses of a GET view, with their ETag
+
+    scope_tags(**view_kwargs) returns the tags of the result set the view
+    searched, so new matches invalidate it too. A cached entry whose ETag
+    matches If-None-Match is answered with a 304 without touching the body.
+    Other workers' writes reach the cache through the catalog poll, so it
+    runs (throttled) before every lookup, hits and 304s included.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if not current_app.config['RESPONSE_CACHE_ENABLED']:
+                return conditional(current_app.make_response(f(*args, **kwargs)))
+
+            if current_app.config['CATALOG_INDEX_ENABLED']:
+                catalog.ensure_fresh()
+            key = request.path + '?' + urlencode(sorted(request.args.items(multi=True)))
+            cached = response_cache.get(key)
+            if cached is not None:
+                body, etag = cached
+                return not_modified(etag) or conditional(
+                    current_app.response_class(body, mimetype='application/json'), etag)
+
+            response = current_app.make_response(f(*args, **kwargs))
+            if response.status_code == 200 and response.is_json:
+                tags = _content_tags(response.get_json())
+                if scope_tags:
+                    tags |= set(scope_tags(**kwargs))
+                body = response.get_data()
+                etag = etag_for(body)
+                response_cache.set(key, body, tags, etag)
+                return conditional(response, etag)
+            return response
+        return wrapper
+    return decorator
+
+
+def product_scope(conn, product_id):
+    """(seller_id, category name) of a product, or None once it's gone"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT p.user_id, c.name
+            FROM products p
+            JOIN categories c ON p.category_id = c.category_id
+            WHERE p.product_id = %s
+        """, (product_id,))
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+    return (row[0], row[1]) if row else None
+
+
+def invalidate_product(product_id, *scopes):
+    """Drop cached responses that contain the product or could now include it
+
+    scopes are product_scope() results from before and after the write.
+    """
+    tags = [f"product:{product_id}", 'catalog']
+    for scope in scopes:
+        if scope:
+            seller_id, category = scope
+            tags += [f"listings:{seller_id}", f"category:{(category or '').lower()}"]
+    response_cache.invalidate(*tags)
+
+
+def invalidate_seller(seller_id):
+    """Drop cached responses showing the seller's products, e.g. after a new rating"""
+    response_cache.invalidate(f"seller:{seller_id}")
+
+
+def invalidate_from_catalog(products, seller_ids):
+    """CatalogIndex listener, covers writes made by other workers"""
+    for product_id, scopes in products.items():
+        invalidate_product(product_id, *scopes)
+    for seller_id in seller_ids:
+        invalidate_seller(seller_id)
@@ -1,6 +1,9 @@
 from flask import Blueprint, request, jsonify
 from app import get_db_connection
 from auth import token_required
+from catalog_index import seller_rating_changed
+from response_cache import invalidate_seller
+from conditional import conditional, etag_for, not_modified
 
 reviews_bp = Blueprint('reviews', __name__, url_prefix='/reviews')
 
@@ -24,17 +27,41 @@ def create_review(current_user):
         INSERT INTO reviews (seller_id, rating, comment)
         VALUES (%s, %s, %s)
     """, (data['seller_id'], data['rating'], data['comment']))
+    # keep the seller's rating totals in the same transaction as the review
+    cursor.execute("""
+        INSERT INTO seller_ratings (seller_id, rating_count, rating_sum)
+        VALUES (%s, 1, %s)
+        ON DUPLICATE KEY UPDATE
+            rating_count = rating_count + 1,
+            rating_sum = rating_sum + %s
+    """, (data['seller_id'], int(data['rating']), int(data['rating'])))
     conn.commit()
+    seller_rating_changed(conn, data['seller_id'])
+    invalidate_seller(data['seller_id'])
 
     cursor.close()
     conn.close()
     return jsonify({'message': 'Review created successfully'}), 201
 
 # Get reviews for a seller
+# the seller_ratings row changes with every new review, so its count and
+# timestamp version the list and a matching If-None-Match skips the scan
 @reviews_bp.route('/<int:seller_id>', methods=['GET'])
 def get_reviews_for_seller(seller_id):
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
+    cursor.execute("""
+        SELECT rating_count, updated_at
+        FROM seller_ratings
+        WHERE seller_id = %s
+    """, (seller_id,))
+    version = cursor.fetchone() or {'rating_count': 0, 'updated_at': None}
+    etag = etag_for('reviews', seller_id, version['rating_count'], version['updated_at'])
+    unchanged = not_modified(etag)
+    if unchanged:
+        cursor.close()
+        return unchanged
+
     cursor.execute("""
         SELECT review_id, rating, comment, created_at
         FROM reviews
@@ -45,4 +72,28 @@ def get_reviews_for_seller(seller_id):
 
     cursor.close()
     conn.close()
-    return jsonify(reviews)
\ No newline at end of file
+    return conditional(jsonify(reviews), etag)
+
+# Recompute every seller's rating totals from the reviews table
+# usage: flask --app app reviews rebuild-ratings
+@reviews_bp.cli.command('rebuild-ratings')
+def rebuild_ratings():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM seller_ratings")
+        cursor.execute("""
+            INSERT INTO seller_ratings (seller_id, rating_count, rating_sum)
+            SELECT seller_id, COUNT(*), SUM(rating)
+            FROM reviews
+            GROUP BY seller_id
+        """)
+        rebuilt = cursor.rowcount
+        conn.commit()
+        print(f"Rebuilt rating totals for {rebuilt} sellers")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
@@ -1,13 +1,27 @@
 import pytest
-from app.backend.app import app as flask_app
-import mysql.connector
+import datetime
+import sys
 import os
+from decimal import Decimal
+from unittest.mock import MagicMock
+
+# backend modules import each other by bare name (from app import ...)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# no background jobs (email outbox, cleanup) while testing
+os.environ.setdefault('SCHEDULER_ENABLED', 'false')
+
+from app import app as flask_app
+import mysql.connector
 
 @pytest.fixture(scope='session')
 def app():
     flask_app.config['TESTING'] = True
     flask_app.config['WTF_CSRF_ENABLED'] = False
     flask_app.config['JWT_SECRET_KEY'] = 'test-secret'
+    # product reads go straight to the mocked database
+    flask_app.config['CATALOG_INDEX_ENABLED'] = False
+    flask_app.config['RESPONSE_CACHE_ENABLED'] = False
 
     yield flask_app
 
@@ -15,6 +29,61 @@ def app():
 def client(app):
     return app.test_client()
 
+@pytest.fixture()
+def sql_db():
+    """Factory for a mocked connection and cursor
+
+    fetchall and fetchone are called with the sql and params of the last
+    execute, so one mock answers a whole plan of statements. every
+    cursor.execute call counts as one statement.
+    """
+    def make(fetchall=lambda sql, params: [], fetchone=lambda sql, params: None):
+        cursor = MagicMock()
+        last = {'sql': '', 'params': None}
+
+        def execute(query, params=None):
+            last['sql'] = query
+            last['params'] = params
+
+        cursor.execute.side_effect = execute
+        cursor.fetchall.side_effect = lambda: fetchall(last['sql'], last['params'])
+        cursor.fetchone.side_effect = lambda: fetchone(last['sql'], last['params'])
+        conn = MagicMock()
+        conn.cursor.return_value = cursor
+        return conn, cursor
+    return make
+
+@pytest.fixture()
+def make_products():
+    """Factory for approved, active listing rows as the search query returns them"""
+    def make(count):
+        return [{
+            'product_id': i,
+            'user_id': 1,
+            'name': f'Product {i}',
+            'description': 'test listing',
+            'price': Decimal('10.00'),
+            'condition': 'Used - Good',
+            'category_id': 1,
+            'created_at': datetime.datetime(2025, 5, 1) - datetime.timedelta(minutes=i),
+            'status': 'active',
+            'approval_status': 'approved',
+            'username': 'testuser',
+            'seller_rating': Decimal('4.25'),
+        } for i in range(1, count + 1)]
+    return make
+
+@pytest.fixture()
+def mock_search_db(sql_db):
+    """Connection whose cursor answers the search query and the image query"""
+    def make(products):
+        def fetchall(sql, params):
+            if 'FROM product_images' in sql:
+                return [{'product_id': pid, 'image_url': f'/products/serve-image/{pid}.jpg'} for pid in params]
+            return products
+        return sql_db(fetchall)
+    return make
+
 @pytest.fixture()
 def db_conn():
     conn = mysql.connector.connect(
@@ -24,4 +93,4 @@ def db_conn():
         database=os.getenv("MYSQL_TEST_DATABASE", "gator_market_test")
     )
     yield conn
-    conn.close()
\ No newline at end of file
+    conn.close()
@@ -0,0 +1,104 @@
+# testing the chunked expired account cleanup
+# expired accounts are removed a chunk per transaction
+
+from unittest.mock import patch
+
+import pytest
+
+import account_cleanup
+from account_cleanup import cleanup_expired_accounts
+
+
+@pytest.fixture
+def cleanup_db(sql_db):
+    """Connection whose expired user query answers with each chunk in turn"""
+    def make(chunks):
+        chunks = list(chunks)
+
+        def fetchall(sql, params):
+            if 'FROM users' in sql:
+                return chunks.pop(0) if chunks else []
+            if 'FROM products WHERE user_id' in sql:
+                return [{'product_id': 1000 + uid} for uid in params]
+            if 'FROM products' in sql:
+                return [{'product_id': pid} for pid in params]
+            if 'conversation_id' in sql:
+                return [{'conversation_id': 5}]
+            return []
+
+        return sql_db(fetchall)
+    return make
+
+
+def users(start, count):
+    return [{'user_id': i, 'username': f'user{i}', 'email': f'user{i}@sfsu.edu'}
+            for i in range(start, start + count)]
+
+
+@pytest.fixture(autouse=True)
+def no_pause():
+    with patch.object(account_cleanup, 'CHUNK_PAUSE', 0), \
+            patch('account_cleanup.catalog.refresh_products'):
+        yield
+
+
+@pytest.mark.parametrize('count', [1, 150])
+def test_statements_per_chunk_do_not_grow_with_users(count, cleanup_db):
+    conn, cursor = cleanup_db([users(1, count)])
+
+    deleted = cleanup_expired_accounts(conn, chunk_size=200)
+
+    assert len(deleted) == count
+    # start and the locking select, then the fixed cascade.delete_users plan
+    assert cursor.execute.call_count == 2 + 21
+    assert conn.commit.call_count == 1
+
+
+def test_each_chunk_is_its_own_transaction(cleanup_db):
+    conn, cursor = cleanup_db([users(1, 10), users(11, 10), users(21, 3)])
+
+    deleted = cleanup_expired_accounts(conn, chunk_size=10)
+
+    assert [u['user_id'] for u in deleted] == list(range(1, 24))
+    # a short last chunk ends the sweep without another query
+    assert conn.commit.call_count == 3
+    assert account_cleanup.cleanup_stats()['last_deleted'] == 23
+
+
+def test_expired_users_are_locked_without_waiting(cleanup_db):
+    conn, cursor = cleanup_db([])
+
+    assert cleanup_expired_accounts(conn) == []
+    select = cursor.execute.call_args_list[1].args[0]
+    assert 'LIMIT %s' in select
+    assert 'FOR UPDATE SKIP LOCKED' in select
+
+
+def test_accounts_expire_a_day_after_registration(cleanup_db):
+    conn, cursor = cleanup_db([])
+
+    cleanup_expired_accounts(conn)
+
+    select, params = cursor.execute.call_args_list[1].args
+    # re-sending the verification mail doesn't keep an unverified account alive
+    assert 'date_joined < NOW() - INTERVAL %s HOUR' in select
+    assert 'verification_token_created_at' not in select
+    assert params[0] == account_cleanup.EXPIRE_HOURS == 24
+
+
+def test_failed_chunk_rolls_back_and_stops(cleanup_db):
+    conn, cursor = cleanup_db([users(1, 5)])
+    execute = cursor.execute.side_effect
+
+    def failing(query, params=None):
+        if query.startswith('DELETE'):
+            raise Exception('lock wait timeout')
+        execute(query, params)
+
+    cursor.execute.side_effect = failing
+
+    with pytest.raises(Exception):
+        cleanup_expired_accounts(conn)
+
+    conn.rollback.assert_called_once()
+    assert account_cleanup.cleanup_stats()['last_error'] == 'lock wait timeout'
@@ -0,0 +1,112 @@
+# testing the set based delete engine
+# products, conversations and users are deleted by a fixed number of statements
+
+from unittest.mock import patch
+
+import pytest
+
+import cascade
+from auth import generate_token
+from user_cache import user_cache
+
+
+@pytest.fixture
+def cascade_db(sql_db):
+    """Cursor whose id lookups return the given products and conversations"""
+    def make(products=(), conversations=()):
+        def fetchall(sql, params):
+            if 'SELECT product_id FROM products' in sql:
+                return [(pid,) for pid in products]
+            if 'SELECT' in sql and 'conversation' in sql:
+                return [(cid,) for cid in conversations]
+            return []
+
+        # fetchone is the ownership check in delete_product
+        conn, cursor = sql_db(fetchall, fetchone=lambda sql, params: (1,))
+        cursor.rowcount = 1
+        return conn, cursor
+    return make
+
+
+def statements(cursor, prefix):
+    return [c.args for c in cursor.execute.call_args_list if c.args[0].strip().startswith(prefix)]
+
+
+@pytest.mark.parametrize('conversation_count', [1, 40, 1000])
+def test_product_delete_statements_do_not_grow_with_conversations(conversation_count, cascade_db):
+    conn, cursor = cascade_db(products=[7], conversations=range(1, conversation_count + 1))
+
+    result = cascade.delete_products(cursor, [7])
+
+    assert result['products'] == [7]
+    # product lock, conversation lookup, messages, summaries, participants,
+    # conversations, wishlist, images, catalog change, product
+    assert cursor.execute.call_count == 10
+    sql, params = statements(cursor, 'DELETE FROM messages')[0]
+    assert len(params) == conversation_count
+
+
+@pytest.mark.parametrize('product_count, conversation_count', [(1, 1), (30, 500)])
+def test_user_delete_statements_do_not_grow(product_count, conversation_count, cascade_db):
+    conn, cursor = cascade_db(products=range(1, product_count + 1),
+                              conversations=range(1, conversation_count + 1))
+
+    cascade.delete_users(cursor, [3])
+
+    # product lookup + the product plan, then their other conversations and
+    # wishlist, reports, reviews, ratings, user
+    assert cursor.execute.call_count == 1 + 10 + 5 + 5
+
+
+def test_nothing_to_cascade_skips_conversation_deletes(cascade_db):
+    conn, cursor = cascade_db()
+
+    cascade.delete_products(cursor, [7])
+
+    assert statements(cursor, 'DELETE FROM messages') == []
+
+
+def test_only_listings_that_exist_are_reported(cascade_db):
+    # 8 was deleted by someone else, the catalog log and the result name only 7
+    conn, cursor = cascade_db(products=[7])
+
+    assert cascade.delete_products(cursor, [7, 8])['products'] == [7]
+    (sql, params), = statements(cursor, 'INSERT INTO catalog_changes')
+    assert params == [7]
+
+    conn, cursor = cascade_db()
+    with patch.object(cascade, 'SOFT_DELETE', True):
+        assert cascade.remove_products(cursor, [8]) == {'products': [], 'conversations': 0}
+    assert statements(cursor, 'UPDATE') == []
+
+
+def test_soft_delete_only_flags_rows(cascade_db):
+    conn, cursor = cascade_db(products=[1, 2])
+
+    with patch.object(cascade, 'SOFT_DELETE', True):
+        result = cascade.remove_users(cursor, [3])
+
+    assert result['products'] == [1, 2]
+    assert statements(cursor, 'DELETE') == []
+    flagged = [sql for sql, params in statements(cursor, 'UPDATE')]
+    assert any("account_status = 'deleted'" in sql for sql in flagged)
+    assert any("status = 'deleted'" in sql and 'products' in sql for sql in flagged)
+
+
+@pytest.mark.parametrize('conversation_count', [1, 200])
+def test_delete_product_endpoint_uses_fixed_statements(client, conversation_count, cascade_db):
+    conn, cursor = cascade_db(products=[7], conversations=range(1, conversation_count + 1))
+    user_cache.set(1, {'user_id': 1, 'account_status': 'active'})
+    try:
+        with patch('products.get_db_connection', return_value=conn), \
+                patch('products.product_scope', return_value=(1, 'Books')), \
+                patch('products.product_changed'):
+            response = client.delete('/products/7', headers={
+                'Authorization': f'Bearer {generate_token(1, "seller", "user")}'})
+    finally:
+        user_cache.invalidate(1)
+
+    assert response.status_code == 200
+    # ownership check plus the product plan
+    assert cursor.execute.call_count == 1 + 10
+    conn.commit.assert_called_once()
@@ -0,0 +1,202 @@
+# testing the in memory catalog index used by the public product reads
+# the index is loaded from a fake connection, no MySQL needed
+
+import datetime
+from decimal import Decimal
+from unittest.mock import patch
+
+import pytest
+
+import catalog_index
+from catalog_index import CatalogIndex
+
+BASE_TIME = datetime.datetime(2025, 5, 1)
+
+
+def product(product_id, name, category='Computers', user_id=1, status='active', minutes_ago=None):
+    return {
+        'product_id': product_id,
+        'user_id': user_id,
+        'name': name,
+        'description': f'{name} in good shape',
+        'price': Decimal('10.00'),
+        'condition': 'Used - Good',
+        'category_id': 1,
+        'created_at': BASE_TIME - datetime.timedelta(minutes=minutes_ago if minutes_ago is not None else product_id),
+        'status': status,
+        'approval_status': 'approved',
+        '_username': f'seller{user_id}',
+        '_category': category,
+    }
+
+
+@pytest.fixture
+def fake_conn(sql_db):
+    """Connection whose cursor answers the catalog's queries from lists"""
+    def make(rows, images=None, ratings=None, changes=None):
+        def fetchone(sql, params):
+            if 'MAX(change_id)' in sql:
+                return {'last_id': 0}
+            if 'MAX(updated_at)' in sql:
+                return {'seen_at': None}
+            return None
+
+        def fetchall(sql, params):
+            if 'FROM product_images' in sql:
+                return [i for i in images or [] if not params or i['product_id'] in params]
+            if 'FROM seller_ratings' in sql:
+                return ratings or []
+            if 'FROM catalog_changes' in sql:
+                return [c for c in changes or [] if c['change_id'] > params[0]]
+            if 'FROM products p' in sql:
+                return [r for r in rows if not params or r['product_id'] in params]
+            return []
+
+        conn, cursor = sql_db(fetchall, fetchone)
+        return conn
+    return make
+
+
+@pytest.fixture
+def loaded_index(fake_conn):
+    def make(rows, **kwargs):
+        index = CatalogIndex()
+        index.load(fake_conn(rows, **kwargs))
+        return index
+    return make
+
+
+def test_load_builds_search_rows_like_sql(loaded_index):
+    index = loaded_index(
+        [product(1, 'MacBook Pro')],
+        images=[{'product_id': 1, 'image_url': '/static/images/macbook.jpg'}],
+        ratings=[{'seller_id': 1, 'rating_avg': Decimal('4.2500')}],
+    )
+
+    found = index.get(1)
+    assert found['name'] == 'MacBook Pro'
+    assert found['username'] == 'seller1'
+    assert found['images'] == ['/static/images/macbook.jpg']
+    assert found['seller_rating'] == 4.25
+    assert '_category' not in found and '_username' not in found
+
+
+def test_search_filters_and_orders_newest_first(loaded_index):
+    index = loaded_index([
+        product(1, 'Dell XPS Laptop'),
+        product(2, 'Gaming Laptops Bundle'),
+        product(3, 'Chemistry Textbook', category='Books'),
+        product(4, 'Sold Laptop', status='sold'),
+        product(5, 'Other Seller Laptop', user_id=2),
+    ])
+
+    results, has_more = index.search(term='laptops')
+    assert [p['product_id'] for p in results] == [1, 2, 5]
+    assert has_more is False
+
+    results, _ = index.search(category='books')
+    assert [p['product_id'] for p in results] == [3]
+
+    # a seller's own listings include sold items
+    results, _ = index.search(user_id=1, term='laptop')
+    assert [p['product_id'] for p in results] == [1, 2, 4]
+
+
+def test_short_terms_match_substrings(loaded_index):
+    index = loaded_index([product(1, 'Samsung TV'), product(2, 'Desk Lamp')])
+
+    results, _ = index.search(term='tv')
+    assert [p['product_id'] for p in results] == [1]
+
+
+def test_keyset_pages_walk_the_whole_feed(loaded_index):
+    index = loaded_index([product(i, f'Item {i}') for i in range(1, 8)])
+
+    seen = []
+    after = None
+    while True:
+        page, has_more = index.search(after=after, limit=3)
+        seen += [p['product_id'] for p in page]
+        if not has_more:
+            break
+        after = (page[-1]['created_at'], page[-1]['product_id'])
+
+    assert seen == [1, 2, 3, 4, 5, 6, 7]
+
+
+def test_refresh_applies_updates_and_removals(loaded_index, fake_conn):
+    rows = [product(1, 'Old Name'), product(2, 'Keyboard')]
+    index = loaded_index(rows)
+
+    rows[0] = product(1, 'New Name')
+    del rows[1]
+    index.refresh_products(fake_conn(rows), [1, 2])
+
+    assert index.get(1)['name'] == 'New Name'
+    assert index.get(2) is None
+    assert index.search(term='keyboard') == ([], False)
+    assert index.search(term='old') == ([], False)
+    assert index.stats()['listings'] == 1
+
+
+def test_poll_picks_up_changes_committed_out_of_order(loaded_index, fake_conn):
+    rows = [product(1, 'Lamp'), product(2, 'Desk')]
+    index = loaded_index(rows)
+    changes = []
+
+    # change 2 commits while change 1 (taking product 1 down) is still open
+    rows[1] = product(2, 'Standing Desk')
+    changes.append({'change_id': 2, 'product_id': 2})
+    assert index.poll(fake_conn(rows, changes=changes)) == [2]
+
+    del rows[0]
+    changes.insert(0, {'change_id': 1, 'product_id': 1})
+    assert index.poll(fake_conn(rows, changes=changes)) == [1]
+    assert index.get(1) is None
+    assert index.get(2)['name'] == 'Standing Desk'
+
+    # the window is re-read every time, applied changes are not refreshed again
+    assert index.poll(fake_conn(rows, changes=changes)) == []
+
+
+def test_poll_leaves_the_callers_transaction_alone(loaded_index, fake_conn):
+    rows = [product(1, 'Lamp')]
+    index = loaded_index(rows)
+    # polls run on the request's shared connection, a commit would commit the view's writes
+    conn = fake_conn(rows, changes=[{'change_id': 1, 'product_id': 1}])
+
+    index.poll(conn)
+
+    conn.commit.assert_not_called()
+    assert not any('DELETE' in c.args[0] for c in conn.cursor.return_value.execute.call_args_list)
+
+
+def test_change_log_is_pruned_on_the_jobs_own_connection(sql_db):
+    conn, cursor = sql_db()
+    with patch('catalog_index.get_db_connection', return_value=conn):
+        catalog_index.prune_changes_job()
+
+    sql, = cursor.execute.call_args.args
+    assert sql.startswith('DELETE FROM catalog_changes')
+    conn.commit.assert_called_once()
+    conn.close.assert_called_once()
+
+
+def test_preload_loads_before_the_first_request(app, fake_conn):
+    index = CatalogIndex()
+    with patch.object(catalog_index, 'catalog', index), \
+            patch('catalog_index.get_db_connection', return_value=fake_conn([product(1, 'Lamp')])), \
+            patch.dict(app.config, {'CATALOG_INDEX_ENABLED': True}):
+        catalog_index.preload()
+
+    assert index.loaded
+    assert index.get(1)['name'] == 'Lamp'
+
+
+def test_plural_and_singular_terms_match_each_other(loaded_index):
+    index = loaded_index([product(1, 'AA batteries'), product(2, 'Battery pack'), product(3, 'Speaker')])
+
+    for term in ('battery', 'batteries'):
+        products, _ = index.search(term=term)
+        assert sorted(p['product_id'] for p in products) == [1, 2]
+    assert index.search(term='speed') == ([], False)
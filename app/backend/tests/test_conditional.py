@@ -0,0 +1,71 @@
+# testing ETag / If-None-Match handling on the read endpoints
+# the database is mocked, so these run without MySQL
+
+import datetime
+from unittest.mock import patch
+
+import pytest
+
+from response_cache import response_cache
+
+
+def test_search_returns_304_for_matching_etag(client, mock_search_db, make_products):
+    conn, cursor = mock_search_db(make_products(3))
+
+    with patch('products.get_db_connection', return_value=conn):
+        first = client.get('/products/search?limit=5')
+        again = client.get('/products/search?limit=5', headers={'If-None-Match': first.headers['ETag']})
+
+    assert first.status_code == 200
+    assert first.headers['Cache-Control'] == 'no-cache'
+    assert again.status_code == 304
+    assert again.data == b''
+    assert again.headers['ETag'] == first.headers['ETag']
+
+
+def test_cached_search_revalidates_without_queries(app, client, mock_search_db, make_products):
+    app.config['RESPONSE_CACHE_ENABLED'] = True
+    response_cache.clear()
+    try:
+        conn, cursor = mock_search_db(make_products(3))
+        with patch('products.get_db_connection', return_value=conn):
+            first = client.get('/products/search?limit=5')
+            again = client.get('/products/search?limit=5', headers={'If-None-Match': first.headers['ETag']})
+
+        assert again.status_code == 304
+        # only the first request ran the search and image queries
+        assert cursor.execute.call_count == 2
+    finally:
+        app.config['RESPONSE_CACHE_ENABLED'] = False
+        response_cache.clear()
+
+
+@pytest.fixture
+def mock_reviews_db(sql_db):
+    def make(version, reviews):
+        return sql_db(lambda sql, params: reviews, lambda sql, params: version)
+    return make
+
+
+def test_reviews_short_circuit_on_rating_version(client, mock_reviews_db):
+    version = {'rating_count': 2, 'updated_at': datetime.datetime(2025, 5, 1, 12, 0)}
+    reviews = [{'review_id': 1, 'rating': 5, 'comment': 'great', 'created_at': None}]
+
+    conn, cursor = mock_reviews_db(version, reviews)
+    with patch('reviews.get_db_connection', return_value=conn):
+        first = client.get('/reviews/7')
+    assert first.status_code == 200
+    assert cursor.execute.call_count == 2
+
+    conn, cursor = mock_reviews_db(version, reviews)
+    with patch('reviews.get_db_connection', return_value=conn):
+        again = client.get('/reviews/7', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
+    # only the version lookup ran
+    assert cursor.execute.call_count == 1
+
+    # a new review bumps the version and the full list comes back
+    conn, cursor = mock_reviews_db(dict(version, rating_count=3), reviews)
+    with patch('reviews.get_db_connection', return_value=conn):
+        changed = client.get('/reviews/7', headers={'If-None-Match': first.headers['ETag']})
+    assert changed.status_code == 200
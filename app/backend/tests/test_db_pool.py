@@ -0,0 +1,124 @@
+# testing the MySQL connection pool behind app.get_db_connection
+# mysql.connector.connect is mocked, every fake connection is a MagicMock
+
+import threading
+from unittest.mock import patch, MagicMock
+
+import pytest
+from mysql.connector.errors import PoolError
+
+from db_pool import ConnectionPool
+
+
+def fake_connection():
+    raw = MagicMock()
+    raw.in_transaction = False
+    return raw
+
+
+@pytest.fixture
+def connect():
+    with patch('db_pool.mysql.connector.connect', side_effect=lambda **kwargs: fake_connection()) as connect:
+        yield connect
+
+
+@pytest.fixture
+def clock():
+    now = {'value': 1000.0}
+    with patch('db_pool.time.monotonic', side_effect=lambda: now['value']):
+        yield now
+
+
+def test_returned_connection_is_reused(connect):
+    pool = ConnectionPool({'host': 'db'}, size=2)
+
+    first = pool.connect()
+    raw = first._raw
+    first.close()
+    first.close()
+    second = pool.connect()
+
+    assert second._raw is raw
+    assert connect.call_count == 1
+    connect.assert_called_with(host='db')
+    assert pool.stats()['checked_out'] == 1
+
+
+def test_overflow_connections_are_closed_when_returned(connect):
+    pool = ConnectionPool({}, size=1, max_overflow=1)
+
+    kept, extra = pool.connect(), pool.connect()
+    assert pool.stats()['overflow'] == 1
+    kept.close()
+    extra.close()
+
+    extra._raw.close.assert_called_once()
+    kept._raw.close.assert_not_called()
+    assert pool.stats()['idle'] == 1
+    assert pool.stats()['overflow_closed'] == 1
+
+
+def test_exhausted_pool_times_out(connect):
+    pool = ConnectionPool({}, size=1, max_overflow=0, timeout=0.05)
+    pool.connect()
+
+    with pytest.raises(PoolError):
+        pool.connect()
+    assert pool.stats()['timeouts'] == 1
+
+
+def test_waiter_gets_the_next_returned_connection(connect):
+    pool = ConnectionPool({}, size=1, max_overflow=0, timeout=5)
+    held = pool.connect()
+    threading.Timer(0.05, held.close).start()
+
+    assert pool.connect()._raw is held._raw
+    assert connect.call_count == 1
+
+
+def test_old_connections_are_recycled(connect, clock):
+    pool = ConnectionPool({}, size=1, recycle=1800, pre_ping=False)
+    first = pool.connect()
+    first.close()
+
+    clock['value'] += 1801
+    second = pool.connect()
+
+    assert second._raw is not first._raw
+    first._raw.close.assert_called_once()
+    assert pool.stats()['recycled'] == 1
+
+
+def test_connection_that_fails_ping_is_replaced(connect, clock):
+    pool = ConnectionPool({}, size=1, ping_after=5)
+    first = pool.connect()
+    first._raw.ping.side_effect = Exception('server has gone away')
+    first.close()
+
+    clock['value'] += 10
+    second = pool.connect()
+
+    assert second._raw is not first._raw
+    first._raw.close.assert_called_once()
+    assert pool.stats()['invalidated'] == 1
+
+
+def test_connection_broken_mid_transaction_is_discarded(connect):
+    pool = ConnectionPool({}, size=1)
+    first = pool.connect()
+    first._raw.in_transaction = True
+    first._raw.rollback.side_effect = Exception('lost connection')
+    first.close()
+
+    assert pool.stats()['idle'] == 0
+    assert pool.stats()['checked_out'] == 0
+    assert pool.connect()._raw is not first._raw
+
+
+def test_failed_connect_gives_the_slot_back():
+    pool = ConnectionPool({}, size=1, max_overflow=0, timeout=0.05)
+    with patch('db_pool.mysql.connector.connect', side_effect=Exception('refused')):
+        with pytest.raises(Exception):
+            pool.connect()
+
+    assert pool.stats()['checked_out'] == 0
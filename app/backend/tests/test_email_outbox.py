@@ -0,0 +1,140 @@
+# testing the email outbox: /verify/send only queues, the sender delivers
+# the database is mocked, so these run without MySQL
+
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+import email_outbox
+from email_outbox import FileTransport, PermanentEmailError, send_batch
+
+
+@pytest.fixture
+def outbox_db(sql_db):
+    """Connection whose claim query returns rows, every statement is recorded"""
+    return lambda rows: sql_db(lambda sql, params: rows)
+
+
+def queued(email_id, attempts=0):
+    return {'email_id': email_id, 'to_email': f'user{email_id}@sfsu.edu', 'subject': 'Verify your email',
+            'text_body': 'hi', 'html_body': '<p>hi</p>', 'attempts': attempts}
+
+
+def deliver(conn, transport):
+    with patch('email_outbox.get_db_connection', return_value=conn):
+        return send_batch(transport)
+
+
+def updates(cursor):
+    """(sql, params) of each UPDATE after the claim"""
+    calls = [c.args for c in cursor.execute.call_args_list if 'UPDATE email_outbox' in c.args[0]]
+    return calls[1:]
+
+
+def test_send_queues_mail_without_calling_the_transport(client, sql_db):
+    conn, cursor = sql_db(fetchone=lambda sql, params: {
+        'user_id': 1, 'verification_status': 'unverified', 'verification_token_created_at': None})
+
+    with patch('email_verification.get_db_connection', return_value=conn), \
+            patch('email_outbox.get_transport', side_effect=AssertionError('sent inline')):
+        response = client.post('/verify/send', json={'email': 'gator@sfsu.edu'})
+
+    assert response.status_code == 200
+    statements = [c.args[0] for c in cursor.execute.call_args_list]
+    assert any('INSERT INTO email_outbox' in sql for sql in statements)
+    # the token update and the queued mail commit together
+    assert conn.commit.call_count == 1
+
+
+def test_delivered_mail_is_marked_sent(outbox_db):
+    conn, cursor = outbox_db([queued(1), queued(2)])
+    transport = MagicMock()
+
+    assert deliver(conn, transport) == 2
+    assert transport.send.call_count == 2
+    assert all("status = 'sent'" in sql for sql, params in updates(cursor))
+
+
+def test_failed_mail_is_retried_with_backoff(outbox_db):
+    conn, cursor = outbox_db([queued(1, attempts=2)])
+    transport = MagicMock()
+    transport.send.side_effect = ConnectionError('SES timed out')
+
+    deliver(conn, transport)
+
+    (sql, params), = updates(cursor)
+    assert "status = 'pending'" in sql
+    # third attempt failed, wait four times the base delay
+    assert params[1] == email_outbox.BACKOFF_BASE * 4
+
+
+@pytest.mark.parametrize('attempts, error', [
+    (email_outbox.MAX_ATTEMPTS - 1, ConnectionError('still down')),
+    (0, PermanentEmailError('Email address is not verified')),
+])
+def test_mail_is_dead_lettered(attempts, error, outbox_db):
+    conn, cursor = outbox_db([queued(1, attempts=attempts)])
+    transport = MagicMock()
+    transport.send.side_effect = error
+
+    deliver(conn, transport)
+
+    (sql, params), = updates(cursor)
+    assert "status = 'dead'" in sql
+    assert str(error) in params[0]
+
+
+def test_lease_covers_every_send_in_a_batch():
+    assert email_outbox.LEASE_SECONDS > email_outbox.BATCH_SIZE * email_outbox.SEND_TIMEOUT
+
+
+def test_sends_stop_before_the_lease_runs_out(outbox_db):
+    conn, cursor = outbox_db([queued(i) for i in range(1, 5)])
+    clock = {'now': 0}
+    transport = MagicMock()
+    transport.send.side_effect = lambda message: clock.update(now=clock['now'] + 10)
+
+    with patch.object(email_outbox, 'LEASE_SECONDS', 45), patch.object(email_outbox, 'SEND_TIMEOUT', 10), \
+            patch('email_outbox.time.monotonic', side_effect=lambda: clock['now']):
+        deliver(conn, transport)
+
+    # after two 10s sends a third might outlive the 45s lease
+    assert transport.send.call_count == 2
+    (sql, params), = [(sql, params) for sql, params in updates(cursor) if 'attempts - 1' in sql]
+    assert params == [3, 4]
+    # each delivered mail was committed on its own, then the release
+    assert conn.commit.call_count == 1 + 2 + 1
+
+
+def test_no_connection_is_held_while_sending(outbox_db):
+    conn, cursor = outbox_db([queued(1), queued(2)])
+    transport = MagicMock()
+
+    with patch('email_outbox.get_db_connection', return_value=conn) as get_conn:
+        def send(message):
+            # every connection borrowed so far went back before the send
+            assert conn.close.call_count == get_conn.call_count
+
+        transport.send.side_effect = send
+        send_batch(transport)
+
+    # one for the claim, one per recorded result
+    assert get_conn.call_count == conn.close.call_count == 3
+
+
+def test_claim_skips_rows_held_by_other_senders(outbox_db):
+    conn, cursor = outbox_db([])
+
+    assert deliver(conn, MagicMock()) == 0
+    claim = cursor.execute.call_args_list[1].args[0]
+    assert 'FOR UPDATE SKIP LOCKED' in claim
+
+
+def test_file_transport_writes_eml(tmp_path):
+    transport = FileTransport(str(tmp_path))
+
+    transport.send(email_outbox.build_message('gator@sfsu.edu', 'Verify your email', 'hi', '<p>hi</p>'))
+
+    written, = tmp_path.iterdir()
+    assert written.suffix == '.eml'
+    assert 'Subject: Verify your email' in written.read_text()
@@ -0,0 +1,126 @@
+# testing resized image copies for ?size= on serve-image
+# images are written to a temp folder, the database is mocked
+
+import os
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+import image_derivatives
+from image_derivatives import derive, derived_name
+
+Image = pytest.importorskip('PIL.Image')
+
+
+@pytest.fixture
+def photo(tmp_path):
+    Image.new('RGB', (2000, 1500), 'purple').save(tmp_path / 'abc_photo.jpg', 'JPEG')
+    return tmp_path
+
+
+def test_copy_is_made_once_and_reused(photo):
+    name = derive(str(photo), 'abc_photo.jpg', 'thumb')
+
+    assert name == derived_name('abc_photo.jpg', 'thumb')
+    with Image.open(photo / name) as thumb:
+        assert thumb.size == (320, 240)
+    made = os.path.getmtime(photo / name)
+    with patch.object(image_derivatives, '_resize', side_effect=AssertionError('resized again')):
+        assert derive(str(photo), 'abc_photo.jpg', 'thumb') == name
+    assert os.path.getmtime(photo / name) == made
+
+
+def test_webp_copy_when_requested(photo):
+    if not image_derivatives.features.check('webp'):
+        pytest.skip('Pillow built without WebP')
+
+    name = derive(str(photo), 'abc_photo.jpg', 'medium', webp=True)
+
+    assert name.endswith('abc_photo.jpg.webp')
+    with Image.open(photo / name) as medium:
+        assert medium.format == 'WEBP' and medium.width == 800
+
+
+def test_small_or_unreadable_images_fall_back_to_the_original(tmp_path):
+    Image.new('RGB', (100, 100)).save(tmp_path / 'small.png', 'PNG')
+    (tmp_path / 'broken.jpg').write_bytes(b'not an image')
+
+    assert derive(str(tmp_path), 'small.png', 'thumb') == 'small.png'
+    assert derive(str(tmp_path), 'broken.jpg', 'thumb') == 'broken.jpg'
+    assert not (tmp_path / 'derived' / 'thumb' / 'broken.jpg').exists()
+
+
+def test_small_original_is_not_opened_again(tmp_path):
+    Image.new('RGB', (100, 100)).save(tmp_path / 'small.png', 'PNG')
+    derive(str(tmp_path), 'small.png', 'thumb')
+
+    # the original is linked in as its own copy
+    linked = tmp_path / derived_name('small.png', 'thumb')
+    assert os.path.samefile(linked, tmp_path / 'small.png')
+    with patch.object(image_derivatives, '_resize', side_effect=AssertionError('opened again')):
+        assert derive(str(tmp_path), 'small.png', 'thumb') == derived_name('small.png', 'thumb')
+
+
+def test_concurrent_requests_make_the_copy_once(photo):
+    resize = image_derivatives._resize
+    calls = []
+
+    def slow_resize(*args):
+        calls.append(args)
+        time.sleep(0.1)
+        return resize(*args)
+
+    names = []
+    with patch.object(image_derivatives, '_resize', side_effect=slow_resize):
+        threads = [threading.Thread(target=lambda: names.append(derive(str(photo), 'abc_photo.jpg', 'thumb')))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.01)
+        for thread in threads:
+            thread.join()
+
+    assert len(calls) == 1
+    assert names == [derived_name('abc_photo.jpg', 'thumb')] * 4
+    assert image_derivatives._building == {}
+
+
+def test_images_too_large_to_decode_are_sent_as_is(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_derivatives, 'MAX_PIXELS', 1_000_000)
+    Image.new('RGB', (2000, 1500)).save(tmp_path / 'huge.png', 'PNG')
+    Image.new('RGB', (2000, 1500)).save(tmp_path / 'huge.jpg', 'JPEG')
+
+    with patch.object(Image.Image, 'load', side_effect=AssertionError('decoded')):
+        assert derive(str(tmp_path), 'huge.png', 'thumb') == 'huge.png'
+    # JPEGs are measured after draft scaling, 500x375 fits the budget
+    assert derive(str(tmp_path), 'huge.jpg', 'thumb') == derived_name('huge.jpg', 'thumb')
+
+
+@pytest.fixture
+def approved_image_db(sql_db):
+    conn, cursor = sql_db(fetchone=lambda sql, params: {'product_id': 1, 'approval_status': 'approved'})
+    return conn
+
+
+def test_serve_image_sends_the_sized_copy(client, photo, approved_image_db):
+    with patch('products.get_db_connection', return_value=approved_image_db), \
+            patch('products.UPLOAD_FOLDER', str(photo)), \
+            patch('products.IMAGE_ACCEL', 'nginx'), \
+            patch('products.WEBP', True), \
+            patch('image_derivatives.WEBP', False):
+        response = client.get('/products/serve-image/abc_photo.jpg?size=thumb',
+                              headers={'Accept': 'image/webp,*/*'})
+
+    assert response.status_code == 200
+    assert response.headers['X-Accel-Redirect'] == '/protected-images/derived/thumb/abc_photo.jpg'
+    assert 'Accept' in response.headers['Vary']
+
+
+def test_unknown_size_is_rejected(client):
+    with patch('products.get_db_connection') as get_conn:
+        response = client.get('/products/serve-image/abc_photo.jpg?size=huge')
+
+    assert response.status_code == 400
+    get_conn.assert_not_called()
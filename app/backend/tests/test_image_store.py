@@ -0,0 +1,103 @@
+# testing content addressed image storage and its garbage collection
+# files are written to a temp folder, the database is mocked
+
+import hashlib
+import io
+import os
+import time
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+import image_store
+from image_store import collect_garbage, save_upload, stored_path
+
+JPEG = b'\xff\xd8\xff\xe0' + b'photo bytes' * 100
+
+
+def upload(data, filename='photo.jpg'):
+    return FileStorage(stream=io.BytesIO(data), filename=filename)
+
+
+def age(folder, path, hours):
+    old = time.time() - hours * 3600
+    os.utime(folder / path, (old, old))
+
+
+@pytest.fixture
+def referencing(sql_db):
+    """Connection whose product_images lookup returns names"""
+    return lambda *names: sql_db(lambda sql, params: [(name,) for name in names])
+
+
+def test_upload_is_stored_under_its_hash_in_shards(tmp_path):
+    name = save_upload(upload(JPEG), 'jpeg', str(tmp_path))
+
+    digest = hashlib.sha256(JPEG).hexdigest()
+    assert name == f'{digest}.jpg'
+    assert stored_path(name) == os.path.join(digest[:2], digest[2:4], name)
+    assert (tmp_path / stored_path(name)).read_bytes() == JPEG
+
+
+def test_same_bytes_are_stored_once(tmp_path):
+    first = save_upload(upload(JPEG, 'a.jpg'), 'jpg', str(tmp_path))
+    age(tmp_path, stored_path(first), 48)
+    second = save_upload(upload(JPEG, 'b.jpg'), 'jpg', str(tmp_path))
+
+    assert first == second
+    files = [path for name, path in image_store.stored_files(str(tmp_path))]
+    assert files == [stored_path(first)]
+    # the duplicate counts as a fresh reference for the grace period
+    assert os.path.getmtime(tmp_path / stored_path(first)) > time.time() - 60
+
+
+def test_older_uuid_names_stay_flat():
+    assert stored_path('0b1e_photo.jpg') == '0b1e_photo.jpg'
+
+
+def test_gc_removes_only_old_unreferenced_images(tmp_path, referencing):
+    kept = save_upload(upload(JPEG), 'jpg', str(tmp_path))
+    orphan = save_upload(upload(JPEG + b'other'), 'jpg', str(tmp_path))
+    fresh = save_upload(upload(JPEG + b'new'), 'jpg', str(tmp_path))
+    thumb = tmp_path / 'derived' / 'thumb' / stored_path(orphan)
+    thumb.parent.mkdir(parents=True)
+    thumb.write_bytes(b'small')
+    for name in (kept, orphan):
+        age(tmp_path, stored_path(name), 48)
+    conn, cursor = referencing(kept)
+
+    assert collect_garbage(conn, str(tmp_path), grace_hours=24) == 1
+
+    assert (tmp_path / stored_path(kept)).exists()
+    assert (tmp_path / stored_path(fresh)).exists()
+    assert not (tmp_path / stored_path(orphan)).exists()
+    assert not thumb.exists()
+    # only the old files were looked up, in one query
+    sql, params = cursor.execute.call_args.args
+    assert sorted(params) == sorted([kept, orphan])
+
+
+@pytest.mark.parametrize('batch', [1, 500])
+def test_gc_lookups_are_batched(tmp_path, batch, monkeypatch, referencing):
+    monkeypatch.setattr(image_store, 'GC_BATCH', batch)
+    for i in range(3):
+        name = save_upload(upload(JPEG + bytes([i])), 'jpg', str(tmp_path))
+        age(tmp_path, stored_path(name), 48)
+    conn, cursor = referencing()
+
+    assert collect_garbage(conn, str(tmp_path), grace_hours=24) == 3
+    assert cursor.execute.call_count == -(-3 // batch)
+
+
+def test_upload_removed_by_gc_mid_dedup_is_stored_again(tmp_path, monkeypatch):
+    name = save_upload(upload(JPEG), 'jpg', str(tmp_path))
+    path = tmp_path / stored_path(name)
+
+    def collected(target, *args):
+        # the GC unlinks the file between the lookup and the touch
+        os.unlink(target)
+        raise FileNotFoundError(target)
+
+    monkeypatch.setattr(image_store.os, 'utime', collected)
+    assert save_upload(upload(JPEG), 'jpg', str(tmp_path)) == name
+    assert path.read_bytes() == JPEG
@@ -0,0 +1,269 @@
+# testing messaging read paths: unread counters, the notifier and /messaging/stream
+# the database is mocked, so these run without MySQL
+
+import re
+
+import pytest
+from unittest.mock import patch, MagicMock
+
+from auth import generate_token
+from messaging import record_message
+from notifier import Notifier, user_channel
+from user_cache import user_cache
+
+
+@pytest.fixture()
+def notifier(tmp_path):
+    return Notifier(str(tmp_path))
+
+
+def test_publish_reaches_local_subscribers(notifier):
+    with notifier.subscribe('user:1') as subscription:
+        notifier.publish('user:1', {'type': 'unread', 'data': {'count': 2}})
+        notifier.publish('user:2', {'type': 'unread', 'data': {'count': 9}})
+
+        assert subscription.get(timeout=1) == {'type': 'unread', 'data': {'count': 2}}
+        assert subscription.get(timeout=0.05) is None
+
+
+def test_publish_reaches_other_workers(notifier, tmp_path):
+    # a second notifier that never subscribed stands in for another worker
+    other_worker = Notifier(str(tmp_path))
+    with notifier.subscribe('user:1') as subscription:
+        other_worker.publish('user:1', {'type': 'unread', 'data': {'count': 5}})
+        assert subscription.get(timeout=1) == {'type': 'unread', 'data': {'count': 5}}
+
+
+def test_stream_sends_count_then_pushed_events(client, sql_db):
+    user_cache.set(42, {'user_id': 42, 'account_status': 'active'})
+    token = generate_token(42, 'streamer', 'user')
+    conn, cursor = sql_db(fetchone=lambda sql, params: {'count': 3})
+
+    try:
+        with patch('messaging.get_db_connection', return_value=conn), \
+                patch('messaging.green_sockets', return_value=True), \
+                patch('messaging.STREAM_MAX_SECONDS', 2):
+            ticket = client.post('/messaging/stream-ticket',
+                                 headers={'Authorization': f'Bearer {token}'}).json['ticket']
+            response = client.get(
+                f'/messaging/stream?ticket={ticket}',
+                headers={'Accept': 'text/event-stream'},
+                buffered=False,
+            )
+            assert response.status_code == 200
+            chunks = iter(response.response)
+            assert 'event: unread\ndata: {"count": 3}' in next(chunks).decode()
+
+            from notifier import notifier
+            notifier.publish(user_channel(42), {'type': 'unread', 'data': {'count': 4}})
+            assert next(chunks).decode() == 'event: unread\ndata: {"count": 4}\n\n'
+            response.close()
+    finally:
+        user_cache.invalidate(42)
+
+
+def test_stream_refused_off_gevent_workers(client):
+    user_cache.set(43, {'user_id': 43, 'account_status': 'active'})
+    headers = {'Authorization': f'Bearer {generate_token(43, "streamer", "user")}'}
+    try:
+        # a gthread worker would give each open tab an OS thread for minutes
+        response = client.post('/messaging/stream-ticket', headers=headers,
+                               environ_overrides={'wsgi.multithread': True})
+        assert response.status_code == 503
+        assert response.json['code'] == 'STREAM_UNAVAILABLE'
+        response = client.get('/messaging/stream', headers=headers)
+        assert response.status_code == 503
+    finally:
+        user_cache.invalidate(43)
+
+
+def test_login_tokens_stay_out_of_stream_urls(client):
+    from auth import generate_stream_ticket
+
+    user_cache.set(43, {'user_id': 43, 'account_status': 'active'})
+    token = generate_token(43, 'streamer', 'user')
+    accept = {'Accept': 'text/event-stream'}
+    try:
+        with patch('messaging.green_sockets', return_value=True):
+            assert client.get(f'/messaging/stream?token={token}', headers=accept).status_code == 401
+            assert client.get(f'/messaging/stream?ticket={token}', headers=accept).status_code == 401
+        # and a ticket that ends up in a log is no login
+        response = client.get('/messaging/unread-count',
+                              headers={'Authorization': f'Bearer {generate_stream_ticket(43)}'})
+        assert response.status_code == 401
+    finally:
+        user_cache.invalidate(43)
+
+
+def logged_in(user_id):
+    user_cache.set(user_id, {'user_id': user_id, 'account_status': 'active'})
+    return {'Authorization': f'Bearer {generate_token(user_id, "sender", "user")}'}
+
+
+@pytest.fixture
+def mock_messaging_db(sql_db):
+    return lambda: sql_db(lambda sql, params: [(8,)], lambda sql, params: {'role': 'buyer', 'count': 1})
+
+
+def test_send_message_bumps_recipient_counter(client, mock_messaging_db):
+    conn, cursor = mock_messaging_db()
+    try:
+        with patch('messaging.get_db_connection', return_value=conn):
+            response = client.post('/messaging/conversations/5/messages', json={'message_text': 'hi'},
+                                   headers=logged_in(44))
+        assert response.status_code == 201
+        statements = [c[0][0] for c in cursor.execute.call_args_list]
+        bump = next(i for i, sql in enumerate(statements) if 'unread_count = unread_count + 1' in sql)
+        # the counter moves in the same transaction as the insert, before commit
+        assert 'INSERT INTO messages' in statements[bump - 1]
+        assert cursor.execute.call_args_list[bump][0][1] == (5, 44)
+        # the recipient's badge is a single SUM over the counters
+        assert any('SUM(unread_count)' in sql for sql in statements[bump + 1:])
+        assert not any('JOIN messages' in sql for sql in statements)
+    finally:
+        user_cache.invalidate(44)
+
+
+def test_summary_upsert_reads_only_qualified_columns():
+    # `latest` repeats the summary's column names, MySQL answers 1052 (ambiguous)
+    # for any of them used unqualified on the right of ON DUPLICATE KEY UPDATE
+    cursor = MagicMock()
+    cursor.lastrowid = 9
+    record_message(cursor, 5, 44)
+
+    sql = next(c.args[0] for c in cursor.execute.call_args_list if 'conversation_summaries' in c.args[0])
+    derived, update = sql.split('ON DUPLICATE KEY UPDATE')
+    selected = derived[derived.index('SELECT m.'):derived.index('FROM messages')]
+    latest_columns = set(re.findall(r'm\.(\w+)', selected)) | set(re.findall(r'AS (\w+)', selected))
+    expressions = re.sub(r'^\s*\w+\s*=', '', update, flags=re.MULTILINE)
+    bare = set(re.findall(r'(?<![.\w])([a-z_]+)(?![\w(])', expressions))
+    assert 'message_count' in latest_columns
+    assert not bare & latest_columns
+    assert 'conversation_summaries.message_count + 1' in update
+
+
+def test_mark_as_read_clears_counter(client, mock_messaging_db):
+    conn, cursor = mock_messaging_db()
+    try:
+        with patch('messaging.get_db_connection', return_value=conn):
+            response = client.post('/messaging/conversations/5/read', headers=logged_in(45))
+        assert response.status_code == 200
+        assert 'unread_count = 0' in cursor.execute.call_args_list[0][0][0]
+    finally:
+        user_cache.invalidate(45)
+
+
+def test_inbox_is_one_query(client, sql_db):
+    rows = [{
+        'conversation_id': cid,
+        'subject': 'Interested',
+        'unread_count': 1,
+        'message_count': 3,
+        'last_message_time': None,
+        'last_message_text': 'still available?',
+        'first_image_url': '/static/images/x.jpg' if cid == 1 else None,
+        'product_name': 'Desk',
+        'product_price': 20,
+        'product_id': 9,
+        'other_user_id': 7,
+        'other_role': 'seller',
+        'other_username': 'seller7',
+        'other_profile_picture_url': None,
+    } for cid in range(1, 201)]
+    conn, cursor = sql_db(lambda sql, params: rows)
+    try:
+        with patch('messaging.get_db_connection', return_value=conn):
+            response = client.get('/messaging/conversations', headers=logged_in(46))
+        assert cursor.execute.call_count == 1
+        assert 'conversation_summaries' in cursor.execute.call_args[0][0]
+
+        first = response.json[0]
+        assert len(response.json) == 200
+        assert first['product'] == {'product_id': 9, 'name': 'Desk', 'images': ['/static/images/x.jpg'], 'price': None}
+        assert first['other_participant'] == {
+            'user_id': 7, 'role': 'seller', 'username': 'seller7', 'profile_picture_url': None,
+        }
+        assert 'other_username' not in first and 'first_image_url' not in first
+        assert response.json[1]['product']['images'] == []
+    finally:
+        user_cache.invalidate(46)
+
+
+@pytest.fixture
+def history_db(sql_db):
+    return lambda rows: sql_db(lambda sql, params: rows, lambda sql, params: {'role': 'buyer'})
+
+
+def test_latest_page_comes_back_oldest_first(client, history_db):
+    # the query walks newest first and fetches one extra row
+    conn, cursor = history_db([{'message_id': i} for i in (30, 29, 28, 27)])
+    try:
+        with patch('messaging.get_db_connection', return_value=conn):
+            response = client.get('/messaging/conversations/5/messages?limit=3', headers=logged_in(47))
+        assert response.json == {'messages': [{'message_id': 28}, {'message_id': 29}, {'message_id': 30}],
+                                 'has_more': True}
+        sql, params = cursor.execute.call_args[0]
+        assert 'ORDER BY m.message_id DESC' in sql
+        assert params == (5, 4)
+    finally:
+        user_cache.invalidate(47)
+
+
+def test_after_cursor_fetches_only_newer_messages(client, history_db):
+    conn, cursor = history_db([{'message_id': 31}])
+    try:
+        with patch('messaging.get_db_connection', return_value=conn):
+            response = client.get('/messaging/conversations/5/messages?after=30', headers=logged_in(47))
+        assert response.json == {'messages': [{'message_id': 31}], 'has_more': False}
+        sql, params = cursor.execute.call_args[0]
+        assert 'm.message_id > %s' in sql and 'ORDER BY m.message_id ASC' in sql
+        assert params == (5, 30, 51)
+
+        response = client.get('/messaging/conversations/5/messages?after=1&before=9', headers=logged_in(47))
+        assert response.status_code == 400
+    finally:
+        user_cache.invalidate(47)
+
+
+def test_long_poll_parks_until_a_message_is_published(client, history_db):
+    import threading
+    import time
+    from notifier import notifier, conversation_channel
+
+    conn, cursor = history_db([])
+    cursor.fetchall.side_effect = [[], [{'message_id': 31}]]
+    headers = logged_in(48)
+    result = {}
+
+    def poll():
+        result['response'] = client.get('/messaging/conversations/6/messages?after=30&wait=5',
+                                        headers=headers)
+
+    try:
+        with patch('messaging.get_db_connection', return_value=conn), \
+                patch('messaging.green_sockets', return_value=True):
+            started = time.monotonic()
+            waiter = threading.Thread(target=poll)
+            waiter.start()
+            time.sleep(0.2)
+            assert 'response' not in result
+            notifier.publish(conversation_channel(6), {'type': 'message', 'data': {'conversation_id': 6}})
+            waiter.join(timeout=5)
+
+        assert result['response'].json == {'messages': [{'message_id': 31}], 'has_more': False}
+        assert time.monotonic() - started < 4
+    finally:
+        user_cache.invalidate(48)
+
+
+def test_long_poll_answers_at_once_off_gevent_workers(client, history_db):
+    conn, cursor = history_db([])
+    try:
+        # gthread too, a parked poll would hold one of its few OS threads
+        with patch('messaging.get_db_connection', return_value=conn):
+            response = client.get('/messaging/conversations/6/messages?after=30&wait=5', headers=logged_in(48),
+                                  environ_overrides={'wsgi.multithread': True})
+        assert response.json == {'messages': [], 'has_more': False}
+        assert cursor.execute.call_count == 2
+    finally:
+        user_cache.invalidate(48)
@@ -0,0 +1,98 @@
+# testing the bounded bcrypt pool behind /auth/register and /auth/login
+# the database is mocked, so these run without MySQL
+
+import threading
+from unittest.mock import patch
+
+import bcrypt
+import pytest
+
+from password_hashing import PasswordHasher, PasswordPoolBusy
+
+
+@pytest.fixture
+def login_db(sql_db):
+    return lambda user: sql_db(fetchone=lambda sql, params: user)
+
+
+def make_user(password, rounds):
+    return {
+        'user_id': 7,
+        'username': 'gator',
+        'email': 'gator@sfsu.edu',
+        'first_name': 'Gator',
+        'last_name': 'Student',
+        'user_role': 'user',
+        'account_status': 'active',
+        'verification_status': 'verified',
+        'password_hash': bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8'),
+    }
+
+
+def test_hash_and_check_round_trip():
+    hasher = PasswordHasher(rounds=4, workers=1, max_queue=1)
+    hashed = hasher.hash('Password1!')
+
+    assert hashed.startswith('$2b$04$')
+    assert hasher.check('Password1!', hashed)
+    assert not hasher.check('wrong', hashed)
+    assert hasher.stats()['latency']['check']['count'] == 2
+
+
+def test_needs_rehash_compares_cost():
+    hasher = PasswordHasher(rounds=5)
+
+    assert not hasher.needs_rehash(bcrypt.hashpw(b'x', bcrypt.gensalt(5)).decode())
+    assert hasher.needs_rehash(bcrypt.hashpw(b'x', bcrypt.gensalt(4)).decode())
+
+
+def test_saturated_pool_rejects_instead_of_queueing():
+    hasher = PasswordHasher(rounds=4, workers=1, max_queue=1)
+    release = threading.Event()
+
+    def slow(*args):
+        release.wait(5)
+        return True
+
+    # one call running and one waiting fill the pool
+    busy = [threading.Thread(target=hasher._run, args=('check', slow)) for _ in range(2)]
+    for t in busy:
+        t.start()
+    try:
+        while hasher.stats()['in_flight'] < 2:
+            pass
+        with pytest.raises(PasswordPoolBusy) as excinfo:
+            hasher.check('Password1!', '$2b$04$' + 'a' * 53)
+        assert excinfo.value.retry_after >= 1
+        assert hasher.stats()['rejected'] == 1
+    finally:
+        release.set()
+        for t in busy:
+            t.join()
+
+
+def test_login_answers_429_with_retry_after_when_saturated(client, login_db):
+    conn, cursor = login_db(make_user('Password1!', 4))
+
+    with patch('auth.get_db_connection', return_value=conn), \
+            patch('auth.password_hasher.check', side_effect=PasswordPoolBusy(3)):
+        response = client.post('/auth/login', json={'username': 'gator', 'password': 'Password1!'})
+
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '3'
+
+
+def test_login_rehashes_when_cost_changed(client, login_db):
+    conn, cursor = login_db(make_user('Password1!', 4))
+    hasher = PasswordHasher(rounds=5, workers=1, max_queue=1)
+
+    with patch('auth.get_db_connection', return_value=conn), \
+            patch('auth.password_hasher', hasher):
+        response = client.post('/auth/login', json={'username': 'gator', 'password': 'Password1!'})
+
+    assert response.status_code == 200
+    sql, params = cursor.execute.call_args_list[-1].args
+    assert 'password_hash = %s' in sql
+    assert params[0].startswith('$2b$05$')
+    assert bcrypt.checkpw(b'Password1!', params[0].encode())
+    assert hasher.stats()['rehashed'] == 1
@@ -0,0 +1,162 @@
+# testing product search performance regressions
+# the database is mocked, every cursor.execute call counts as one query
+# so these run without MySQL
+
+import pytest
+import datetime
+from unittest.mock import patch
+
+from flask import Response
+
+
+@pytest.mark.parametrize('row_count', [1, 25, 2000])
+def test_search_query_count_is_constant(client, row_count, mock_search_db, make_products):
+    conn, cursor = mock_search_db(make_products(row_count))
+
+    with patch('products.get_db_connection', return_value=conn):
+        response = client.get('/products/search?all=true')
+
+    assert response.status_code == 200
+    assert len(response.json) == row_count
+    # one query for the listings and one for all of their images
+    assert cursor.execute.call_count == 2
+
+
+def test_search_attaches_images_to_matching_products(client, mock_search_db, make_products):
+    conn, cursor = mock_search_db(make_products(3))
+
+    with patch('products.get_db_connection', return_value=conn):
+        response = client.get('/products/search?all=true')
+
+    for product in response.json:
+        assert product['images'] == [f"/products/serve-image/{product['product_id']}.jpg"]
+        assert product['seller_rating'] == 4.25
+
+
+def test_search_with_no_results_skips_image_query(client, mock_search_db):
+    conn, cursor = mock_search_db([])
+
+    with patch('products.get_db_connection', return_value=conn):
+        response = client.get('/products/search?term=nothing&all=true')
+
+    assert response.json == []
+    assert cursor.execute.call_count == 1
+
+
+def test_search_pages_with_keyset_cursor(client, mock_search_db, make_products):
+    # the mock returns limit + 1 rows, like LIMIT %s with one extra row
+    conn, cursor = mock_search_db(make_products(6))
+
+    with patch('products.get_db_connection', return_value=conn):
+        first = client.get('/products/search?limit=5')
+
+    assert first.status_code == 200
+    assert [p['product_id'] for p in first.json['products']] == [1, 2, 3, 4, 5]
+    assert first.json['next_cursor']
+    search_sql, search_params = cursor.execute.call_args_list[0][0]
+    assert 'LIMIT %s' in search_sql
+    assert search_params[-1] == 6
+
+    conn, cursor = mock_search_db(make_products(2))
+    with patch('products.get_db_connection', return_value=conn):
+        second = client.get(f"/products/search?limit=5&cursor={first.json['next_cursor']}")
+
+    assert second.json['next_cursor'] is None
+    search_sql, search_params = cursor.execute.call_args_list[0][0]
+    assert 'p.created_at < %s' in search_sql
+    # the cursor carries the last row's created_at and product_id
+    assert search_params[-2] == 5
+    assert search_params[-4] == datetime.datetime(2025, 5, 1) - datetime.timedelta(minutes=5)
+
+
+def test_search_rejects_bad_cursor(client):
+    response = client.get('/products/search?cursor=not-a-cursor')
+    assert response.status_code == 400
+
+
+def test_search_term_uses_fulltext_with_stems(client, mock_search_db, make_products):
+    conn, cursor = mock_search_db(make_products(1))
+
+    with patch('products.get_db_connection', return_value=conn):
+        response = client.get('/products/search?term=Gaming+Laptops&sort=relevance')
+
+    assert response.status_code == 200
+    search_sql, search_params = cursor.execute.call_args_list[0][0]
+    assert 'MATCH(p.name, p.description) AGAINST' in search_sql
+    assert 'ORDER BY relevance DESC' in search_sql
+    assert 'LIKE' not in search_sql
+    assert search_params[0] == '+gam* +laptop*'
+    assert 'relevance' not in response.json['products'][0]
+
+
+def test_search_short_term_falls_back_to_like(client, mock_search_db):
+    conn, cursor = mock_search_db([])
+
+    with patch('products.get_db_connection', return_value=conn):
+        client.get('/products/search?term=tv')
+
+    search_sql, search_params = cursor.execute.call_args_list[0][0]
+    assert 'LIKE %s' in search_sql
+    assert '%tv%' in search_params
+
+
+@pytest.mark.parametrize('status, served, cache_control', [
+    ('approved', ('/app/product_images', 'abc_photo.jpg'), 'public, max-age=31536000, immutable'),
+    ('pending', ('/app/static/images', 'pending_approval.png'), 'no-cache'),
+])
+def test_serve_image_looks_up_filename_by_equality(client, status, served, cache_control, sql_db):
+    conn, cursor = sql_db(fetchone=lambda sql, params: {'product_id': 1, 'approval_status': status})
+
+    with patch('products.get_db_connection', return_value=conn), \
+            patch('products.send_from_directory', side_effect=lambda *a: Response('image')) as send:
+        response = client.get('/products/serve-image/abc_photo.jpg')
+
+    assert response.status_code == 200
+    send.assert_called_once_with(*served)
+    assert response.headers['Cache-Control'] == cache_control
+    sql, params = cursor.execute.call_args.args
+    assert 'pi.filename = %s' in sql and 'LIKE' not in sql
+    # a soft deleted listing's images go with it
+    assert "p.status != 'deleted'" in sql
+    assert params == ('abc_photo.jpg',)
+
+
+def test_accelerated_image_is_sent_by_nginx(client, sql_db):
+    conn, cursor = sql_db(fetchone=lambda sql, params: {'product_id': 1, 'approval_status': 'approved'})
+
+    with patch('products.get_db_connection', return_value=conn), \
+            patch('products.IMAGE_ACCEL', 'nginx'), \
+            patch('products.send_from_directory') as send:
+        response = client.get('/products/serve-image/abc_photo.jpg')
+
+    assert response.status_code == 200
+    assert response.headers['X-Accel-Redirect'] == '/protected-images/abc_photo.jpg'
+    assert response.headers['Content-Type'] == 'image/jpeg'
+    assert response.data == b''
+    send.assert_not_called()
+
+
+@pytest.mark.parametrize('term', ['batteries', 'battery'])
+def test_plural_and_singular_search_the_same_forms(client, term, mock_search_db, make_products):
+    conn, cursor = mock_search_db(make_products(1))
+
+    with patch('products.get_db_connection', return_value=conn):
+        client.get(f'/products/search?term={term}&sort=relevance')
+
+    search_sql, search_params = cursor.execute.call_args_list[0][0]
+    # batteri* matches the stored plural, battery* the singular
+    assert search_params[0] == '+(battery* batteri*)'
+
+
+@pytest.mark.parametrize('term, query', [('speed', '+speed*'), ('string', '+string*'), ('listing', '+list*'),
+                                         ('boxes', '+box*'), ('box', '+box*'), ('watches', '+watch*'),
+                                         ('dishes', '+dish*'), ('classes', '+class*'), ('phones', '+phone*')])
+def test_stems_keep_words_without_a_real_suffix(term, query):
+    from text_search import boolean_query
+    assert boolean_query(term) == query
+
+
+def test_negative_relevance_offset_is_rejected(client):
+    from products import encode_cursor
+    response = client.get(f'/products/search?term=lamp&sort=relevance&cursor={encode_cursor(-5)}')
+    assert response.status_code == 400
@@ -0,0 +1,66 @@
+# testing the request scoped connection: one checkout per request, committed
+# on success and rolled back on errors. the pool is mocked
+
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+from auth import generate_token
+from user_cache import user_cache
+
+
+@pytest.fixture
+def pool():
+    pool = MagicMock()
+    pooled = pool.connect.return_value
+    pooled.cursor.return_value.fetchone.return_value = {
+        'user_id': 60, 'username': 'gator', 'user_role': 'admin', 'account_status': 'active', 'count': 2,
+    }
+    with patch('app.get_db_pool', return_value=pool):
+        yield pool
+    user_cache.invalidate(60)
+
+
+def auth_headers():
+    return {'Authorization': f'Bearer {generate_token(60, "gator", "admin")}'}
+
+
+def test_successful_request_commits_its_one_connection(client, pool):
+    response = client.get('/messaging/unread-count', headers=auth_headers())
+
+    assert response.json == {'count': 2}
+    # token_required's user lookup and the view shared the checkout
+    pool.connect.assert_called_once()
+    pooled = pool.connect.return_value
+    pooled.commit.assert_called_once()
+    pooled.rollback.assert_not_called()
+    pooled.close.assert_called_once()
+
+
+def test_client_error_rolls_back(client, pool):
+    response = client.put('/auth/users/5/role', json={'role': 'owner'}, headers=auth_headers())
+
+    assert response.status_code == 400
+    pooled = pool.connect.return_value
+    pooled.rollback.assert_called_once()
+    pooled.commit.assert_not_called()
+    pooled.close.assert_called_once()
+
+
+def test_server_error_response_rolls_back(client, pool):
+    # the cached row has no email, so the profile view answers 500
+    response = client.get('/auth/profile', headers=auth_headers())
+
+    assert response.status_code == 500
+    pool.connect.return_value.rollback.assert_called_once()
+    pool.connect.return_value.commit.assert_not_called()
+
+
+def test_unhandled_exception_rolls_back(client, pool):
+    with pytest.raises(TypeError):
+        client.put('/auth/users/5/role', json=5, headers=auth_headers())
+
+    pooled = pool.connect.return_value
+    pooled.rollback.assert_called_once()
+    pooled.commit.assert_not_called()
+    pooled.close.assert_called_once()
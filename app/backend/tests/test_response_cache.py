@@ -0,0 +1,93 @@
+# testing the product response cache: eviction, expiry and tag invalidation
+# plus the cached search route with a mocked database
+
+import time
+from unittest.mock import patch
+
+from response_cache import ResponseCache, invalidate_product, response_cache
+
+
+def test_lru_evicts_oldest_by_count_and_bytes():
+    cache = ResponseCache(max_entries=2, max_bytes=10)
+    cache.set('a', b'1234', {'t'})
+    cache.set('b', b'1234', {'t'})
+    cache.get('a')
+    cache.set('c', b'1234', {'t'})
+
+    # b was least recently used
+    assert cache.get('b') is None
+    assert cache.get('a') == (b'1234', None)
+
+    cache.set('d', b'12345678', set())
+    assert cache.stats()['bytes'] <= 10
+    assert cache.stats()['evictions'] >= 2
+
+
+def test_entries_expire_after_ttl():
+    cache = ResponseCache(ttl=0.01)
+    cache.set('a', b'{}', set())
+    time.sleep(0.02)
+    assert cache.get('a') is None
+
+
+def test_invalidate_drops_only_tagged_entries():
+    cache = ResponseCache()
+    cache.set('detail', b'{}', {'product:1', 'seller:7'})
+    cache.set('feed', b'[]', {'catalog', 'product:2'})
+    cache.set('books', b'[]', {'category:books'})
+
+    cache.invalidate('product:1')
+    assert cache.get('detail') is None
+    assert cache.get('feed') == (b'[]', None)
+
+    cache.invalidate('catalog', 'category:books')
+    assert cache.get('feed') is None and cache.get('books') is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_search_is_served_from_cache_until_invalidated(app, client, mock_search_db, make_products):
+    app.config['RESPONSE_CACHE_ENABLED'] = True
+    response_cache.clear()
+    try:
+        conn, cursor = mock_search_db(make_products(3))
+        with patch('products.get_db_connection', return_value=conn):
+            first = client.get('/products/search?limit=5')
+            second = client.get('/products/search?limit=5')
+            assert cursor.execute.call_count == 2
+            assert second.json == first.json
+
+            # a write to a listing on the page drops the cached page
+            invalidate_product(2, (1, 'Electronics'))
+            client.get('/products/search?limit=5')
+            assert cursor.execute.call_count == 4
+    finally:
+        app.config['RESPONSE_CACHE_ENABLED'] = False
+        response_cache.clear()
+
+
+def test_cache_hits_still_poll_for_other_workers_writes(app, client, mock_search_db, make_products):
+    app.config['RESPONSE_CACHE_ENABLED'] = True
+    app.config['CATALOG_INDEX_ENABLED'] = True
+    response_cache.clear()
+    try:
+        conn, cursor = mock_search_db(make_products(3))
+        with patch('products.get_db_connection', return_value=conn), \
+                patch('catalog_index.catalog.ensure_fresh', return_value=False) as ensure_fresh:
+            client.get('/products/search?limit=5')
+            polls = ensure_fresh.call_count
+            client.get('/products/search?limit=5')
+        # the second request was a hit and still gave the poll its chance
+        assert cursor.execute.call_count == 2
+        assert ensure_fresh.call_count == polls + 1
+    finally:
+        app.config['RESPONSE_CACHE_ENABLED'] = False
+        app.config['CATALOG_INDEX_ENABLED'] = False
+        response_cache.clear()
+
+
+def test_all_categories_search_is_tagged_catalog(app):
+    from products import search_scope
+    with app.test_request_context('/products/search?category=All%20Categories'):
+        assert search_scope() == ['catalog']
+    with app.test_request_context('/products/search?category=Books'):
+        assert search_scope() == ['category:books']
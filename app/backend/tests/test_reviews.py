@@ -0,0 +1,98 @@
+# testing the seller_ratings totals kept next to reviews
+# most tests mock the database, the last one needs the MySQL test database
+
+from decimal import Decimal
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+from auth import generate_token
+from user_cache import user_cache
+
+
+@pytest.fixture
+def reviewer():
+    user_cache.set(70, {'user_id': 70, 'account_status': 'active'})
+    yield {'Authorization': f'Bearer {generate_token(70, "reviewer", "user")}'}
+    user_cache.invalidate(70)
+
+
+def test_review_updates_the_totals_in_its_transaction(client, sql_db, reviewer):
+    conn, cursor = sql_db()
+    cursor.execute.side_effect = lambda sql, params=None: conn.commit.assert_not_called()
+
+    with patch('reviews.get_db_connection', return_value=conn), \
+            patch('reviews.seller_rating_changed') as rating_changed:
+        response = client.post('/reviews/', json={'seller_id': 3, 'rating': 4, 'comment': 'quick sale'},
+                               headers=reviewer)
+
+    assert response.status_code == 201
+    (insert, _), (upsert, params) = [c.args for c in cursor.execute.call_args_list]
+    assert 'INSERT INTO reviews' in insert
+    assert 'INSERT INTO seller_ratings' in upsert and 'ON DUPLICATE KEY UPDATE' in upsert
+    assert params == (3, 4, 4)
+    conn.commit.assert_called_once()
+    rating_changed.assert_called_once_with(conn, 3)
+
+
+def test_rebuild_recomputes_every_seller(app, sql_db):
+    conn, cursor = sql_db()
+    cursor.rowcount = 2
+
+    with patch('reviews.get_db_connection', return_value=conn):
+        result = app.test_cli_runner().invoke(args=['reviews', 'rebuild-ratings'])
+
+    assert 'Rebuilt rating totals for 2 sellers' in result.output
+    delete, rebuild = [c.args[0] for c in cursor.execute.call_args_list]
+    assert delete.strip() == 'DELETE FROM seller_ratings'
+    assert 'COUNT(*), SUM(rating)' in rebuild and 'GROUP BY seller_id' in rebuild
+    conn.commit.assert_called_once()
+
+
+def product_row():
+    return {'product_id': 9, 'user_id': 3, 'name': 'Desk', 'price': Decimal('20.00'),
+            'status': 'active', 'approval_status': 'approved', 'username': 'seller',
+            'seller_rating': Decimal('4.5000')}
+
+
+def test_product_and_search_read_the_stored_average(client, sql_db):
+    def fetchall(sql, params):
+        return [] if 'FROM product_images' in sql else [product_row()]
+
+    conn, cursor = sql_db(fetchall, fetchone=lambda sql, params: product_row())
+    with patch('products.get_db_connection', return_value=conn):
+        product = client.get('/products/9').json
+        found = client.get('/products/search?all=true').json
+
+    assert product['seller_rating'] == 4.5
+    assert found[0]['seller_rating'] == 4.5
+    listing_queries = [c.args[0] for c in cursor.execute.call_args_list if 'FROM products p' in c.args[0]]
+    assert len(listing_queries) == 2
+    for sql in listing_queries:
+        assert 'sr.rating_avg' in sql and 'JOIN seller_ratings sr' in sql
+        # no per request average over the reviews table
+        assert 'FROM reviews' not in sql and 'AVG(' not in sql
+
+
+def test_totals_after_reviews_match_a_rebuild(client, app, db_conn, reviewer):
+    shared = MagicMock(wraps=db_conn)
+    shared.cursor.side_effect = lambda *args, **kwargs: db_conn.cursor(*args, **kwargs)
+    shared.close = MagicMock()
+
+    def totals():
+        cursor = db_conn.cursor()
+        cursor.execute("SELECT seller_id, rating_count, rating_sum FROM seller_ratings ORDER BY seller_id")
+        rows = cursor.fetchall()
+        cursor.close()
+        db_conn.commit()
+        return rows
+
+    with patch('reviews.get_db_connection', return_value=shared):
+        for rating in (5, 2, 4):
+            response = client.post('/reviews/', json={'seller_id': 1, 'rating': rating, 'comment': 'ok'},
+                                   headers=reviewer)
+            assert response.status_code == 201
+        maintained = totals()
+        app.test_cli_runner().invoke(args=['reviews', 'rebuild-ratings'])
+
+    assert maintained == totals()
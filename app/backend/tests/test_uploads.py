@@ -0,0 +1,108 @@
+# testing streamed uploads in create_product
+# files land in a temp image store, the database is mocked
+
+import hashlib
+import io
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+import image_store
+from auth import generate_token
+from user_cache import user_cache
+
+JPEG = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00'
+
+
+def photo(i, size=200):
+    return (io.BytesIO(JPEG + bytes([i]) * size), f'photo{i}.jpg')
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_store, 'UPLOAD_FOLDER', str(tmp_path))
+    monkeypatch.setattr('products.UPLOAD_FOLDER', str(tmp_path))
+    user_cache.set(1, {'user_id': 1, 'account_status': 'active'})
+    with patch('products.warm'):
+        yield tmp_path
+    user_cache.invalidate(1)
+
+
+def stored_images(folder):
+    return sorted(p for p in folder.rglob('*') if p.is_file())
+
+
+def post_listing(client, images):
+    return client.post('/products/', content_type='multipart/form-data', data={
+        'name': 'Desk lamp', 'price': '10', 'condition': 'New', 'category_id': '1',
+        'description': 'works', 'images': images,
+    }, headers={'Authorization': f'Bearer {generate_token(1, "seller", "user")}'})
+
+
+def test_transaction_starts_after_files_are_durable(client, store):
+    count_conn = MagicMock()
+    count_conn.cursor.return_value.fetchone.return_value = (0,)
+    insert_conn = MagicMock()
+    insert_conn.cursor.return_value.lastrowid = 42
+    seen = {}
+
+    def execute(sql, params=None):
+        if 'INSERT INTO products' in sql:
+            seen['files'] = stored_images(store)
+
+    insert_conn.cursor.return_value.execute.side_effect = execute
+    with patch('products.get_db_connection', side_effect=[count_conn, insert_conn]), \
+            patch('products.release_db_connection') as release:
+        response = post_listing(client, [photo(1), photo(2), photo(3)])
+
+    assert response.status_code == 201
+    # the count's connection went back before the upload was read
+    release.assert_called_once()
+    assert len(seen['files']) == 3
+    assert not any(p.suffix == image_store.TEMP_SUFFIX for p in seen['files'])
+    sql, rows = insert_conn.cursor.return_value.executemany.call_args.args
+    # one row per file in upload order, named by content hash
+    expected = [hashlib.sha256(photo(i)[0].read()).hexdigest() + '.jpg' for i in (1, 2, 3)]
+    assert rows == [(42, f'/products/serve-image/{name}') for name in expected]
+    assert seen['files'] == sorted(store / image_store.stored_path(name) for name in expected)
+    insert_conn.commit.assert_called_once()
+
+
+def test_oversized_file_is_rejected_while_streaming(client, store, monkeypatch):
+    monkeypatch.setattr(image_store, 'MAX_IMAGE_BYTES', 100)
+    conn = MagicMock()
+    conn.cursor.return_value.fetchone.return_value = (0,)
+
+    with patch('products.get_db_connection', return_value=conn), \
+            patch('products.release_db_connection'):
+        response = post_listing(client, [photo(1, size=10), photo(2, size=1000)])
+
+    assert response.status_code == 413
+    # the first, smaller file was streamed too, nothing is left behind
+    assert stored_images(store) == []
+    conn.commit.assert_not_called()
+
+
+def test_invalid_content_stores_nothing(client, store):
+    conn = MagicMock()
+    conn.cursor.return_value.fetchone.return_value = (0,)
+
+    with patch('products.get_db_connection', return_value=conn) as get_conn, \
+            patch('products.release_db_connection'):
+        response = post_listing(client, [photo(1), (io.BytesIO(b'#!/bin/sh\nrm -rf /'), 'evil.jpg')])
+
+    assert response.status_code == 400
+    assert 'evil.jpg' in response.get_json()['error']
+    assert stored_images(store) == []
+    # no transaction was opened for the listing
+    assert get_conn.call_count == 1
+
+
+def test_upload_extension_comes_from_content(client, store):
+    jfif = JPEG + b'x' * 200
+    response = client.post('/products/upload-image', content_type='multipart/form-data',
+                           data={'file': (io.BytesIO(jfif), 'фото.jpg')},
+                           headers={'Authorization': f'Bearer {generate_token(1, "seller", "user")}'})
+
+    assert response.status_code == 200
+    assert response.get_json()['url'] == f'/products/serve-image/{hashlib.sha256(jfif).hexdigest()}.jpg'
@@ -0,0 +1,111 @@
+# testing the users cache behind token_required
+# the local cache runs as is, redis is replaced by an in memory stand in
+
+import datetime
+import pickle
+import sys
+import types
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+from auth import generate_token
+from user_cache import LocalUserCache, RedisUserCache, user_cache
+
+JOINED = datetime.datetime(2025, 1, 2, 3, 4, 5)
+
+
+def row(user_id, **extra):
+    return dict({'user_id': user_id, 'username': f'user{user_id}', 'account_status': 'active',
+                 'date_joined': JOINED, 'last_login': None, 'password_hash': '$2b$12$secret'}, **extra)
+
+
+def test_entries_expire_after_the_ttl():
+    cache = LocalUserCache(ttl=30)
+    with patch('user_cache.time.monotonic', return_value=100):
+        cache.set(1, row(1))
+    with patch('user_cache.time.monotonic', return_value=129):
+        assert cache.get(1)['username'] == 'user1'
+    with patch('user_cache.time.monotonic', return_value=131):
+        assert cache.get(1) is None
+    assert cache.stats()['size'] == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = LocalUserCache(max_entries=2)
+    cache.set(1, row(1))
+    cache.set(2, row(2))
+    cache.get(1)
+    cache.set(3, row(3))
+
+    assert cache.get(2) is None
+    assert cache.get(1) is not None and cache.get(3) is not None
+    assert cache.stats()['evictions'] == 1
+
+
+def test_password_hash_is_never_cached():
+    cache = LocalUserCache()
+    cache.set(1, row(1))
+
+    cached = cache.get(1)
+    assert 'password_hash' not in cached
+    assert cached['date_joined'] == JOINED
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value.encode() if isinstance(value, str) else value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+@pytest.fixture
+def redis_cache():
+    store = FakeRedis()
+    redis = types.SimpleNamespace(Redis=types.SimpleNamespace(from_url=lambda url: store))
+    with patch.dict(sys.modules, {'redis': redis}):
+        yield RedisUserCache('redis://cache'), store
+
+
+def test_redis_entries_are_json_without_secrets(redis_cache):
+    cache, store = redis_cache
+    cache.set(1, row(1))
+
+    raw = store.data['gm:user:1']
+    assert b'password_hash' not in raw and b'$2b$' not in raw
+    assert cache.get(1) == {'user_id': 1, 'username': 'user1', 'account_status': 'active',
+                            'date_joined': JOINED, 'last_login': None}
+
+
+def test_redis_payloads_are_never_unpickled(redis_cache):
+    cache, store = redis_cache
+
+    class Exploit:
+        def __reduce__(self):
+            return (pytest.fail, ('unpickled a cache entry',))
+
+    store.data['gm:user:1'] = pickle.dumps(Exploit())
+    assert cache.get(1) is None
+    assert cache.stats()['errors'] == 1
+
+
+def test_status_change_drops_the_cached_user(client):
+    user_cache.set(1, {'user_id': 1, 'account_status': 'active', 'user_role': 'admin'})
+    user_cache.set(5, {'user_id': 5, 'account_status': 'active', 'user_role': 'user'})
+    try:
+        with patch('auth.get_db_connection', return_value=MagicMock()):
+            response = client.put('/auth/users/5/status', json={'status': 'inactive/banned'},
+                                  headers={'Authorization': f'Bearer {generate_token(1, "admin", "admin")}'})
+        assert response.status_code == 200
+        # the next request for user 5 reads the banned row from the database
+        assert user_cache.get(5) is None
+    finally:
+        user_cache.invalidate(1)
+        user_cache.invalidate(5)
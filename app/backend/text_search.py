@@ -0,0 +1,97 @@
+# tokenizing and light stemming for product name/description search
+# MySQL FULLTEXT has no stemming, so search terms are reduced to a stem and
+# matched as a prefix (laptops -> +laptop*), which also matches the plural,
+# -ing and -ed forms stored in the index. a stem has to be a prefix of every
+# stored form, so -y / -ies words search both spellings: battery and batteries
+# both become +(battery* batteri*)
+import re
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+# innodb_ft_min_token_size default, shorter words are not in the index
+MIN_TOKEN_LENGTH = 3
+
+# InnoDB's default FULLTEXT stopword list
+STOPWORDS = {
+    'a', 'about', 'an', 'are', 'as', 'at', 'be', 'by', 'com', 'de', 'en', 'for',
+    'from', 'how', 'i', 'in', 'is', 'it', 'la', 'of', 'on', 'or', 'that', 'the',
+    'this', 'to', 'was', 'what', 'when', 'where', 'who', 'will', 'with', 'und', 'www',
+}
+
+
+VOWELS = set('aeiouy')
+
+
+def _has_vowel(stem):
+    return any(c in VOWELS for c in stem[:-1]) or stem[-1:] in 'aeiou'
+
+
+def stem(token):
+    """Strip common English suffixes, never shorter than MIN_TOKEN_LENGTH"""
+    if len(token) > 4 and token.endswith('ies'):
+        return token[:-3] + 'y'
+    if token.endswith('sses'):
+        return token[:-2]
+    # speed, need: the e is part of the word, not an -ed suffix
+    if token.endswith('eed'):
+        return token
+    # only strip when a vowel is left, string and spring stay whole
+    if len(token) > 5 and token.endswith('ing') and _has_vowel(token[:-3]):
+        return token[:-3]
+    if len(token) > 4 and token.endswith('ed') and _has_vowel(token[:-2]):
+        return token[:-2]
+    # boxes, watches: the e belongs to the -es, box* still matches both forms
+    if (len(token) - 2 >= MIN_TOKEN_LENGTH and token.endswith('es')
+            and token[:-2].endswith(('s', 'x', 'z', 'ch', 'sh'))):
+        return token[:-2]
+    if len(token) > MIN_TOKEN_LENGTH and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+
+def prefixes(stemmed):
+    """Prefixes that together match every stored form of a stem
+
+    battery -> (battery, batteri), the second matches batteries
+    """
+    if len(stemmed) > MIN_TOKEN_LENGTH and stemmed.endswith('y') and stemmed[-2] not in VOWELS:
+        return (stemmed, stemmed[:-1] + 'i')
+    return (stemmed,)
+
+
+def tokenize(text):
+    """Lowercase word stems in order, including short words and stopwords"""
+    return [stem(token) for token in TOKEN_RE.findall((text or '').lower())]
+
+
+def search_tokens(text):
+    """Distinct stems that can be looked up in a FULLTEXT index
+
+    Each is a tuple of prefixes(), a word matches the stem when it starts
+    with any of them.
+    """
+    tokens = []
+    for token in tokenize(text):
+        if len(token) >= MIN_TOKEN_LENGTH and token not in STOPWORDS:
+            alternatives = prefixes(token)
+            if alternatives not in tokens:
+                tokens.append(alternatives)
+    return tokens
+
+
+def boolean_query(text):
+    """MATCH ... AGAINST boolean mode string requiring every stem, or None
+
+    None means nothing indexable is left (e.g. "tv" or "the"), callers fall
+    back to a LIKE scan for those.
+    """
+    tokens = search_tokens(text)
+    if not tokens:
+        return None
+    terms = []
+    for alternatives in tokens:
+        if len(alternatives) == 1:
+            terms.append(f'+{alternatives[0]}*')
+        else:
+            terms.append('+(' + ' '.join(f'{prefix}*' for prefix in alternatives) + ')')
+    return ' '.join(terms)
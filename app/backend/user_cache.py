@@ -0,0 +1,174 @@
+# cache of users rows for token_required, keyed by the token's sub (user_id)
+# saves the users SELECT on every authenticated request, entries expire after
+# USER_CACHE_TTL seconds and are dropped explicitly whenever a user's status,
+# role or verification changes or the account is deleted
+#
+# USER_CACHE_BACKEND=local (default) keeps an LRU per gunicorn worker,
+# USER_CACHE_BACKEND=redis shares entries and invalidations across workers
+# (needs the redis package and USER_CACHE_REDIS_URL)
+#
+# only USER_COLUMNS are kept, never password_hash, and redis holds them as JSON
+# so nothing read back from it is ever unpickled
+import collections
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# what views read from current_user
+USER_COLUMNS = ('user_id', 'username', 'email', 'first_name', 'last_name', 'user_role',
+                'account_status', 'verification_status', 'profile_picture_url',
+                'date_joined', 'last_login')
+DATETIME_COLUMNS = ('date_joined', 'last_login')
+
+
+def cached_fields(user):
+    return {column: user[column] for column in USER_COLUMNS if column in user}
+
+
+def dump_user(user):
+    row = cached_fields(user)
+    for column in DATETIME_COLUMNS:
+        if isinstance(row.get(column), datetime.datetime):
+            row[column] = row[column].isoformat()
+    return json.dumps(row)
+
+
+def load_user(raw):
+    row = json.loads(raw)
+    for column in DATETIME_COLUMNS:
+        if row.get(column):
+            row[column] = datetime.datetime.fromisoformat(row[column])
+    return row
+
+
+class LocalUserCache:
+    """In process TTL + LRU cache"""
+
+    def __init__(self, ttl=30, max_entries=2048):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'invalidations': 0, 'evictions': 0}
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._entries[user_id]
+                self._counters['misses'] += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self._counters['hits'] += 1
+            # hand out a copy so a view can't change the cached row
+            return dict(entry[1])
+
+    def set(self, user_id, user):
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, cached_fields(user))
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._counters['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({'backend': 'local', 'size': len(self._entries), 'ttl': self.ttl})
+        return stats
+
+
+class RedisUserCache:
+    """Cache shared by every worker, redis handles the ttl"""
+
+    def __init__(self, url, ttl=30, prefix='gm:user:'):
+        import redis
+        self.ttl = ttl
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'invalidations': 0, 'errors': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def get(self, user_id):
+        try:
+            raw = self._client.get(f"{self.prefix}{user_id}")
+        except Exception as e:
+            # a cache outage falls back to the database instead of failing auth
+            logger.warning(f"User cache read failed: {e}")
+            self._count('errors')
+            return None
+        if raw is None:
+            self._count('misses')
+            return None
+        try:
+            user = load_user(raw)
+        except ValueError:
+            # not ours, e.g. an entry from before the JSON format
+            self._count('errors')
+            return None
+        self._count('hits')
+        return user
+
+    def set(self, user_id, user):
+        try:
+            self._client.set(f"{self.prefix}{user_id}", dump_user(user), ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"User cache write failed: {e}")
+            self._count('errors')
+
+    def invalidate(self, user_id):
+        try:
+            self._client.delete(f"{self.prefix}{user_id}")
+            self._count('invalidations')
+        except Exception as e:
+            logger.error(f"User cache invalidation failed for user {user_id}: {e}")
+            self._count('errors')
+
+    def clear(self):
+        for key in self._client.scan_iter(f"{self.prefix}*"):
+            self._client.delete(key)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats.update({'backend': 'redis', 'ttl': self.ttl})
+        return stats
+
+
+def _build_cache():
+    ttl = int(os.getenv('USER_CACHE_TTL', 30))
+    backend = os.getenv('USER_CACHE_BACKEND', 'local').lower()
+    if backend == 'redis':
+        try:
+            return RedisUserCache(os.getenv('USER_CACHE_REDIS_URL', 'redis://localhost:6379/0'), ttl=ttl)
+        except ImportError:
+            logger.warning("USER_CACHE_BACKEND=redis but redis is not installed, using the local cache")
+    return LocalUserCache(ttl=ttl, max_entries=int(os.getenv('USER_CACHE_SIZE', 2048)))
+
+
+user_cache = _build_cache()
+
+
+def invalidate_user(user_id):
+    """Drop a cached user, call after the change is committed"""
+    user_cache.invalidate(int(user_id))
@@ -3,6 +3,7 @@
 from flask import Blueprint, request, jsonify
 from auth import token_required
 from app import get_db_connection
+from conditional import conditional_json
 import logging
 
 # Fix the Blueprint initialization
@@ -84,6 +85,7 @@ def remove_from_wishlist(current_user, product_id):
 
 # returns current user's wishlist
 @wishlist_bp.route('/user', methods=['GET'])
+@conditional_json(private=True)
 @token_required
 def get_user_wishlist(current_user):
     conn = None
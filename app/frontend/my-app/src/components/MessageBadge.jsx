@@ -1,40 +1,13 @@
 // app/frontend/my-app/src/components/MessageBadge.jsx
-import React, { useState, useEffect } from 'react';
-import axios from 'axios';
+import React from 'react';
 import { Link } from 'react-router-dom';
 import { MessageCircle } from 'lucide-react';
-import config from '../config';
+import useUnreadCount from '../hooks/useUnreadCount';
 
 const MessageBadge = () => {
-  const [unreadCount, setUnreadCount] = useState(0);
-  const [isLoggedIn, setIsLoggedIn] = useState(false);
-
-  useEffect(() => {
-    const token = localStorage.getItem('token');
-    if (token) {
-      setIsLoggedIn(true);
-      fetchUnreadCount();
-      
-      // Set up an interval to check for new messages every 30 seconds
-      const interval = setInterval(fetchUnreadCount, 30000);
-      return () => clearInterval(interval);
-    }
-  }, []);
-
-  const fetchUnreadCount = async () => {
-    try {
-      const token = localStorage.getItem('token');
-      if (!token) return;
-      
-      const response = await axios.get(`${config.apiUrl}/messaging/unread-count`, {
-        headers: { Authorization: `Bearer ${token}` }
-      });
-      
-      setUnreadCount(response.data.count);
-    } catch (error) {
-      console.error('Error fetching unread message count:', error);
-    }
-  };
+  const isLoggedIn = !!localStorage.getItem('token');
+  // pushed over /messaging/stream, polled only when streaming isn't available
+  const unreadCount = useUnreadCount();
 
   if (!isLoggedIn) return null;
 
@@ -11,15 +11,16 @@ import {
   Heart,
 } from "lucide-react";
 import { toast } from "react-hot-toast";
-import axios from "axios";
 import config from "../config";
+import useUnreadCount from "../hooks/useUnreadCount";
 
 const Navbar = () => {
   const [isOpen, setIsOpen] = useState(false);
   const [profileMenuOpen, setProfileMenuOpen] = useState(false);
   const [isLoggedIn, setIsLoggedIn] = useState(false);
   const [user, setUser] = useState(null);
-  const [unreadCount, setUnreadCount] = useState(0);
+  // pushed over /messaging/stream, polled only when streaming isn't available
+  const unreadCount = useUnreadCount();
   const navigate = useNavigate();
 
   useEffect(() => {
@@ -29,7 +30,6 @@ const Navbar = () => {
     if (token && userData) {
       setIsLoggedIn(true);
       setUser(JSON.parse(userData));
-      fetchUnreadCount();
   
       const fetchNotifications = async () => {
         console.log("⏱️ Checking for wishlist notifications...");
@@ -62,7 +62,6 @@ const Navbar = () => {
       };
   
       const interval = setInterval(() => {
-        fetchUnreadCount();
         fetchNotifications();
       }, 30000); // every 30 seconds
   
@@ -71,25 +70,6 @@ const Navbar = () => {
   }, []);
   
 
-  const fetchUnreadCount = async () => {
-    try {
-      const token = localStorage.getItem("token");
-      if (!token) return;
-
-      const response = await axios.get(
-        `${config.apiUrl}/messaging/unread-count`,
-        {
-          headers: { Authorization: `Bearer ${token}` },
-        }
-      );
-
-      setUnreadCount(response.data.count);
-    } catch (error) {
-      console.error("Error fetching unread message count:", error);
-      setUnreadCount(0);
-    }
-  };
-
   const handleLogout = () => {
     fetch(`${config.apiUrl}/auth/logout`, {
       method: "POST",
@@ -189,9 +189,14 @@ const ProductCard = ({ product }) => {
   };
   
   // Helper function to get the full image URL
-  const getImageUrl = (imagePath) => {
+  // size asks the backend for a resized copy (thumb 320px, medium 800px)
+  const getImageUrl = (imagePath, size) => {
     if (!imagePath) return "/pictures/placeholder.png";
-    return imagePath.startsWith("/") ? `${config.apiUrl}${imagePath}` : imagePath;
+    if (!imagePath.startsWith("/")) return imagePath;
+    const url = `${config.apiUrl}${imagePath}`;
+    return size && imagePath.startsWith("/products/serve-image/")
+      ? `${url}?size=${size}`
+      : url;
   };
 
   // Placeholder image fallback for error handling
@@ -205,9 +210,10 @@ const ProductCard = ({ product }) => {
       >
         <div className="relative h-48 bg-gray-200">
           <img
-            src={getImageUrl(product.images?.[0])}
+            src={getImageUrl(product.images?.[0], "thumb")}
             alt={product.name}
             className="w-full h-full object-contain"
+            loading="lazy"
             onError={(e) => {
               e.target.onerror = null;
               e.target.src = placeholderImage;
@@ -316,7 +322,7 @@ const ProductCard = ({ product }) => {
                 {/* Primary Image Display */}
                 <div className="aspect-square bg-gray-100 rounded-lg overflow-hidden relative">
                   <img
-                    src={getImageUrl(product.images?.[currentImageIndex])}
+                    src={getImageUrl(product.images?.[currentImageIndex], "medium")}
                     alt={`${product.name} - Image ${currentImageIndex + 1}`}
                     className="w-full h-full object-contain"
                     onError={(e) => {
@@ -361,7 +367,7 @@ const ProductCard = ({ product }) => {
                         }}
                       >
                         <img
-                          src={getImageUrl(image)}
+                          src={getImageUrl(image, "thumb")}
                           alt={`${product.name} thumbnail ${index + 1}`}
                           className="w-full h-full object-contain"
                           onError={(e) => {
@@ -452,7 +458,7 @@ const ProductCard = ({ product }) => {
             <div className="flex items-start mb-4">
               <div className="w-16 h-16 bg-gray-100 rounded overflow-hidden mr-3 flex-shrink-0">
                 <img
-                  src={getImageUrl(product.images?.[0])}
+                  src={getImageUrl(product.images?.[0], "thumb")}
                   alt={product.name}
                   className="w-full h-full object-contain"
                   onError={(e) => {
@@ -517,7 +523,7 @@ const ProductCard = ({ product }) => {
             <div className="flex items-start mb-4">
               <div className="w-16 h-16 bg-gray-100 rounded overflow-hidden mr-3 flex-shrink-0">
                 <img
-                  src={getImageUrl(product.images?.[0])}
+                  src={getImageUrl(product.images?.[0], "thumb")}
                   alt={product.name}
                   className="w-full h-full object-contain"
                   onError={(e) => {
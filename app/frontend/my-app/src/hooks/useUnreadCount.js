@@ -0,0 +1,123 @@
+// useUnreadCount.js
+import { useEffect, useState } from 'react';
+import axios from 'axios';
+import config from '../config';
+
+/**
+ * Unread message count pushed from /messaging/stream
+ * One EventSource is shared by every component in the tab. It opens with a
+ * short lived ticket from /messaging/stream-ticket, so the login token never
+ * ends up in a URL. When the server can't stream (or the browser has no
+ * EventSource) it falls back to polling /messaging/unread-count every 30
+ * seconds like before.
+ */
+const POLL_INTERVAL = 30000;
+const RECONNECT_DELAY = 5000;
+
+const listeners = new Set();
+let count = 0;
+let source = null;
+let pollTimer = null;
+let reconnectTimer = null;
+
+const setCount = (value) => {
+  count = value;
+  listeners.forEach((listener) => listener(value));
+};
+
+const fetchUnreadCount = async () => {
+  try {
+    const token = localStorage.getItem('token');
+    if (!token) return;
+    const response = await axios.get(`${config.apiUrl}/messaging/unread-count`, {
+      headers: { Authorization: `Bearer ${token}` }
+    });
+    setCount(response.data.count);
+  } catch (error) {
+    console.error('Error fetching unread message count:', error);
+  }
+};
+
+const startPolling = () => {
+  if (pollTimer) return;
+  fetchUnreadCount();
+  pollTimer = setInterval(fetchUnreadCount, POLL_INTERVAL);
+};
+
+const connect = async () => {
+  reconnectTimer = null;
+  const token = localStorage.getItem('token');
+  if (!token) return;
+  if (typeof window.EventSource === 'undefined') {
+    startPolling();
+    return;
+  }
+
+  let ticket;
+  try {
+    const response = await axios.post(`${config.apiUrl}/messaging/stream-ticket`, null, {
+      headers: { Authorization: `Bearer ${token}` }
+    });
+    ticket = response.data.ticket;
+  } catch (error) {
+    // 503 when the server runs without gevent workers
+    startPolling();
+    return;
+  }
+  // every component went away while the ticket was on its way
+  if (listeners.size === 0 || source) return;
+
+  let opened = false;
+  source = new EventSource(`${config.apiUrl}/messaging/stream?ticket=${encodeURIComponent(ticket)}`);
+  source.onopen = () => {
+    opened = true;
+  };
+  source.addEventListener('unread', (event) => {
+    setCount(JSON.parse(event.data).count);
+  });
+  source.onerror = () => {
+    // the ticket has expired by the time the browser would retry the same URL,
+    // reopen a stream that was working with a new one, poll if it never opened
+    source.close();
+    source = null;
+    if (opened) {
+      reconnectTimer = setTimeout(connect, RECONNECT_DELAY);
+    } else {
+      startPolling();
+    }
+  };
+};
+
+const disconnect = () => {
+  if (source) {
+    source.close();
+    source = null;
+  }
+  if (reconnectTimer) {
+    clearTimeout(reconnectTimer);
+    reconnectTimer = null;
+  }
+  if (pollTimer) {
+    clearInterval(pollTimer);
+    pollTimer = null;
+  }
+};
+
+function useUnreadCount() {
+  const [unreadCount, setUnreadCount] = useState(count);
+
+  useEffect(() => {
+    listeners.add(setUnreadCount);
+    if (listeners.size === 1) connect();
+    setUnreadCount(count);
+
+    return () => {
+      listeners.delete(setUnreadCount);
+      if (listeners.size === 0) disconnect();
+    };
+  }, []);
+
+  return unreadCount;
+}
+
+export default useUnreadCount;
@@ -53,7 +53,7 @@ const UserProfile = () => {
     try {
       const user = JSON.parse(localStorage.getItem("user"));
       const response = await axios.get(
-        `${config.apiUrl}/products/search?user_id=${user.user_id}`,
+        `${config.apiUrl}/products/search?all=true&user_id=${user.user_id}`,
         {
           headers: { Authorization: `Bearer ${localStorage.getItem("token")}` },
         }
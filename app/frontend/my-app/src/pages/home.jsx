@@ -60,9 +60,10 @@ const HomePage = () => {
   }, [searchTerm, selectedCategory]);
 
   const buildQueryString = (category = selectedCategory, term = searchTerm) => {
-    let query = "";
+    // all=true keeps the unpaginated array response from /products/search
+    let query = "all=true";
     if (term.trim() !== "") {
-      query += `term=${encodeURIComponent(term.trim())}`;
+      query += `&term=${encodeURIComponent(term.trim())}`;
     }
     if (category !== "All Categories") {
       if (query !== "") query += "&";
@@ -23,6 +23,15 @@ import {
 } from "lucide-react";
 import { toast } from "react-hot-toast";
 
+// messages per page when opening a conversation or loading earlier ones
+const MESSAGE_PAGE_SIZE = 50;
+// seconds the server may park a request waiting for replies
+const LONG_POLL_SECONDS = 25;
+// pause between polls when the server answers without parking, or after an error
+const POLL_RETRY_MS = 5000;
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
 const MessagePage = () => {
   // route and navigation hooks
   const { conversationId } = useParams();
@@ -32,6 +41,9 @@ const MessagePage = () => {
   // State variables for messages, user, UI
   const [conversations, setConversations] = useState([]);
   const [messages, setMessages] = useState([]);
+  const [hasOlderMessages, setHasOlderMessages] = useState(false);
+  // newest message id shown, read by the long poll loop
+  const lastMessageIdRef = useRef(null);
   const [newMessage, setNewMessage] = useState("");
   const [loading, setLoading] = useState(true);
   const [selectedConversation, setSelectedConversation] = useState(null);
@@ -88,6 +100,59 @@ const MessagePage = () => {
     }
   }, [conversationId, location, navigate]);
 
+  useEffect(() => {
+    lastMessageIdRef.current = messages.length ? messages[messages.length - 1].message_id : null;
+  }, [messages]);
+
+  // wait for replies with a long poll while a conversation is open
+  useEffect(() => {
+    if (!conversationId) return;
+    let active = true;
+    const controller = new AbortController();
+    // wait for this conversation's first page before polling from its last id
+    lastMessageIdRef.current = null;
+
+    const poll = async () => {
+      while (active) {
+        const lastId = lastMessageIdRef.current;
+        if (lastId === null) {
+          await sleep(1000);
+          continue;
+        }
+        const started = Date.now();
+        try {
+          const token = localStorage.getItem("token");
+          const response = await axios.get(
+            `${config.apiUrl}/messaging/conversations/${conversationId}/messages`,
+            {
+              params: { after: lastId, wait: LONG_POLL_SECONDS, limit: MESSAGE_PAGE_SIZE },
+              headers: { Authorization: `Bearer ${token}` },
+              signal: controller.signal,
+            }
+          );
+          if (!active) return;
+          if (response.data.messages.length) {
+            appendMessages(response.data.messages);
+            markAsRead(conversationId);
+          } else if (Date.now() - started < 1000) {
+            // the server didn't park the request, fall back to plain polling
+            await sleep(POLL_RETRY_MS);
+          }
+        } catch (error) {
+          if (!active) return;
+          console.error("Error waiting for new messages:", error);
+          await sleep(POLL_RETRY_MS);
+        }
+      }
+    };
+    poll();
+
+    return () => {
+      active = false;
+      controller.abort();
+    };
+  }, [conversationId]);
+
   useEffect(() => {
     // Increment render key to force re-render when conversation changes
     setRenderKey(prev => prev + 1);
@@ -161,20 +226,32 @@ const MessagePage = () => {
     }
   };
 
-  // load messages and mark as read
+  // load the latest page of messages and mark as read
   const fetchMessages = async (id) => {
     try {
       const token = localStorage.getItem("token");
       const response = await axios.get(
         `${config.apiUrl}/messaging/conversations/${id}/messages`,
         {
+          params: { limit: MESSAGE_PAGE_SIZE },
           headers: { Authorization: `Bearer ${token}` },
         }
       );
-      setMessages(response.data || []);
+      setMessages(response.data.messages || []);
+      setHasOlderMessages(response.data.has_more);
       setLoading(false);
 
-      // Mark messages as read
+      await markAsRead(id);
+    } catch (error) {
+      console.error("Error fetching messages:", error);
+      setLoading(false);
+    }
+  };
+
+  // Mark messages as read
+  const markAsRead = async (id) => {
+    try {
+      const token = localStorage.getItem("token");
       await axios.post(
         `${config.apiUrl}/messaging/conversations/${id}/read`,
         {},
@@ -183,8 +260,62 @@ const MessagePage = () => {
         }
       );
     } catch (error) {
-      console.error("Error fetching messages:", error);
-      setLoading(false);
+      console.error("Error marking messages as read:", error);
+    }
+  };
+
+  // add messages after the ones shown, skipping any already there
+  const appendMessages = (newMessages) => {
+    setMessages((prev) => {
+      const seen = new Set(prev.map((msg) => msg.message_id));
+      return [...prev, ...newMessages.filter((msg) => !seen.has(msg.message_id))];
+    });
+  };
+
+  // append only the messages newer than the last one shown
+  const fetchNewMessages = async (id) => {
+    const lastMessage = messages[messages.length - 1];
+    if (!lastMessage) {
+      fetchMessages(id);
+      return;
+    }
+    try {
+      const token = localStorage.getItem("token");
+      const response = await axios.get(
+        `${config.apiUrl}/messaging/conversations/${id}/messages`,
+        {
+          params: { after: lastMessage.message_id, limit: MESSAGE_PAGE_SIZE },
+          headers: { Authorization: `Bearer ${token}` },
+        }
+      );
+      if (response.data.has_more) {
+        // fell too far behind, start over from the latest page
+        fetchMessages(id);
+        return;
+      }
+      appendMessages(response.data.messages);
+    } catch (error) {
+      console.error("Error fetching new messages:", error);
+    }
+  };
+
+  // prepend the page before the oldest message shown
+  const fetchOlderMessages = async () => {
+    if (!messages.length) return;
+    try {
+      const token = localStorage.getItem("token");
+      const response = await axios.get(
+        `${config.apiUrl}/messaging/conversations/${conversationId}/messages`,
+        {
+          params: { before: messages[0].message_id, limit: MESSAGE_PAGE_SIZE },
+          headers: { Authorization: `Bearer ${token}` },
+        }
+      );
+      setMessages((prev) => [...response.data.messages, ...prev]);
+      setHasOlderMessages(response.data.has_more);
+    } catch (error) {
+      console.error("Error fetching older messages:", error);
+      toast.error("Failed to load earlier messages");
     }
   };
 
@@ -203,7 +334,7 @@ const MessagePage = () => {
         }
       );
       setNewMessage("");
-      fetchMessages(conversationId);
+      fetchNewMessages(conversationId);
     } catch (error) {
       console.error("Error sending message:", error);
       toast.error("Failed to send message");
@@ -221,7 +352,7 @@ const MessagePage = () => {
           headers: { Authorization: `Bearer ${token}` },
         }
       );
-      fetchMessages(conversationId);
+      fetchNewMessages(conversationId);
       toast.success("Meeting suggestion sent");
     } catch (error) {
       console.error("Error sending meeting suggestion:", error);
@@ -577,6 +708,16 @@ const MessagePage = () => {
 
                   {/* Messages area with proper height calculation */}
                   <div className="flex-grow overflow-y-auto p-4">
+                    {hasOlderMessages && (
+                      <div className="text-center mb-4">
+                        <button
+                          onClick={fetchOlderMessages}
+                          className="text-sm text-[#2E0854] underline hover:text-purple-800"
+                        >
+                          Load earlier messages
+                        </button>
+                      </div>
+                    )}
                     {messages.map((msg) => (
                       <div
                         key={msg.message_id}
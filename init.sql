@@ -19,7 +19,12 @@ CREATE TABLE IF NOT EXISTS users (
     last_login TIMESTAMP NULL,
     user_role ENUM('user', 'moderator', 'admin') DEFAULT 'user',
     account_status ENUM('active', 'inactive/banned', 'deleted') DEFAULT 'active',
-    bookmarked_products JSON DEFAULT NULL
+    bookmarked_products JSON DEFAULT NULL,
+    -- set by cascade.py soft deletes, purged in the background
+    deleted_at TIMESTAMP NULL,
+    INDEX idx_users_deleted (deleted_at),
+    -- expired account cleanup only scans (and locks) unverified users
+    INDEX idx_users_verification (verification_status, date_joined)
 );
 
 -- Categories for organizing products
@@ -40,8 +45,15 @@ CREATE TABLE IF NOT EXISTS products (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     status ENUM('active', 'sold', 'deleted') DEFAULT 'active',
     approval_status ENUM('pending', 'approved', 'rejected') DEFAULT 'pending',
+    -- set by cascade.py soft deletes, purged in the background
+    deleted_at TIMESTAMP NULL,
     FOREIGN KEY (user_id) REFERENCES users(user_id),
-    FOREIGN KEY (category_id) REFERENCES categories(category_id)
+    FOREIGN KEY (category_id) REFERENCES categories(category_id),
+    INDEX idx_products_deleted (deleted_at),
+    -- keyset pagination for /products/search (newest first)
+    INDEX idx_products_feed (approval_status, status, created_at, product_id),
+    -- term search for /products/search
+    FULLTEXT INDEX ft_products_text (name, description)
 );
 
 -- images associated with each product
@@ -49,8 +61,19 @@ CREATE TABLE IF NOT EXISTS product_images (
     image_id INT AUTO_INCREMENT PRIMARY KEY,
     product_id INT NOT NULL,
     image_url VARCHAR(255) NOT NULL,
+    -- last path segment of image_url, looked up by /products/serve-image/<filename>
+    -- MySQL backfills it when added to an existing database:
+    --   ALTER TABLE product_images
+    --     ADD COLUMN filename VARCHAR(255) AS (SUBSTRING_INDEX(image_url, '/', -1)) STORED,
+    --     ADD INDEX idx_product_images_filename (filename);
+    -- databases that already have the unique index:
+    --   ALTER TABLE product_images DROP INDEX idx_product_images_filename,
+    --     ADD INDEX idx_product_images_filename (filename);
+    filename VARCHAR(255) AS (SUBSTRING_INDEX(image_url, '/', -1)) STORED,
     uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (product_id) REFERENCES products(product_id) ON DELETE CASCADE
+    FOREIGN KEY (product_id) REFERENCES products(product_id) ON DELETE CASCADE,
+    -- not unique, listings uploading the same photo share one content addressed file
+    INDEX idx_product_images_filename (filename)
 );
 
 -- product review system
@@ -60,7 +83,26 @@ CREATE TABLE IF NOT EXISTS reviews (
     rating INT NOT NULL CHECK (rating BETWEEN 1 AND 5),
     comment TEXT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (seller_id) REFERENCES users(user_id)
+    FOREIGN KEY (seller_id) REFERENCES users(user_id),
+    INDEX idx_reviews_seller_created (seller_id, created_at)
+);
+
+-- running rating totals per seller, kept current by reviews.create_review
+-- rebuild from reviews with: flask --app app reviews rebuild-ratings
+CREATE TABLE IF NOT EXISTS seller_ratings (
+    seller_id INT PRIMARY KEY,
+    rating_count INT NOT NULL DEFAULT 0,
+    rating_sum INT NOT NULL DEFAULT 0,
+    rating_avg DECIMAL(7,4) AS (IF(rating_count = 0, NULL, rating_sum / rating_count)) STORED,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+);
+
+-- product ids touched by writes, polled by every worker to keep its in memory catalog current
+CREATE TABLE IF NOT EXISTS catalog_changes (
+    change_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    product_id INT NOT NULL,
+    changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_catalog_changes_time (changed_at)
 );
 
 -- conversations initiated around specific product
@@ -82,9 +124,14 @@ CREATE TABLE IF NOT EXISTS conversation_participants (
     user_id INT NOT NULL,
     role ENUM('buyer', 'seller') NOT NULL,
     last_read_at TIMESTAMP NULL,
+    -- messages from the other side since last_read_at, kept by messaging.py
+    -- rebuild with: flask --app app messaging reconcile-unread
+    unread_count INT NOT NULL DEFAULT 0,
     FOREIGN KEY (conversation_id) REFERENCES conversations(conversation_id),
     FOREIGN KEY (user_id) REFERENCES users(user_id),
-    UNIQUE KEY unique_participant (conversation_id, user_id)
+    UNIQUE KEY unique_participant (conversation_id, user_id),
+    -- unread badge is a SUM over this index
+    INDEX idx_participants_user_unread (user_id, unread_count)
 );
 
 -- messages exchanged in a convo
@@ -97,7 +144,23 @@ CREATE TABLE IF NOT EXISTS messages (
     attachment_url VARCHAR(255) NULL,
     message_type ENUM('text', 'reminder_proposal', 'reminder_update', 'system') DEFAULT 'text',
     FOREIGN KEY (conversation_id) REFERENCES conversations(conversation_id),
-    FOREIGN KEY (sender_id) REFERENCES users(user_id)
+    FOREIGN KEY (sender_id) REFERENCES users(user_id),
+    INDEX idx_messages_conversation_sent (conversation_id, sent_at),
+    -- paged history, message ids are the cursors
+    INDEX idx_messages_conversation (conversation_id, message_id)
+);
+
+-- inbox projection, one row per conversation kept current by messaging.py
+-- rebuild with: flask --app app messaging rebuild-summaries
+CREATE TABLE IF NOT EXISTS conversation_summaries (
+    conversation_id INT PRIMARY KEY,
+    last_message_id INT NULL,
+    last_message_text TEXT NULL,
+    last_message_time TIMESTAMP NULL,
+    message_count INT NOT NULL DEFAULT 0,
+    -- product images are only added when a listing is created, before any conversation
+    first_image_url VARCHAR(255) NULL,
+    FOREIGN KEY (conversation_id) REFERENCES conversations(conversation_id)
 );
 
 -- tracks products bookmarked by users (wishlisted items)
@@ -126,6 +189,24 @@ CREATE TABLE IF NOT EXISTS user_reports (
     FOREIGN KEY (reported_user_id) REFERENCES users(user_id)
 );
 
+-- outgoing email, written by the views and delivered by email_outbox.py
+CREATE TABLE IF NOT EXISTS email_outbox (
+    email_id INT AUTO_INCREMENT PRIMARY KEY,
+    to_email VARCHAR(255) NOT NULL,
+    subject VARCHAR(255) NOT NULL,
+    text_body TEXT NOT NULL,
+    html_body MEDIUMTEXT NULL,
+    status ENUM('pending', 'sending', 'sent', 'dead') NOT NULL DEFAULT 'pending',
+    attempts INT NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    -- a 'sending' row whose lease ran out is claimed again
+    locked_until TIMESTAMP NULL,
+    last_error VARCHAR(1000) NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP NULL,
+    INDEX idx_outbox_due (status, next_attempt_at)
+);
+
 -- create app-specific user for db access
 CREATE USER IF NOT EXISTS 'csc648user'@'%' IDENTIFIED BY 'Csc648_P@ss!';
 GRANT ALL PRIVILEGES ON gator_market.* TO 'csc648user'@'%';
@@ -195,6 +276,9 @@ INSERT INTO reviews (seller_id, rating, comment, created_at) VALUES
 (1, 5, 'Product exactly as described. Thank you!', NOW()),
 (1, 3, 'Item was fine, but shipping was delayed.', NOW());
 
+INSERT INTO seller_ratings (seller_id, rating_count, rating_sum)
+SELECT seller_id, COUNT(*), SUM(rating) FROM reviews GROUP BY seller_id;
+
 INSERT INTO conversations (product_id, subject, status)
 SELECT 1, 'Interested in your product', 'active' FROM products WHERE product_id = 1 LIMIT 1;
 
@@ -207,4 +291,26 @@ FROM conversations WHERE conversation_id = 1 LIMIT 1;
 
 INSERT INTO messages (conversation_id, sender_id, message_text)
 SELECT 1, (SELECT user_id FROM users WHERE user_id != 1 LIMIT 1), 'Hi, I am interested in your product. Is it still available?'
-FROM conversations WHERE conversation_id = 1 LIMIT 1;
\ No newline at end of file
+FROM conversations WHERE conversation_id = 1 LIMIT 1;
+
+-- seed the unread counters from the messages above
+UPDATE conversation_participants cp
+JOIN (
+    SELECT cp2.id, COUNT(*) AS unread
+    FROM conversation_participants cp2
+    JOIN messages m ON m.conversation_id = cp2.conversation_id
+        AND m.sender_id != cp2.user_id
+        AND (cp2.last_read_at IS NULL OR m.sent_at > cp2.last_read_at)
+    GROUP BY cp2.id
+) counts ON counts.id = cp.id
+SET cp.unread_count = counts.unread;
+
+-- seed the inbox summaries from the messages above
+INSERT INTO conversation_summaries
+    (conversation_id, last_message_id, last_message_text, last_message_time, message_count, first_image_url)
+SELECT c.conversation_id, lm.message_id, lm.message_text, lm.sent_at, counts.message_count,
+    (SELECT pi.image_url FROM product_images pi WHERE pi.product_id = c.product_id ORDER BY pi.image_id LIMIT 1)
+FROM conversations c
+JOIN (SELECT conversation_id, COUNT(*) AS message_count, MAX(message_id) AS last_id
+      FROM messages GROUP BY conversation_id) counts ON counts.conversation_id = c.conversation_id
+JOIN messages lm ON lm.message_id = counts.last_id;